@@ -11,6 +11,7 @@ __version__ = "0.1.0"
 
 from mongodog.reporters import BaseReporter, MemoryReporter, LoggingReporter
 from mongodog.sniffer import Sniffer
+from mongodog.testing import assert_max_queries
 
 __all__ = [
     "__author__",
@@ -19,4 +20,5 @@ __all__ = [
     "MemoryReporter",
     "LoggingReporter",
     "Sniffer",
+    "assert_max_queries",
 ]
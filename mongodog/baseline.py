@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Defines query shape baselines: the set of command shapes (with counts) that a
+test or scenario issues is recorded into a baseline file and later runs are
+compared against it.
+"""
+import json
+import os
+import threading
+
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+from mongodog.sniffer import Sniffer
+
+BASELINE_VERSION = 1
+
+# set this environment variable to rewrite baselines instead of comparing
+UPDATE_ENVIRON_KEY = 'MONGODOG_UPDATE_BASELINES'
+
+
+def format_call_site(call_site):
+    """Formats call site for the baseline (relative file and function, no
+    line numbers, so that unrelated edits do not change the baseline)"""
+    if call_site is None:
+        return 'unknown'
+    filename, _, name = call_site
+    try:
+        relative = os.path.relpath(filename)
+        if not relative.startswith(os.pardir):
+            filename = relative
+    except ValueError:
+        # different drive on windows
+        pass
+    return '%s:%s' % (filename.replace(os.sep, '/'), name)
+
+
+class ShapeRecorder(BaseReporter):
+    """Counts commands per shape and remembers their call sites. Commands
+    issued by pymongo within other sniffed calls (`nested`) are not
+    recorded, so baselines do not depend on pymongo internals."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shapes = {}
+
+    def report_mongo_command(self, command, traceback=None):
+        """Counts the command's shape"""
+        if command.get('nested'):
+            return
+        shape = mongodog.utils.get_command_shape(command)
+        call_site = format_call_site(mongodog.utils.get_call_site(traceback))
+        with self.lock:
+            entry = self.shapes.get(shape)
+            if entry is None:
+                entry = self.shapes[shape] = {'count': 0, 'call_sites': set()}
+            entry['count'] += 1
+            entry['call_sites'].add(call_site)
+
+    def baseline(self):
+        """Returns recorded shapes as baseline data"""
+        with self.lock:
+            return dict((shape, {'count': entry['count'],
+                                 'call_sites': sorted(entry['call_sites'])})
+                        for shape, entry in self.shapes.items())
+
+
+def save_baseline(path, shapes):
+    """Writes baseline data into the file (sorted, one field per line)"""
+    document = {'version': BASELINE_VERSION, 'shapes': shapes}
+    with open(path, 'w') as output:
+        json.dump(document, output, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        output.write('\n')
+
+
+def load_baseline(path):
+    """Reads baseline data from the file"""
+    with open(path) as baseline_file:
+        document = json.load(baseline_file)
+    if document.get('version') != BASELINE_VERSION:
+        raise ValueError("Unsupported baseline version in %s: %r" %
+                         (path, document.get('version')))
+    return document['shapes']
+
+
+class BaselineDiff(object):
+    """Differences between the baseline and the current run"""
+
+    def __init__(self, new, removed, increased):
+        self.new = new
+        self.removed = removed
+        self.increased = increased
+
+    @property
+    def regressed(self):
+        """True if there are new shapes or count increases"""
+        return bool(self.new or self.increased)
+
+    def format(self):
+        """Returns a human readable description of the differences"""
+        lines = []
+        for shape, entry in self.new:
+            lines.append('new: %s (%d) at %s' % (
+                shape, entry['count'], ', '.join(entry['call_sites'])))
+        for shape, before, after in self.increased:
+            lines.append('increased: %s (%d -> %d) at %s' % (
+                shape, before['count'], after['count'],
+                ', '.join(after['call_sites'])))
+        for shape, entry in self.removed:
+            lines.append('removed: %s (%d)' % (shape, entry['count']))
+        return '\n'.join(lines)
+
+
+def compare(baseline, current, tolerance=0.0):
+    """Compares current shapes to the baseline. Count increases are only
+    reported, when the count grows by more than `tolerance` (a fraction of
+    the baseline count)."""
+    new, removed, increased = [], [], []
+    for shape in sorted(current):
+        if shape not in baseline:
+            new.append((shape, current[shape]))
+        elif current[shape]['count'] > \
+                baseline[shape]['count'] * (1.0 + tolerance):
+            increased.append((shape, baseline[shape], current[shape]))
+    for shape in sorted(baseline):
+        if shape not in current:
+            removed.append((shape, baseline[shape]))
+    return BaselineDiff(new, removed, increased)
+
+
+class ShapeBaseline(object):
+    """Context manager, that records query shapes issued within it and
+    compares them to the baseline file. If the file does not exist (or
+    MONGODOG_UPDATE_BASELINES environment variable is set), it is written
+    instead. Fails with AssertionError on new shapes or count increases."""
+
+    def __init__(self, path, tolerance=0.0, update=None,
+                 sniffer_class=Sniffer):
+        self.path = path
+        self.tolerance = tolerance
+        if update is None:
+            update = bool(os.environ.get(UPDATE_ENVIRON_KEY))
+        self.update = update
+        self.sniffer_class = sniffer_class
+        self.recorder = None
+        self.sniffer = None
+        self.diff = None
+
+    def __enter__(self):
+        self.recorder = ShapeRecorder()
+        self.sniffer = self.sniffer_class(self.recorder)
+        self.sniffer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.sniffer.stop()
+        if exc_type is not None:
+            return
+        current = self.recorder.baseline()
+        if self.update or not os.path.exists(self.path):
+            save_baseline(self.path, current)
+            return
+        self.diff = compare(load_baseline(self.path), current,
+                            self.tolerance)
+        if self.diff.regressed:
+            raise AssertionError("Query shapes regressed against %s:\n%s" %
+                                 (self.path, self.diff.format()))
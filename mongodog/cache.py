@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the request-scoped read-through cache: within a request, repeated
+find_one, count, count_documents, estimated_document_count and distinct
+calls with the same arguments are answered from memory, until a write to the
+same collection goes through one of the patched write methods of the 2.x or
+CRUD API.
+"""
+import contextlib
+import copy
+import threading
+
+import mongodog.serialization
+import mongodog.utils
+from mongodog.sniffer import SkipCall, Sniffer
+
+CACHED_OPS = ('collection_find_one', 'collection_count',
+              'collection_count_documents',
+              'collection_estimated_document_count', 'collection_distinct')
+
+INVALIDATING_OPS = ('collection_insert', 'collection_update',
+                    'collection_remove', 'collection_save',
+                    'collection_find_and_modify', 'collection_bulk_write',
+                    'collection_delete_many', 'collection_delete_one',
+                    'collection_find_one_and_delete',
+                    'collection_find_one_and_replace',
+                    'collection_find_one_and_update',
+                    'collection_insert_many', 'collection_insert_one',
+                    'collection_replace_one', 'collection_update_many',
+                    'collection_update_one')
+
+UNKNOWN_CALL_SITE = ('<unknown>', 0, '<unknown>')
+
+
+def get_cache_key(command):
+    """Returns the key of the read command: op, db, collection and the rest
+    of its fields in normalized form"""
+    rest = dict((key, val) for key, val in command.items()
+                if key not in ('op', 'db', 'collection'))
+    return (command.get('op'), command.get('db'), command.get('collection'),
+            mongodog.serialization.dumps(rest, sort_keys=True))
+
+
+class CacheState(threading.local):
+    """Thread local cache of the current request"""
+
+    def __init__(self):
+        super(CacheState, self).__init__()
+        self.entries = None
+        self.miss = None
+
+
+class RequestCache(Sniffer):
+    """Sniffer, that answers repeated reads from the cache of the current
+    request (see `request`). Outside of requests calls are not touched.
+
+    Cached results are copied on the way in and out, so callers can modify
+    them. Writes, that do not go through the patched methods (e.g. database
+    commands or other processes), are not seen, so only use it, where reads
+    within one request may be served slightly stale data.
+
+    Usage::
+
+        cache = RequestCache()
+        cache.start()
+        with cache.request():
+            handle_request()
+        print(cache.hit_rates())
+    """
+
+    def __init__(self, reporter=None, with_traceback=True, ops=None,
+                 **kwargs):
+        """
+        :Parameters:
+        - `reporter`: reporter, that receives the calls, that were not
+        answered from the cache (optional)
+        - `with_traceback`: capture tracebacks to attribute hits and misses
+        to call sites
+        - `ops`: cached and invalidating ops to patch
+        Other keyword arguments are passed to the Sniffer.
+        """
+        self.state = CacheState()
+        if ops is None:
+            ops = [op for op in CACHED_OPS + INVALIDATING_OPS
+                   if op in set(entry[0] for entry in self.config)]
+        kwargs.setdefault('condition', self.in_request)
+        super(RequestCache, self).__init__(reporter, with_traceback,
+                                           ops=ops, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.call_sites = {}
+
+    def in_request(self):
+        """Returns True if a request is open in the current thread"""
+        return self.state.entries is not None
+
+    def open_request(self):
+        """Starts caching in the current thread"""
+        self.state.entries = {}
+
+    def close_request(self):
+        """Stops caching in the current thread and forgets cached results"""
+        self.state.entries = None
+        self.state.miss = None
+
+    @contextlib.contextmanager
+    def request(self):
+        """Context manager, that caches reads within it"""
+        self.open_request()
+        try:
+            yield self
+        finally:
+            self.close_request()
+
+    def count_lookup(self, hit, traceback):
+        """Counts the hit or miss for the call site"""
+        call_site = mongodog.utils.get_call_site(traceback)
+        if call_site is None:
+            call_site = UNKNOWN_CALL_SITE
+        with self.stats_lock:
+            counts = self.call_sites.get(call_site)
+            if counts is None:
+                counts = self.call_sites[call_site] = [0, 0]
+            counts[0 if hit else 1] += 1
+
+    def hit_rates(self):
+        """Returns {call site: (hits, misses, hit rate)}"""
+        with self.stats_lock:
+            return dict((call_site, (hits, misses,
+                                     float(hits) / (hits + misses)))
+                        for call_site, (hits, misses)
+                        in self.call_sites.items())
+
+    def report_command(self, command, immediate=False):
+        """Answers cached reads with SkipCall, remembers missed reads to be
+        cached once they return and invalidates the collection on writes"""
+        entries = self.state.entries
+        op = command.get('op')
+        if entries is not None and op in CACHED_OPS:
+            key = get_cache_key(command)
+            traceback = None
+            if self.with_traceback:
+                traceback = mongodog.utils.get_full_traceback()
+            if key in entries:
+                self.count_lookup(True, traceback)
+                raise SkipCall(copy.deepcopy(entries[key]))
+            self.count_lookup(False, traceback)
+            self.state.miss = key
+        elif entries is not None and op in INVALIDATING_OPS:
+            target = command.get('db'), command.get('collection')
+            for key in [key for key in entries if key[1:3] == target]:
+                del entries[key]
+        if self.reporter is not None:
+            super(RequestCache, self).report_command(command, immediate)
+
+    def callback_after(self, result, custom, *args, **kwargs):
+        """Caches the result of the read, that missed"""
+        key, self.state.miss = self.state.miss, None
+        if key is not None and self.state.entries is not None:
+            self.state.entries[key] = copy.deepcopy(result)
+        super(RequestCache, self).callback_after(result, custom, *args,
+                                                 **kwargs)
+
+    def callback_error(self, exc_info, custom, *args, **kwargs):
+        """Forgets the read, that failed"""
+        self.state.miss = None
+        super(RequestCache, self).callback_error(exc_info, custom, *args,
+                                                 **kwargs)
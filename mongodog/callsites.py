@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the call site reporter, that attributes the cost of sniffed commands
+to the innermost application frame (file, line, function), that issued them.
+"""
+import threading
+
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+
+UNKNOWN_CALL_SITE = ('<unknown>', 0, '<unknown>')
+
+COLUMNS = ('count', 'total', 'max', 'nreturned', 'nbytes', 'errors')
+
+
+class CallSiteStats(object):
+    """Cost of one call site"""
+
+    def __init__(self, count=0, total=0.0, max=0.0, nreturned=0, nbytes=0,
+                 errors=0):
+        self.count = count
+        self.total = total
+        self.max = max
+        self.nreturned = nreturned
+        self.nbytes = nbytes
+        self.errors = errors
+
+    def add(self, command):
+        """Adds the cost of the command (only its time and documents, if it
+        `continues` an earlier call)"""
+        duration = command.get('duration', 0.0)
+        self.total += duration
+        if not command.get('continues'):
+            self.count += 1
+            if duration > self.max:
+                self.max = duration
+        self.nreturned += command.get('nreturned', 0)
+        self.nbytes += command.get('nbytes', 0) + \
+            command.get('nbytes_sent', 0)
+        if 'error' in command:
+            self.errors += 1
+
+    def copy(self):
+        """Returns a copy of the stats"""
+        return CallSiteStats(**self.as_dict())
+
+    def as_dict(self):
+        """Returns the stats as a dict"""
+        return dict((column, getattr(self, column)) for column in COLUMNS)
+
+
+class CallSiteReporter(BaseReporter):
+    """Aggregates call count, total and max latency, returned documents and
+    bytes sent and returned (see Sniffer's `with_sizes`) per call site.
+    Commands issued within other sniffed calls (`nested`) are part of the
+    cost of the outer call and are not added (see
+    `mongodog.utils.is_included_in_outer_call`)."""
+
+    requires_timing = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def report_mongo_command(self, command, traceback=None):
+        """Adds the command's cost to its call site"""
+        if mongodog.utils.is_included_in_outer_call(command):
+            return
+        call_site = mongodog.utils.get_call_site(traceback)
+        if call_site is None:
+            call_site = UNKNOWN_CALL_SITE
+        with self.lock:
+            stats = self.stats.get(call_site)
+            if stats is None:
+                stats = self.stats[call_site] = CallSiteStats()
+            stats.add(command)
+
+    def snapshot(self):
+        """Returns a {call site: CallSiteStats} copy of current stats"""
+        with self.lock:
+            return dict((call_site, stats.copy())
+                        for call_site, stats in self.stats.items())
+
+    def reset(self):
+        """Forgets all collected stats"""
+        with self.lock:
+            self.stats = {}
+
+
+def diff_snapshots(before, after):
+    """Returns {call site: CallSiteStats} of the cost between two snapshots
+    (max latency is taken from the `after` snapshot). Call sites without
+    any new calls are left out."""
+    result = {}
+    for call_site, stats in after.items():
+        previous = before.get(call_site, CallSiteStats())
+        delta = CallSiteStats(
+            count=stats.count - previous.count,
+            total=stats.total - previous.total,
+            max=stats.max,
+            nreturned=stats.nreturned - previous.nreturned,
+            nbytes=stats.nbytes - previous.nbytes,
+            errors=stats.errors - previous.errors)
+        if delta.count:
+            result[call_site] = delta
+    return result
+
+
+def rank(snapshot, order_by='total', limit=None):
+    """Returns a list of (call site, CallSiteStats) tuples, most expensive
+    first"""
+    if order_by not in COLUMNS:
+        raise ValueError("Can not order by %s, expected one of: %s" %
+                         (order_by, ', '.join(COLUMNS)))
+    rows = sorted(snapshot.items(),
+                  key=lambda row: (-getattr(row[1], order_by), row[0]))
+    if limit is not None:
+        rows = rows[:limit]
+    return rows
+
+
+def format_table(rows):
+    """Formats ranked rows as a text table"""
+    lines = ['%8s %12s %12s %10s %12s %6s  %s' % (
+        'count', 'total (s)', 'max (s)', 'returned', 'bytes', 'errors',
+        'call site')]
+    for (filename, lineno, name), stats in rows:
+        lines.append('%8d %12.6f %12.6f %10d %12d %6d  %s:%d in %s' % (
+            stats.count, stats.total, stats.max, stats.nreturned,
+            stats.nbytes, stats.errors, filename, lineno, name))
+    return '\n'.join(lines)
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the workload capture: sniffed commands (with their start times) are
+written as MongoDB extended JSON records, that can later be read back and
+replayed against another server (see mongodog.replay).
+
+Two formats are supported: plain JSON lines (CaptureReporter) and block
+compressed files with an index (BlockCaptureReporter), where readers only
+decompress the blocks, that cover the requested time window or shapes.
+The block file layout is::
+
+    header: MAGIC, compression code (1 byte)
+    blocks: compressed length (4 bytes), compressed JSON lines
+    index: JSON document describing the blocks
+    footer: index offset (8 bytes), INDEX_MAGIC
+"""
+import json
+import struct
+import threading
+import zlib
+
+import bson.json_util
+
+import mongodog.serialization
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+
+try:
+    import lzma
+except ImportError:
+    # python2 has no lzma in the stdlib
+    lzma = None
+
+try:
+    STRING_TYPES = basestring
+except NameError:
+    # must be python3
+    STRING_TYPES = str, bytes
+
+MAGIC = b'MDOGCAP1'
+INDEX_MAGIC = b'MDOGIDX1'
+BLOCK_HEADER = struct.Struct('>I')
+FOOTER = struct.Struct('>Q')
+INDEX_VERSION = 1
+
+# compression name: (code, compress, decompress)
+COMPRESSIONS = {
+    'zlib': (b'z', zlib.compress, zlib.decompress),
+}
+if lzma is not None:
+    COMPRESSIONS['lzma'] = (b'x', lzma.compress, lzma.decompress)
+
+
+def get_compression(code):
+    """Returns the compression name for the code stored in the header"""
+    for name, (known_code, _, _) in COMPRESSIONS.items():
+        if known_code == code:
+            return name
+    raise ValueError("Unsupported capture compression: %r" % code)
+
+
+def create_record(command, shape=None):
+    """Returns the capture record (JSON line) of the command, with the ident
+    of the thread, that issued it (used by replay to recognize calls nested
+    within other calls), and the shape of the command (computed, unless
+    given). The shape is stored, because values, that are serialized as
+    strings, change the shape of the decoded record."""
+    if shape is None:
+        shape = mongodog.utils.get_command_shape(command)
+    record = dict(command, thread=threading.current_thread().ident,
+                  shape=shape)
+    return mongodog.serialization.dumps(record, sort_keys=True)
+
+
+def get_record_shape(command):
+    """Returns the shape of the command read from a capture record (stored
+    at capture time, computed for captures, that do not have it)"""
+    shape = command.get('shape')
+    if shape is None:
+        shape = mongodog.utils.get_command_shape(command)
+    return shape
+
+
+def parse_record(line):
+    """Returns the command from the capture record with BSON types
+    decoded"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    return bson.json_util.loads(line)
+
+
+def in_window(started, start=None, end=None):
+    """Returns True if started is within [start, end] (either may be
+    None)"""
+    if started is None:
+        return start is None and end is None
+    return (start is None or started >= start) and \
+        (end is None or started <= end)
+
+
+class CaptureReporter(BaseReporter):
+    """Writes every command as one line of MongoDB extended JSON"""
+
+    requires_timing = True
+
+    def __init__(self, output):
+        """
+        :Parameters:
+        - `output`: file name or a file-like object (opened in text mode)
+        """
+        self.owns_output = isinstance(output, STRING_TYPES)
+        if self.owns_output:
+            output = open(output, 'w')
+        self.output = output
+        self.lock = threading.Lock()
+
+    def report_mongo_command(self, command, traceback=None):
+        """Writes the command to the output"""
+        line = create_record(command)
+        with self.lock:
+            self.output.write(line + '\n')
+
+    def flush(self):
+        """Flushes the output"""
+        with self.lock:
+            self.output.flush()
+
+    def close(self):
+        """Flushes the output and closes it, if it was opened by the
+        reporter"""
+        with self.lock:
+            self.output.flush()
+            if self.owns_output:
+                self.output.close()
+
+
+class BlockCaptureReporter(BaseReporter):
+    """Writes commands in compressed blocks of `block_size` records. Call
+    `close` to write the last block and the index (files without the index
+    can still be read, but every block has to be decompressed)."""
+
+    requires_timing = True
+
+    def __init__(self, output, compression='zlib', block_size=1000):
+        """
+        :Parameters:
+        - `output`: file name or a file-like object (opened in binary mode)
+        - `compression`: 'zlib' or 'lzma' (if available)
+        - `block_size`: number of records per block
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unsupported capture compression: %s" %
+                             compression)
+        self.owns_output = isinstance(output, STRING_TYPES)
+        if self.owns_output:
+            output = open(output, 'wb')
+        self.output = output
+        self.compression = compression
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.blocks = []
+        self.records = 0
+        self.offset = 0
+        self.closed = False
+        self.reset_block()
+        code, _, _ = COMPRESSIONS[compression]
+        self.write(MAGIC + code)
+
+    def reset_block(self):
+        """Starts a new block (caller holds the lock)"""
+        self.lines = []
+        self.shapes = set()
+        self.start = None
+        self.end = None
+
+    def write(self, data):
+        """Writes data to the output (caller holds the lock)"""
+        self.output.write(data)
+        self.offset += len(data)
+
+    def report_mongo_command(self, command, traceback=None):
+        """Adds the command to the current block"""
+        shape = mongodog.utils.get_command_shape(command)
+        line = create_record(command, shape)
+        started = command.get('started')
+        with self.lock:
+            self.lines.append(line)
+            self.shapes.add(shape)
+            if started is not None:
+                if self.start is None or started < self.start:
+                    self.start = started
+                if self.end is None or started > self.end:
+                    self.end = started
+            if len(self.lines) >= self.block_size:
+                self.write_block()
+
+    def write_block(self):
+        """Compresses and writes the current block (caller holds the
+        lock)"""
+        if not self.lines:
+            return
+        _, compress, _ = COMPRESSIONS[self.compression]
+        data = compress('\n'.join(self.lines).encode('utf-8'))
+        self.blocks.append({
+            'offset': self.offset,
+            'length': len(data),
+            'first_record': self.records,
+            'count': len(self.lines),
+            'start': self.start,
+            'end': self.end,
+            'shapes': sorted(self.shapes),
+        })
+        self.records += len(self.lines)
+        self.write(BLOCK_HEADER.pack(len(data)) + data)
+        self.reset_block()
+
+    def flush(self):
+        """Writes the current (possibly incomplete) block"""
+        with self.lock:
+            self.write_block()
+            self.output.flush()
+
+    def close(self):
+        """Writes the last block, the index and the footer and closes the
+        output, if it was opened by the reporter"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.write_block()
+            index_offset = self.offset
+            index = {'version': INDEX_VERSION, 'blocks': self.blocks}
+            self.write(json.dumps(index, sort_keys=True).encode('utf-8'))
+            self.write(FOOTER.pack(index_offset) + INDEX_MAGIC)
+            self.output.flush()
+            if self.owns_output:
+                self.output.close()
+
+
+class BlockCaptureReader(object):
+    """Reads block compressed capture files"""
+
+    def __init__(self, source):
+        """
+        :Parameters:
+        - `source`: file name or a seekable file-like object (opened in
+        binary mode)
+        """
+        self.owns_source = isinstance(source, STRING_TYPES)
+        if self.owns_source:
+            source = open(source, 'rb')
+        self.source = source
+        header = source.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a block capture file")
+        self.compression = get_compression(header[len(MAGIC):])
+        self.blocks = self.read_index()
+
+    def read_index(self):
+        """Returns block descriptions from the index, or recovers them by
+        scanning all blocks, if the file was not closed properly"""
+        source = self.source
+        source.seek(0, 2)
+        size = source.tell()
+        footer_size = FOOTER.size + len(INDEX_MAGIC)
+        if size >= len(MAGIC) + 1 + footer_size:
+            source.seek(size - footer_size)
+            footer = source.read(footer_size)
+            if footer[FOOTER.size:] == INDEX_MAGIC:
+                index_offset, = FOOTER.unpack(footer[:FOOTER.size])
+                source.seek(index_offset)
+                data = source.read(size - footer_size - index_offset)
+                index = json.loads(data.decode('utf-8'))
+                if index.get('version') != INDEX_VERSION:
+                    raise ValueError("Unsupported capture index version: "
+                                     "%r" % index.get('version'))
+                return index['blocks']
+        return self.scan_blocks(size)
+
+    def scan_blocks(self, size):
+        """Returns block descriptions built by decompressing every complete
+        block"""
+        blocks = []
+        offset = len(MAGIC) + 1
+        records = 0
+        while offset + BLOCK_HEADER.size <= size:
+            self.source.seek(offset)
+            length, = BLOCK_HEADER.unpack(self.source.read(BLOCK_HEADER.size))
+            if offset + BLOCK_HEADER.size + length > size:
+                # truncated block
+                break
+            block = {'offset': offset, 'length': length,
+                     'first_record': records}
+            commands = list(self.read_block(block))
+            started = [command['started'] for command in commands
+                       if command.get('started') is not None]
+            block.update({
+                'count': len(commands),
+                'start': min(started) if started else None,
+                'end': max(started) if started else None,
+                'shapes': sorted(set(get_record_shape(command)
+                                     for command in commands)),
+            })
+            blocks.append(block)
+            records += len(commands)
+            offset += BLOCK_HEADER.size + length
+        return blocks
+
+    def read_block(self, block):
+        """Yields commands from the block"""
+        _, _, decompress = COMPRESSIONS[self.compression]
+        self.source.seek(block['offset'] + BLOCK_HEADER.size)
+        data = decompress(self.source.read(block['length']))
+        for line in data.split(b'\n'):
+            if line:
+                yield parse_record(line)
+
+    def matching_blocks(self, start=None, end=None, shapes=None):
+        """Returns descriptions of the blocks, that may contain commands
+        started within [start, end] with one of the shapes"""
+        result = []
+        for block in self.blocks:
+            if block['start'] is not None:
+                if end is not None and block['start'] > end:
+                    continue
+                if start is not None and block['end'] < start:
+                    continue
+            if shapes is not None and not shapes.intersection(
+                    block['shapes']):
+                continue
+            result.append(block)
+        return result
+
+    def read(self, start=None, end=None, shapes=None):
+        """Yields commands started within [start, end] (either may be None)
+        with one of the shapes (all shapes if None), decompressing only the
+        blocks, that may contain them"""
+        if shapes is not None:
+            shapes = set(shapes)
+        for block in self.matching_blocks(start, end, shapes):
+            for command in self.read_block(block):
+                if not in_window(command.get('started'), start, end):
+                    continue
+                if shapes is not None and \
+                        get_record_shape(command) not in shapes:
+                    continue
+                yield command
+
+    def close(self):
+        """Closes the source, if it was opened by the reader"""
+        if self.owns_source:
+            self.source.close()
+
+
+def is_block_capture(source):
+    """Returns True if the seekable file-like object contains a block
+    compressed capture (the position is not changed)"""
+    position = source.tell()
+    try:
+        return source.read(len(MAGIC)) == MAGIC
+    finally:
+        source.seek(position)
+
+
+def read_capture(source, start=None, end=None, shapes=None):
+    """Yields commands from the capture file (name or file-like object) of
+    either format with BSON types decoded, optionally only those started
+    within [start, end] and with one of the shapes"""
+    if isinstance(source, STRING_TYPES):
+        with open(source, 'rb') as capture:
+            for command in read_capture(capture, start, end, shapes):
+                yield command
+        return
+    if is_block_capture(source):
+        reader = BlockCaptureReader(source)
+        for command in reader.read(start, end, shapes):
+            yield command
+        return
+    if shapes is not None:
+        shapes = set(shapes)
+    for line in source:
+        line = line.strip()
+        if not line:
+            continue
+        command = parse_record(line)
+        if not in_window(command.get('started'), start, end):
+            continue
+        if shapes is not None and get_record_shape(command) not in shapes:
+            continue
+        yield command
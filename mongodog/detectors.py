@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Defines detectors, that look for performance anti-patterns in the stream of
+sniffed commands.
+"""
+import collections
+import logging
+import threading
+import time
+
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+
+# ops, that can be replaced by a batched insert or a bulk operation
+SINGLE_WRITE_OPS = ('collection_insert', 'collection_save',
+                    'collection_update', 'collection_insert_one',
+                    'collection_replace_one', 'collection_update_one')
+
+
+def is_single_document_write(command):
+    """Returns True if the command writes a single document"""
+    op = command.get('op')
+    if op not in SINGLE_WRITE_OPS:
+        return False
+    if op == 'collection_insert':
+        documents = command.get('doc_or_docs')
+        return not isinstance(documents, (list, tuple)) or \
+            len(documents) == 1
+    if op == 'collection_update':
+        return not command.get('multi')
+    return True
+
+
+class WriteRun(object):
+    """Consecutive single document writes from one stack"""
+
+    def __init__(self, command, call_site):
+        self.db = command.get('db')
+        self.collection = command.get('collection')
+        self.op = command.get('op')
+        self.call_site = call_site
+        self.length = 0
+        self.total = 0.0
+        self.last_end = None
+
+    def add(self, command, end):
+        """Adds the write to the run"""
+        self.length += 1
+        self.total += command.get('duration', 0.0)
+        self.last_end = end
+
+    def finding(self):
+        """Returns the finding describing the run"""
+        return {
+            'db': self.db,
+            'collection': self.collection,
+            'op': self.op,
+            'call_site': self.call_site,
+            'length': self.length,
+            'total_duration': self.total,
+            # a single batched call is assumed to cost one average call
+            'estimated_savings': self.total - self.total / self.length,
+        }
+
+
+class BulkWriteDetector(BaseReporter):
+    """Detects runs of single document writes to the same collection from the
+    same stack (e.g. insert/update/save called in a loop), where consecutive
+    writes are no more than `window` seconds apart.
+
+    Runs of at least `min_run` writes are passed to `callback` (or logged as
+    warnings) once they end: when a later write shows that the window has
+    passed, when the background thread finds them idle for longer than the
+    window (so that the last loop of a request or a job is reported too),
+    or on `flush`/`close`. State is kept per thread and limited to
+    `max_runs` open runs and `max_findings` remembered findings.
+
+    Open runs are kept in the order they were last extended, which is the
+    order of their `last_end` up to concurrent calls finishing out of
+    order, so ended runs are only looked for at the front."""
+
+    requires_timing = True
+
+    def __init__(self, window=0.1, min_run=5, callback=None,
+                 logger='mongodog.detectors', max_runs=1000,
+                 max_findings=100, interval=1.0, clock=time.time,
+                 background=True):
+        """
+        :Parameters:
+        - `window`: maximum gap in seconds between writes of a run
+        - `min_run`: minimum number of writes of a reported run
+        - `callback`: function receiving the findings (instead of logging)
+        - `logger`: logging.Logger or logger name to warn to
+        - `max_runs`: maximum number of open runs, the oldest are ended
+        - `max_findings`: number of findings kept in `findings`
+        - `interval`: seconds between checks of the background thread
+        - `clock`: function returning the current unix time
+        - `background`: start the background thread, that ends idle runs
+        (otherwise `flush` has to be called to report the last runs)
+        """
+        self.window = window
+        self.min_run = min_run
+        self.callback = callback
+        if not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.max_runs = max_runs
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.runs = collections.OrderedDict()
+        self.findings = collections.deque(maxlen=max_findings)
+        self.stopped = threading.Event()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run,
+                                           name='mongodog-bulk-writes')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def expire(self, now):
+        """Removes and returns the runs, that can no longer be extended at
+        `now` (caller holds the lock)"""
+        finished = []
+        while self.runs:
+            run = next(iter(self.runs.values()))
+            if now - run.last_end <= self.window:
+                break
+            finished.append(self.runs.popitem(last=False)[1])
+        return finished
+
+    def report_mongo_command(self, command, traceback=None):
+        """Adds single document writes to their runs"""
+        if not is_single_document_write(command):
+            return
+        started = command.get('started', 0.0)
+        end = started + command.get('duration', 0.0)
+        stack = tuple((filename, lineno) for _, filename, lineno, _
+                      in mongodog.utils.iter_traceback_frames(traceback))
+        key = (threading.current_thread().ident, command.get('db'),
+               command.get('collection'), command.get('op'), stack)
+
+        with self.lock:
+            finished = self.expire(started)
+            run = self.runs.pop(key, None)
+            if run is None:
+                run = WriteRun(command,
+                               mongodog.utils.get_call_site(traceback))
+            run.add(command, end)
+            self.runs[key] = run
+            while len(self.runs) > self.max_runs:
+                finished.append(self.runs.popitem(last=False)[1])
+
+        for run in finished:
+            self.finish(run)
+
+    def finish(self, run):
+        """Reports the run, if it is long enough"""
+        if run.length < self.min_run:
+            return
+        finding = run.finding()
+        self.findings.append(finding)
+        if self.callback is not None:
+            self.callback(finding)
+            return
+        where = '%s:%d in %s' % run.call_site if run.call_site else 'unknown'
+        self.logger.warning(
+            "mongodog: %d single document %s calls on %s.%s from %s took "
+            "%.3f ms, a bulk operation could save about %.3f ms",
+            finding['length'], finding['op'], finding['db'],
+            finding['collection'], where, finding['total_duration'] * 1000,
+            finding['estimated_savings'] * 1000,
+            extra={'mongodog': finding})
+
+    def run(self):
+        """Background thread, that ends idle runs until closed"""
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                finished = self.expire(self.clock())
+            for run in finished:
+                self.finish(run)
+
+    def flush(self):
+        """Ends all open runs"""
+        with self.lock:
+            runs = list(self.runs.values())
+            self.runs.clear()
+        for run in runs:
+            self.finish(run)
+
+    def close(self):
+        """Stops the background thread and ends all open runs"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the flame graph reporter, that aggregates call stacks of sniffed
+commands into folded stacks (`frame;frame;frame count`), and an offline SVG
+flame graph renderer.
+"""
+import sys
+import threading
+import zlib
+from xml.sax.saxutils import escape as xml_escape
+
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+
+WEIGHT_COUNT = 'count'
+WEIGHT_DURATION = 'duration'
+
+
+def format_frame(module, name):
+    """Returns folded stack frame label"""
+    return ('%s:%s' % (module, name)).replace(';', ':').replace(' ', '_')
+
+
+def fold_stack(command, traceback):
+    """Returns the folded stack of the command: application frames (outermost
+    first) followed by the op and collection of the command"""
+    frames = [format_frame(module, name)
+              for module, _, _, name
+              in mongodog.utils.iter_traceback_frames(traceback)
+              if not mongodog.utils.is_library_module(module)]
+    leaf = '%s_%s.%s' % (command.get('op'), command.get('db'),
+                         command.get('collection'))
+    frames.append(leaf.replace(';', ':').replace(' ', '_'))
+    return ';'.join(frames)
+
+
+class FlameGraphReporter(BaseReporter):
+    """Aggregates call stacks of commands, weighted either by call count or
+    by total mongo time (in microseconds). Commands issued within other
+    sniffed calls (`nested`) are part of the outer call and are not added,
+    fetches of cursors, that continue an earlier call (`continues`), only
+    add their time."""
+
+    def __init__(self, weight=WEIGHT_COUNT):
+        if weight not in (WEIGHT_COUNT, WEIGHT_DURATION):
+            raise ValueError("FlameGraphReporter weight must be either '%s' "
+                             "or '%s'" % (WEIGHT_COUNT, WEIGHT_DURATION))
+        self.weight = weight
+        self.requires_timing = weight == WEIGHT_DURATION
+        self.lock = threading.Lock()
+        self.stacks = {}
+
+    def report_mongo_command(self, command, traceback=None):
+        """Adds the command's weight to its stack"""
+        if mongodog.utils.is_included_in_outer_call(command):
+            return
+        if self.weight == WEIGHT_COUNT:
+            if command.get('continues'):
+                return
+            value = 1
+        else:
+            value = int(round(command.get('duration', 0) * 1000000))
+        stack = fold_stack(command, traceback)
+        with self.lock:
+            self.stacks[stack] = self.stacks.get(stack, 0) + value
+
+    def folded(self):
+        """Returns the folded stacks as a list of lines"""
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+        return ['%s %d' % item for item in stacks]
+
+    def write_folded(self, path):
+        """Writes the folded stacks into the file (input for flamegraph.pl,
+        speedscope, etc.)"""
+        with open(path, 'w') as output:
+            for line in self.folded():
+                output.write(line + '\n')
+
+    def render_svg(self, **kwargs):
+        """Returns SVG flame graph of the collected stacks (see render_svg
+        function for the arguments)"""
+        if self.weight == WEIGHT_DURATION:
+            kwargs.setdefault('unit', 'us')
+        with self.lock:
+            stacks = dict(self.stacks)
+        return render_svg(stacks, **kwargs)
+
+
+def parse_folded(lines):
+    """Parses folded stack lines into a {stack: weight} dict"""
+    stacks = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        stack, _, value = line.rpartition(' ')
+        stacks[stack] = stacks.get(stack, 0) + int(value)
+    return stacks
+
+
+class FrameNode(object):
+    """Node of the stack tree"""
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self.children = {}
+
+    def add(self, frames, value):
+        """Adds the stack (list of frames below this node)"""
+        self.value += value
+        if frames:
+            child = self.children.get(frames[0])
+            if child is None:
+                child = self.children[frames[0]] = FrameNode(frames[0])
+            child.add(frames[1:], value)
+
+    def depth(self):
+        """Returns depth of the tree below this node"""
+        if not self.children:
+            return 0
+        return 1 + max(child.depth() for child in self.children.values())
+
+
+def frame_color(name):
+    """Returns a deterministic warm color for the frame"""
+    hashed = zlib.crc32(name.encode('utf-8')) & 0xffffffff
+    return 'rgb(%d,%d,%d)' % (205 + hashed % 50, 80 + (hashed >> 8) % 150,
+                              (hashed >> 16) % 60)
+
+
+def render_svg(stacks, width=1200, frame_height=16, title='mongodog',
+               unit='calls'):
+    """Renders a {folded stack: weight} dict into an SVG flame graph.
+
+    :Returns:
+    SVG document as a string.
+    """
+    root = FrameNode('all')
+    for stack, value in sorted(stacks.items()):
+        root.add(stack.split(';'), value)
+
+    header = frame_height * 2
+    height = (root.depth() + 1) * frame_height + header
+    elements = []
+
+    def draw(node, x_offset, depth):
+        """Draws the node and its children"""
+        if not root.value:
+            return
+        node_width = float(width) * node.value / root.value
+        if node_width < 0.1:
+            return
+        y_offset = height - (depth + 1) * frame_height
+        label = '%s (%d %s, %.2f%%)' % (node.name, node.value, unit,
+                                         100.0 * node.value / root.value)
+        elements.append(
+            '<g><title>%s</title><rect x="%.1f" y="%d" width="%.1f" '
+            'height="%d" fill="%s" rx="2"/>' % (
+                xml_escape(label), x_offset, y_offset, node_width,
+                frame_height - 1, frame_color(node.name)))
+        # about 7px per character at font-size 12
+        chars = int(node_width / 7)
+        if chars > 3:
+            text = node.name
+            if len(text) > chars:
+                text = text[:chars - 2] + '..'
+            elements.append('<text x="%.1f" y="%d">%s</text>' % (
+                x_offset + 3, y_offset + frame_height - 4, xml_escape(text)))
+        elements.append('</g>')
+        for name in sorted(node.children):
+            child = node.children[name]
+            draw(child, x_offset, depth + 1)
+            x_offset += float(width) * child.value / root.value
+
+    draw(root, 0.0, 0)
+    return '\n'.join([
+        '<?xml version="1.0" standalone="no"?>',
+        '<svg version="1.1" width="%d" height="%d" '
+        'xmlns="http://www.w3.org/2000/svg" font-family="Verdana" '
+        'font-size="12">' % (width, height),
+        '<rect x="0" y="0" width="%d" height="%d" fill="#f8f8f8"/>' % (
+            width, height),
+        '<text x="%d" y="%d" text-anchor="middle" font-size="16">%s</text>'
+        % (width // 2, frame_height + 4, xml_escape(title)),
+    ] + elements + ['</svg>', ''])
+
+
+def main(argv=None):
+    """Renders folded stacks file into SVG flame graph:
+    python -m mongodog.flamegraph stacks.folded > flamegraph.svg"""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.stderr.write("usage: python -m mongodog.flamegraph "
+                         "<folded stacks file>\n")
+        return 2
+    with open(argv[0]) as folded:
+        stacks = parse_folded(folded)
+    sys.stdout.write(render_svg(stacks, title=argv[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the fault injector, that adds latency or raises errors before
+pymongo calls, to test how the application behaves when the database slows
+down or fails.
+"""
+import importlib
+import math
+import random
+import threading
+import time
+
+import mongodog.rules
+import mongodog.utils
+from mongodog.sniffer import Sniffer
+
+try:
+    STRING_TYPES = basestring
+except NameError:
+    # must be python3
+    STRING_TYPES = str, bytes
+
+
+def import_error_class(path):
+    """Returns the exception class from its dotted path, e.g.
+    'pymongo.errors.AutoReconnect'"""
+    module, _, name = path.rpartition('.')
+    return getattr(importlib.import_module(module), name)
+
+
+def exponential(mean):
+    """Returns a latency distribution with exponentially distributed delays
+    of the given mean"""
+    return lambda: random.expovariate(1.0 / mean)
+
+
+def lognormal(median, sigma=0.5):
+    """Returns a latency distribution with log-normally distributed delays
+    (long tail) of the given median"""
+    mu = math.log(median)
+    return lambda: random.lognormvariate(mu, sigma)
+
+
+class Fault(object):
+    """Latency and/or error injected into matching calls.
+
+    Every condition, that is not None, has to match:
+    - `op`, `db`, `collection`: a name or a collection of names
+    - `shape`: a command shape or a collection of them (see
+    mongodog.utils.get_command_shape)
+
+    The injected delay is `latency` (seconds or a function returning
+    seconds, e.g. `exponential(0.05)`) plus uniformly distributed `jitter`.
+    After the delay `error` (an exception class, instance or a function
+    returning one) is raised, so the call is not made at all. Faults apply
+    to `probability` fraction of matching calls."""
+
+    def __init__(self, op=None, db=None, collection=None, shape=None,
+                 latency=0.0, jitter=0.0, error=None, probability=1.0):
+        self.ops = mongodog.rules.as_name_set(op)
+        self.dbs = mongodog.rules.as_name_set(db)
+        self.collections = mongodog.rules.as_name_set(collection)
+        self.shapes = mongodog.rules.as_name_set(shape)
+        self.latency = latency
+        self.jitter = jitter
+        self.error = error
+        self.probability = probability
+        self.injected = 0
+
+    @classmethod
+    def from_dict(cls, spec):
+        """Returns a Fault from a JSON compatible dict (`error` is a dotted
+        path of an exception class)"""
+        spec = dict(spec)
+        if isinstance(spec.get('error'), STRING_TYPES):
+            spec['error'] = import_error_class(spec['error'])
+        return cls(**spec)
+
+    def matches(self, command):
+        """Returns True if the fault applies to the command"""
+        return ((self.ops is None or command.get('op') in self.ops) and
+                (self.dbs is None or command.get('db') in self.dbs) and
+                (self.collections is None or
+                 command.get('collection') in self.collections) and
+                (self.shapes is None or
+                 mongodog.utils.get_command_shape(command) in self.shapes))
+
+    def delay(self):
+        """Returns the delay in seconds for one call"""
+        latency = self.latency() if callable(self.latency) else self.latency
+        if self.jitter:
+            latency += random.uniform(0, self.jitter)
+        return max(latency, 0.0)
+
+    def exception(self):
+        """Returns the exception to raise (None if there is none)"""
+        error = self.error
+        if error is None or isinstance(error, BaseException):
+            return error
+        # exception class or a factory function
+        return error()
+
+
+class FaultInjector(Sniffer):
+    """Sniffer, that injects the first matching fault into calls. Faults can
+    be added, removed or replaced and injection paused at any time, from any
+    thread.
+
+    Start it before any reporting sniffers, so that they measure the
+    injected latency as part of the call.
+
+    Usage::
+
+        injector = FaultInjector([Fault(collection='users', latency=0.2)])
+        injector.start()
+        ...
+        injector.set_faults([{'op': 'collection_insert',
+                              'error': 'pymongo.errors.AutoReconnect',
+                              'probability': 0.1}])
+    """
+
+    def __init__(self, faults=(), reporter=None, with_traceback=False,
+                 sleep=time.sleep, random=random.random, **kwargs):
+        """
+        :Parameters:
+        - `faults`: Fault objects
+        - `reporter`: reporter, that receives the calls (optional)
+        - `with_traceback`: pass tracebacks to the reporter
+        - `sleep`: function used to delay calls
+        - `random`: function returning a random float in [0, 1)
+        Other keyword arguments are passed to the Sniffer.
+        """
+        super(FaultInjector, self).__init__(reporter, with_traceback,
+                                            **kwargs)
+        self.faults_lock = threading.Lock()
+        self.faults = tuple(faults)
+        self.enabled = True
+        self.sleep = sleep
+        self.random = random
+
+    def add_fault(self, fault):
+        """Adds the fault (after the existing ones) and returns it"""
+        with self.faults_lock:
+            self.faults = self.faults + (fault,)
+        return fault
+
+    def remove_fault(self, fault):
+        """Removes the fault"""
+        with self.faults_lock:
+            self.faults = tuple(existing for existing in self.faults
+                                if existing is not fault)
+
+    def set_faults(self, faults):
+        """Replaces all faults with Fault objects or dicts (see
+        `Fault.from_dict`)"""
+        faults = tuple(fault if isinstance(fault, Fault)
+                       else Fault.from_dict(fault) for fault in faults)
+        with self.faults_lock:
+            self.faults = faults
+
+    def pause(self):
+        """Stops injecting faults (calls are still sniffed)"""
+        self.enabled = False
+
+    def resume(self):
+        """Starts injecting faults again"""
+        self.enabled = True
+
+    def report_command(self, command, immediate=False):
+        """Delays the call and/or raises the error of the first matching
+        fault"""
+        if self.enabled and not immediate:
+            for fault in self.faults:
+                if not fault.matches(command):
+                    continue
+                if fault.probability >= 1.0 or \
+                        self.random() < fault.probability:
+                    self.inject(fault)
+                break
+        if self.reporter is not None:
+            super(FaultInjector, self).report_command(command, immediate)
+
+    def inject(self, fault):
+        """Delays the current call and raises the fault's error"""
+        fault.injected += 1
+        delay = fault.delay()
+        if delay > 0:
+            self.sleep(delay)
+        error = fault.exception()
+        if error is not None:
+            raise error
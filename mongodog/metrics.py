@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the metrics reporter, that keeps counters and latency histograms of
+sniffed commands and exposes them in Prometheus text format.
+"""
+import bisect
+import os
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    # must be python2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """Fixed bucket histogram"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Adds the value to the histogram"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Returns a list of (upper bound, cumulative count) tuples, the last
+        upper bound is float('inf')"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def escape_label(value):
+    """Escapes label value for Prometheus text format"""
+    if value is None:
+        return ''
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def format_bound(bound):
+    """Formats histogram bucket upper bound"""
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(float(bound))
+
+
+class CommandMetrics(object):
+    """Counters and latency histogram of one (db, collection, op)"""
+
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(buckets)
+
+
+class MetricsReporter(BaseReporter):
+    """Counts commands and keeps latency histograms per (db, collection,
+    op). Does not keep any data of individual commands. Commands issued
+    within other sniffed calls (`nested`) are part of the outer call and
+    are not counted. Fetches of cursors, that continue an earlier call
+    (`continues`), are observed in the latency histogram of their op, but
+    are not counted as calls."""
+
+    requires_timing = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='mongodog'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def report_mongo_command(self, command, traceback=None):
+        """Updates counters and histogram of the command"""
+        if mongodog.utils.is_included_in_outer_call(command):
+            return
+        key = command.get('db'), command.get('collection'), command.get('op')
+        duration = command.get('duration')
+        with self.lock:
+            metrics = self.metrics.get(key)
+            if metrics is None:
+                metrics = self.metrics[key] = CommandMetrics(self.buckets)
+            if not command.get('continues'):
+                metrics.calls += 1
+            if 'error' in command:
+                metrics.errors += 1
+            if duration is not None:
+                metrics.latency.observe(duration)
+
+    def snapshot(self):
+        """Returns a sorted list of (key, calls, errors, cumulative buckets,
+        sum, count) tuples"""
+        with self.lock:
+            rows = [(key, metrics.calls, metrics.errors,
+                     metrics.latency.cumulative(), metrics.latency.sum,
+                     metrics.latency.count)
+                    for key, metrics in self.metrics.items()]
+        return sorted(rows, key=lambda row: tuple(escape_label(value)
+                                                  for value in row[0]))
+
+    def render(self):
+        """Returns metrics in Prometheus text exposition format"""
+        prefix = self.prefix
+        calls, errors, latency = [], [], []
+        for key, ncalls, nerrors, buckets, total, count in self.snapshot():
+            labels = 'db="%s",collection="%s",op="%s"' % tuple(
+                escape_label(value) for value in key)
+            calls.append('%s_commands_total{%s} %d' % (prefix, labels,
+                                                       ncalls))
+            errors.append('%s_command_errors_total{%s} %d' % (prefix, labels,
+                                                              nerrors))
+            for bound, cumulative in buckets:
+                latency.append('%s_command_duration_seconds_bucket{%s,le="%s"}'
+                               ' %d' % (prefix, labels, format_bound(bound),
+                                        cumulative))
+            latency.append('%s_command_duration_seconds_sum{%s} %r' % (
+                prefix, labels, total))
+            latency.append('%s_command_duration_seconds_count{%s} %d' % (
+                prefix, labels, count))
+
+        lines = [
+            '# HELP %s_commands_total Sniffed mongo commands.' % prefix,
+            '# TYPE %s_commands_total counter' % prefix,
+        ] + calls + [
+            '# HELP %s_command_errors_total Sniffed mongo commands, that '
+            'raised an error.' % prefix,
+            '# TYPE %s_command_errors_total counter' % prefix,
+        ] + errors + [
+            '# HELP %s_command_duration_seconds Duration of sniffed mongo '
+            'commands.' % prefix,
+            '# TYPE %s_command_duration_seconds histogram' % prefix,
+        ] + latency
+        return '\n'.join(lines) + '\n'
+
+    def write_to_file(self, path):
+        """Writes metrics to the file atomically (for node exporter's
+        textfile collector or a sidecar to pick up)"""
+        temporary_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary_path, 'w') as output:
+            output.write(self.render())
+        getattr(os, 'replace', os.rename)(temporary_path, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Starts serving metrics over HTTP in a background thread.
+
+        :Returns:
+        The HTTP server, call its `shutdown` method to stop it. The actual
+        port is in `server_port` attribute (useful if `port` was 0).
+        """
+        reporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            """Responds to every GET with the metrics"""
+
+            def do_GET(self):
+                """Handles GET request"""
+                body = reporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                """Does not log requests"""
+                pass
+
+        server = HTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever,
+                                  name='mongodog-metrics')
+        thread.daemon = True
+        thread.start()
+        return server
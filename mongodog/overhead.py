@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Defines mongodog's self-instrumentation: time spent in the stages of
+sniffing (callbacks, traceback capture, copying, size computation and the
+reporter), allocations made by mongodog (with tracemalloc) and a periodic
+self-report of both.
+"""
+import logging
+import os
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    # python2 has no tracemalloc
+    tracemalloc = None
+
+# stages of a sniffed call, `callback_before` includes `traceback`,
+# `deepcopy` and `sizes` and, when timing is disabled, also `reporter`,
+# `callback_after` includes the callbacks of calls, that raised
+STAGES = ('callback_before', 'callback_after', 'traceback', 'deepcopy',
+          'sizes', 'reporter')
+
+MONGODOG_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class OverheadStats(object):
+    """Count, total and max time per stage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        """Adds time spent in the stage"""
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+    def snapshot(self, reset=False):
+        """Returns {stage: {'count', 'total', 'max', 'mean'}} and optionally
+        starts counting from zero"""
+        with self.lock:
+            stages = self.stages
+            if reset:
+                self.stages = {}
+            else:
+                stages = dict((stage, list(entry))
+                              for stage, entry in stages.items())
+        return dict((stage, {'count': count, 'total': total, 'max': maximum,
+                             'mean': total / count if count else 0.0})
+                    for stage, (count, total, maximum) in stages.items())
+
+
+class AllocationTracker(object):
+    """Measures memory allocated by mongodog's own modules with
+    tracemalloc"""
+
+    def __init__(self, frames=1, top=10):
+        """
+        :Parameters:
+        - `frames`: number of frames tracemalloc stores per allocation
+        - `top`: number of biggest allocation sites to report
+        """
+        if tracemalloc is None:
+            raise RuntimeError("Allocation tracking requires tracemalloc")
+        self.frames = frames
+        self.top = top
+        self.started_tracing = False
+
+    def start(self):
+        """Starts tracemalloc, unless it is already tracing"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started_tracing = True
+
+    def stop(self):
+        """Stops tracemalloc, if it was started by the tracker"""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def snapshot(self):
+        """Returns {'size', 'count', 'top'} of memory currently allocated by
+        mongodog modules, `top` is a list of (file:line, size, count)"""
+        if not tracemalloc.is_tracing():
+            return {'size': 0, 'count': 0, 'top': []}
+        pattern = os.path.join(MONGODOG_DIRECTORY, '*')
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(True, pattern)])
+        statistics = snapshot.statistics('lineno')
+        top = [('%s:%d' % (stat.traceback[0].filename,
+                           stat.traceback[0].lineno), stat.size, stat.count)
+               for stat in statistics[:self.top]]
+        return {'size': sum(stat.size for stat in statistics),
+                'count': sum(stat.count for stat in statistics),
+                'top': top}
+
+
+def format_stats(stats):
+    """Returns a one line summary of Sniffer.stats()"""
+    parts = []
+    for stage in STAGES:
+        entry = stats['stages'].get(stage)
+        if entry:
+            parts.append('%s %d x %.1f us (max %.1f us)' % (
+                stage, entry['count'], entry['mean'] * 1000000,
+                entry['max'] * 1000000))
+    allocations = stats.get('allocations')
+    if allocations is not None:
+        parts.append('allocated %d bytes in %d blocks' % (
+            allocations['size'], allocations['count']))
+    return ', '.join(parts) or 'no calls'
+
+
+class SelfReport(object):
+    """Logs the sniffer's stats every `interval` seconds on a background
+    thread (stats are reset after every report)"""
+
+    def __init__(self, sniffer, interval=60.0, logger='mongodog.overhead',
+                 level=logging.INFO):
+        self.sniffer = sniffer
+        self.interval = interval
+        if not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.level = level
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def report(self):
+        """Logs the stats now"""
+        stats = self.sniffer.stats(reset=True)
+        self.logger.log(self.level, "mongodog overhead: %s",
+                        format_stats(stats), extra={'mongodog': stats})
+
+    def run(self):
+        """Background thread, that reports until stopped"""
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def start(self):
+        """Starts the background thread"""
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run,
+                                       name='mongodog-self-report')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background thread"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
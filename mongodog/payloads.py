@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the payload size reporter, that keeps histograms of encoded BSON
+sizes of sniffed commands per shape and per call site, and the largest
+payloads seen. Requires a Sniffer with `with_sizes` enabled.
+"""
+import heapq
+import itertools
+import threading
+
+import mongodog.utils
+from mongodog.metrics import Histogram
+from mongodog.reporters import BaseReporter
+
+# payload size buckets in bytes (256B .. 16MB, the maximum document size)
+DEFAULT_BUCKETS = tuple(256 * 4 ** i for i in range(9))
+
+
+def get_payload_size(command):
+    """Returns bytes sent plus bytes returned by the command, or None if its
+    size was not computed (not sampled)"""
+    if 'nbytes' not in command and 'nbytes_sent' not in command:
+        return None
+    return command.get('nbytes', 0) + command.get('nbytes_sent', 0)
+
+
+class PayloadSizeReporter(BaseReporter):
+    """Keeps payload size histograms per command shape and per call site,
+    and the `top` largest payloads"""
+
+    requires_timing = True
+
+    def __init__(self, top=20, buckets=DEFAULT_BUCKETS):
+        self.top = top
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.by_shape = {}
+        self.by_call_site = {}
+        self.largest = []
+        self.counter = itertools.count()
+
+    def histogram(self, histograms, key):
+        """Returns the histogram for the key (caller holds the lock)"""
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def report_mongo_command(self, command, traceback=None):
+        """Adds the command's payload size to the histograms"""
+        size = get_payload_size(command)
+        if size is None:
+            return
+        shape = mongodog.utils.get_command_shape(command)
+        call_site = mongodog.utils.get_call_site(traceback)
+        with self.lock:
+            self.histogram(self.by_shape, shape).observe(size)
+            self.histogram(self.by_call_site, call_site).observe(size)
+            if len(self.largest) < self.top or size > self.largest[0][0]:
+                entry = size, next(self.counter), {
+                    'size': size,
+                    'shape': shape,
+                    'call_site': call_site,
+                    'nbytes': command.get('nbytes', 0),
+                    'nbytes_sent': command.get('nbytes_sent', 0),
+                }
+                if len(self.largest) < self.top:
+                    heapq.heappush(self.largest, entry)
+                else:
+                    heapq.heapreplace(self.largest, entry)
+
+    def largest_payloads(self):
+        """Returns a list of the largest payloads, largest first"""
+        with self.lock:
+            return [entry[2] for entry in sorted(self.largest, reverse=True)]
+
+    def summary(self, histograms):
+        """Returns a list of (key, count, total bytes, cumulative buckets)
+        tuples, largest total first"""
+        with self.lock:
+            rows = [(key, histogram.count, histogram.sum,
+                     histogram.cumulative())
+                    for key, histogram in histograms.items()]
+        return sorted(rows, key=lambda row: -row[2])
+
+    def shapes(self):
+        """Returns size summary per shape (see `summary`)"""
+        return self.summary(self.by_shape)
+
+    def call_sites(self):
+        """Returns size summary per call site (see `summary`)"""
+        return self.summary(self.by_call_site)
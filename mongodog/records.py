@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the compact record format of sniffed commands: db, collection and op
+names are interned into integer codes of a per-session dictionary, field
+names are replaced by a schema code and values are stored positionally.
+
+Reporters opt in by setting `accepts_compact = True`, the Sniffer then
+passes them CompactRecord objects instead of dicts (see `decode` for the
+dict form).
+"""
+import threading
+
+from mongodog.reporters import BaseReporter
+
+# fields, that are stored as interned codes instead of values
+NAME_FIELDS = ('op', 'db', 'collection')
+
+
+class CompactRecord(object):
+    """Sniffed command in compact form"""
+
+    __slots__ = ('dictionary', 'op', 'db', 'collection', 'schema', 'values')
+
+    def __init__(self, dictionary, op, db, collection, schema, values):
+        self.dictionary = dictionary
+        self.op = op
+        self.db = db
+        self.collection = collection
+        self.schema = schema
+        self.values = values
+
+    def as_tuple(self):
+        """Returns the record as a (op, db, collection, schema, values) tuple
+        of codes and values"""
+        return self.op, self.db, self.collection, self.schema, self.values
+
+    def decode(self):
+        """Returns the command dict"""
+        return self.dictionary.decode(self)
+
+
+class RecordDictionary(object):
+    """Per-session dictionary of interned strings and schemas"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.codes = {}
+        self.strings = []
+        self.schema_codes = {}
+        self.schemas = []
+
+    def intern(self, string):
+        """Returns the code of the string (None for None)"""
+        if string is None:
+            return None
+        try:
+            return self.codes[string]
+        except KeyError:
+            pass
+        with self.lock:
+            code = self.codes.get(string)
+            if code is None:
+                code = self.codes[string] = len(self.strings)
+                self.strings.append(string)
+            return code
+
+    def schema(self, fields):
+        """Returns the code of the schema (a tuple of field names)"""
+        try:
+            return self.schema_codes[fields]
+        except KeyError:
+            pass
+        with self.lock:
+            code = self.schema_codes.get(fields)
+            if code is None:
+                code = self.schema_codes[fields] = len(self.schemas)
+                self.schemas.append(fields)
+            return code
+
+    def encode(self, command):
+        """Returns the CompactRecord of the command dict"""
+        fields = tuple(sorted(key for key in command
+                              if key not in NAME_FIELDS))
+        return CompactRecord(self, self.intern(command.get('op')),
+                             self.intern(command.get('db')),
+                             self.intern(command.get('collection')),
+                             self.schema(fields),
+                             tuple(command[field] for field in fields))
+
+    def decode(self, record):
+        """Returns the command dict of the CompactRecord"""
+        command = dict(zip(self.schemas[record.schema], record.values))
+        for field in NAME_FIELDS:
+            code = getattr(record, field)
+            if code is not None:
+                command[field] = self.strings[code]
+        return command
+
+    def snapshot(self):
+        """Returns the dictionary as {'strings': [...], 'schemas': [...]},
+        suitable for storing along with record tuples"""
+        with self.lock:
+            return {'strings': list(self.strings),
+                    'schemas': [list(fields) for fields in self.schemas]}
+
+
+def decode(record):
+    """Returns the command dict of the record (commands, that are already
+    dicts, are returned as they are)"""
+    if isinstance(record, CompactRecord):
+        return record.decode()
+    return record
+
+
+class CompactMemoryReporter(BaseReporter):
+    """Collects compact records of all commands in a list"""
+
+    accepts_compact = True
+
+    def __init__(self):
+        self.reported_records = []
+
+    def report_mongo_command(self, command, traceback=None):
+        """Adds the record to `self.reported_records`"""
+        self.reported_records.append((command, traceback))
+
+    @property
+    def reported_commands(self):
+        """List of (command dict, traceback) tuples, like MemoryReporter"""
+        return [(decode(record), traceback)
+                for record, traceback in self.reported_records]
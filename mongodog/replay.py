@@ -0,0 +1,545 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the replay load generator, that re-issues captured commands (see
+mongodog.capture, both capture formats are detected automatically) against
+a target server and measures their latency:
+
+    python -m mongodog.replay capture.jsonl --uri mongodb://localhost:27017
+"""
+import argparse
+import math
+import multiprocessing
+import sys
+import threading
+import time
+
+import mongodog.capture
+import mongodog.utils
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def as_pairs(sort):
+    """Returns the captured sort specification as a list of tuples"""
+    if isinstance(sort, dict):
+        return list(sort.items())
+    return [tuple(pair) for pair in sort]
+
+
+def replay_database_command(database, command):
+    """Replays a database command"""
+    return database.command(command['command'], command.get('value', 1),
+                            check=command.get('check', True))
+
+
+def replay_collection_aggregate(collection, command):
+    """Replays a collection aggregate call"""
+    result = collection.aggregate(command['pipeline'])
+    if isinstance(result, dict):
+        return result
+    return list(result)
+
+
+def get_filter(command):
+    """Returns the captured query filter (pymongo 3.x `filter` or 2.x
+    `spec` or `spec_or_id`), None if the command has none"""
+    for field in ('filter', 'spec', 'spec_or_id'):
+        spec = command.get(field)
+        if spec is not None:
+            return spec
+    return None
+
+
+def get_projection(command):
+    """Returns the captured projection (pymongo 3.x `projection` or 2.x
+    `fields`), None if the command has none"""
+    fields = command.get('projection')
+    if fields is None:
+        fields = command.get('fields')
+    return fields
+
+
+def replay_collection_count(collection, command):
+    """Replays a collection count call"""
+    spec = get_filter(command)
+    if spec is None:
+        return collection.count()
+    return collection.count(spec)
+
+
+def replay_collection_distinct(collection, command):
+    """Replays a collection distinct call"""
+    spec = get_filter(command)
+    if spec is None:
+        return collection.distinct(command['key'])
+    return collection.distinct(command['key'], spec)
+
+
+def replay_collection_find(collection, command):
+    """Replays a collection find call and fetches all documents"""
+    cursor = collection.find(get_filter(command), get_projection(command),
+                             skip=command.get('skip') or 0,
+                             limit=command.get('limit') or 0)
+    if command.get('sort'):
+        cursor = cursor.sort(as_pairs(command['sort']))
+    return list(cursor)
+
+
+def replay_collection_find_and_modify(collection, command):
+    """Replays a collection find_and_modify call"""
+    kwargs = dict((key, command[key]) for key in ('new', 'remove', 'fields')
+                  if key in command)
+    sort = command.get('sort')
+    return collection.find_and_modify(
+        command.get('query') or {}, command.get('update'),
+        upsert=command.get('upsert', False),
+        sort=as_pairs(sort) if sort else None, **kwargs)
+
+
+def replay_collection_find_one(collection, command):
+    """Replays a collection find_one call"""
+    return collection.find_one(get_filter(command), get_projection(command))
+
+
+def replay_collection_group(collection, command):
+    """Replays a collection group call"""
+    return collection.group(command['key'], command['condition'],
+                            command['initial'], command['reduce'],
+                            command.get('finalize'))
+
+
+def replay_collection_inline_map_reduce(collection, command):
+    """Replays a collection inline_map_reduce call"""
+    return collection.inline_map_reduce(command['map'], command['reduce'])
+
+
+def replay_collection_insert(collection, command):
+    """Replays a collection insert call"""
+    return collection.insert(
+        command['doc_or_docs'],
+        continue_on_error=command.get('continue_on_error', False))
+
+
+def replay_collection_map_reduce(collection, command):
+    """Replays a collection map_reduce call"""
+    return collection.map_reduce(command['map'], command['reduce'],
+                                 command['out'])
+
+
+def replay_collection_remove(collection, command):
+    """Replays a collection remove call"""
+    return collection.remove(command.get('spec_or_id'))
+
+
+def replay_collection_save(collection, command):
+    """Replays a collection save call"""
+    return collection.save(command['to_save'])
+
+
+def replay_collection_update(collection, command):
+    """Replays a collection update call"""
+    return collection.update(command['spec'], command['document'],
+                             upsert=command.get('upsert', False),
+                             multi=command.get('multi', False))
+
+
+def replay_collection_bulk_write(collection, command):
+    """Replays a collection bulk_write call"""
+    import pymongo.operations
+    requests = []
+    for request in command['requests']:
+        fields = dict(request)
+        operation = getattr(pymongo.operations, fields.pop('type'))
+        if 'document' in fields:
+            fields[BULK_DOCUMENT_ARGUMENTS[operation.__name__]] = \
+                fields.pop('document')
+        requests.append(operation(**fields))
+    return collection.bulk_write(requests,
+                                 ordered=command.get('ordered', True))
+
+
+def replay_collection_count_documents(collection, command):
+    """Replays a collection count_documents call"""
+    return collection.count_documents(command.get('filter') or {})
+
+
+def replay_collection_delete_many(collection, command):
+    """Replays a collection delete_many call"""
+    return collection.delete_many(command['filter'])
+
+
+def replay_collection_delete_one(collection, command):
+    """Replays a collection delete_one call"""
+    return collection.delete_one(command['filter'])
+
+
+def replay_collection_estimated_document_count(collection, _command):
+    """Replays a collection estimated_document_count call"""
+    return collection.estimated_document_count()
+
+
+def replay_collection_find_one_and_delete(collection, command):
+    """Replays a collection find_one_and_delete call"""
+    sort = command.get('sort')
+    return collection.find_one_and_delete(
+        command['filter'], command.get('projection'),
+        sort=as_pairs(sort) if sort else None)
+
+
+def replay_collection_find_one_and_replace(collection, command):
+    """Replays a collection find_one_and_replace call"""
+    sort = command.get('sort')
+    return collection.find_one_and_replace(
+        command['filter'], command['replacement'], command.get('projection'),
+        sort=as_pairs(sort) if sort else None,
+        upsert=command.get('upsert', False),
+        return_document=command.get('return_document', False))
+
+
+def replay_collection_find_one_and_update(collection, command):
+    """Replays a collection find_one_and_update call"""
+    sort = command.get('sort')
+    return collection.find_one_and_update(
+        command['filter'], command['update'], command.get('projection'),
+        sort=as_pairs(sort) if sort else None,
+        upsert=command.get('upsert', False),
+        return_document=command.get('return_document', False))
+
+
+def replay_collection_insert_many(collection, command):
+    """Replays a collection insert_many call"""
+    return collection.insert_many(command['documents'],
+                                  ordered=command.get('ordered', True))
+
+
+def replay_collection_insert_one(collection, command):
+    """Replays a collection insert_one call"""
+    return collection.insert_one(command['document'])
+
+
+def replay_collection_replace_one(collection, command):
+    """Replays a collection replace_one call"""
+    return collection.replace_one(command['filter'], command['replacement'],
+                                  upsert=command.get('upsert', False))
+
+
+def replay_collection_update_many(collection, command):
+    """Replays a collection update_many call"""
+    return collection.update_many(command['filter'], command['update'],
+                                  upsert=command.get('upsert', False))
+
+
+def replay_collection_update_one(collection, command):
+    """Replays a collection update_one call"""
+    return collection.update_one(command['filter'], command['update'],
+                                 upsert=command.get('upsert', False))
+
+
+# constructor arguments of the bulk_write requests, that the captured
+# `document` field is passed as
+BULK_DOCUMENT_ARGUMENTS = {
+    'InsertOne': 'document',
+    'ReplaceOne': 'replacement',
+    'UpdateOne': 'update',
+    'UpdateMany': 'update',
+}
+
+# cursor ops are not replayed, their query is replayed by the find, that
+# created the cursor
+REPLAYERS = {
+    'database_command': replay_database_command,
+    'collection_aggregate': replay_collection_aggregate,
+    'collection_count': replay_collection_count,
+    'collection_distinct': replay_collection_distinct,
+    'collection_find': replay_collection_find,
+    'collection_find_and_modify': replay_collection_find_and_modify,
+    'collection_find_one': replay_collection_find_one,
+    'collection_group': replay_collection_group,
+    'collection_inline_map_reduce': replay_collection_inline_map_reduce,
+    'collection_insert': replay_collection_insert,
+    'collection_map_reduce': replay_collection_map_reduce,
+    'collection_remove': replay_collection_remove,
+    'collection_save': replay_collection_save,
+    'collection_update': replay_collection_update,
+    'collection_bulk_write': replay_collection_bulk_write,
+    'collection_count_documents': replay_collection_count_documents,
+    'collection_delete_many': replay_collection_delete_many,
+    'collection_delete_one': replay_collection_delete_one,
+    'collection_estimated_document_count':
+        replay_collection_estimated_document_count,
+    'collection_find_one_and_delete': replay_collection_find_one_and_delete,
+    'collection_find_one_and_replace': replay_collection_find_one_and_replace,
+    'collection_find_one_and_update': replay_collection_find_one_and_update,
+    'collection_insert_many': replay_collection_insert_many,
+    'collection_insert_one': replay_collection_insert_one,
+    'collection_replace_one': replay_collection_replace_one,
+    'collection_update_many': replay_collection_update_many,
+    'collection_update_one': replay_collection_update_one,
+}
+
+
+def replay_command(client, command):
+    """Issues the command through the client"""
+    database = client[command['db']]
+    replayer = REPLAYERS[command['op']]
+    if command['op'].startswith('database_'):
+        return replayer(database, command)
+    return replayer(database[command['collection']], command)
+
+
+def drop_nested(commands):
+    """Returns commands without the ones, that were issued by pymongo itself
+    while running another sniffed call on the same thread (e.g. the database
+    command behind a count), as those are replayed by the outer call.
+    Commands marked `nested` by the sniffer are always dropped, the rest
+    by thread and time containment: commands are expected to be sorted by
+    start time; captures without thread information are not checked."""
+    commands = [command for command in commands if not command.get('nested')]
+    if not all('thread' in command for command in commands):
+        return commands
+    ends = {}
+    result = []
+    for command in commands:
+        started = command.get('started', 0.0)
+        if started < ends.get(command['thread'], started):
+            continue
+        ends[command['thread']] = started + command.get('duration', 0.0)
+        result.append(command)
+    return result
+
+
+def select_commands(commands, shapes=None, ops=None):
+    """Returns the replayable commands sorted by start time, optionally only
+    those with one of the `shapes` (see mongodog.capture.get_record_shape)
+    or `ops`. Returns (commands, number of skipped commands)."""
+    commands = sorted(commands, key=lambda command: (
+        command.get('started', 0.0), -command.get('duration', 0.0)))
+    total = len(commands)
+    commands = [command for command in drop_nested(commands)
+                if command.get('op') in REPLAYERS]
+    if ops is not None:
+        commands = [command for command in commands if command['op'] in ops]
+    if shapes is not None:
+        shapes = set(shapes)
+        commands = [command for command in commands
+                    if mongodog.capture.get_record_shape(command) in shapes]
+    return commands, total - len(commands)
+
+
+def schedule(commands, speed=1.0):
+    """Returns (offset in seconds, command) pairs, where offset is the time
+    since the first command divided by `speed` (or 0 for all commands, when
+    speed is None or 0, i.e. as fast as possible)"""
+    if not commands:
+        return []
+    first = commands[0].get('started', 0.0)
+    return [((command.get('started', first) - first) / speed
+             if speed else 0.0, command) for command in commands]
+
+
+def replay_scheduled(client, scheduled, start):
+    """Issues scheduled commands in order, waiting for each command's
+    offset from the `start` time. Returns a list of (op, latency, failed)
+    tuples."""
+    results = []
+    for offset, command in scheduled:
+        delay = start + offset - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        failed = False
+        started = mongodog.utils.timer()
+        try:
+            replay_command(client, command)
+        except Exception:
+            failed = True
+        results.append((command['op'], mongodog.utils.timer() - started,
+                        failed))
+    return results
+
+
+def create_client(uri):
+    """Returns a new pymongo client connected to the uri"""
+    import pymongo
+    return pymongo.MongoClient(uri)
+
+
+def replay_partition(arguments):
+    """Replays one partition in a worker process with its own client"""
+    uri, scheduled, start = arguments
+    client = create_client(uri)
+    try:
+        return replay_scheduled(client, scheduled, start)
+    finally:
+        client.close()
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of sorted values (None if there
+    are no values)"""
+    if not values:
+        return None
+    # tolerance for float error (0.99 * 100 is slightly above 99)
+    rank = int(math.ceil(fraction * len(values) - 1e-9)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def format_latency(seconds):
+    """Returns the latency in milliseconds, '-' if it is not known"""
+    if seconds is None:
+        return '-'
+    return '%.3f' % (seconds * 1000)
+
+
+class ReplayResult(object):
+    """Latencies and errors of a replay"""
+
+    def __init__(self, results, elapsed, skipped=0):
+        self.elapsed = elapsed
+        self.skipped = skipped
+        self.latencies = {}
+        self.errors = {}
+        for op, latency, failed in results:
+            self.latencies.setdefault(op, []).append(latency)
+            if failed:
+                self.errors[op] = self.errors.get(op, 0) + 1
+        for latencies in self.latencies.values():
+            latencies.sort()
+
+    @property
+    def count(self):
+        """Number of replayed commands"""
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    @property
+    def throughput(self):
+        """Replayed commands per second"""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.count / self.elapsed
+
+    def percentile(self, fraction, op=None):
+        """Returns latency percentile of the op (or all ops)"""
+        if op is not None:
+            return percentile(self.latencies.get(op, []), fraction)
+        return percentile(sorted(latency
+                                 for latencies in self.latencies.values()
+                                 for latency in latencies), fraction)
+
+    def format(self):
+        """Returns a human readable summary of the replay"""
+        lines = ['replayed %d commands in %.3f s (%.1f/s), %d errors, '
+                 '%d skipped' % (self.count, self.elapsed, self.throughput,
+                                 sum(self.errors.values()), self.skipped),
+                 '%-32s %8s %8s %10s %10s %10s' % (
+                     'op', 'count', 'errors', 'p50 (ms)', 'p90 (ms)',
+                     'p99 (ms)')]
+        ops = sorted(self.latencies)
+        if self.count:
+            ops.append(None)
+        for op in ops:
+            count = len(self.latencies[op]) if op else self.count
+            errors = self.errors.get(op, 0) if op \
+                else sum(self.errors.values())
+            lines.append('%-32s %8d %8d %10s %10s %10s' % ((
+                op or 'all', count, errors) + tuple(
+                    format_latency(self.percentile(fraction, op))
+                    for fraction in PERCENTILES)))
+        return '\n'.join(lines)
+
+
+def replay(commands, client=None, uri=None, concurrency=1, processes=False,
+           speed=1.0, shapes=None, ops=None):
+    """Replays the captured commands and returns a ReplayResult.
+
+    :Parameters:
+    - `commands`: captured commands (see mongodog.capture.read_capture)
+    - `client`: pymongo client to use (threads only)
+    - `uri`: mongodb uri to connect to, when client is not given
+    - `concurrency`: number of workers, commands are distributed between
+    them round-robin, each worker issues its commands in capture order
+    - `processes`: use worker processes (each with its own client
+    connected to `uri`) instead of threads
+    - `speed`: time scaling factor (2.0 replays twice as fast as captured,
+    None or 0 replays as fast as possible)
+    - `shapes`: replay only commands with one of these shapes
+    - `ops`: replay only these ops
+    """
+    if processes and uri is None:
+        raise ValueError("Replay in processes requires uri")
+    if client is None and uri is None:
+        raise ValueError("Replay requires either client or uri")
+    commands, skipped = select_commands(commands, shapes, ops)
+    scheduled = schedule(commands, speed)
+    partitions = [scheduled[worker::concurrency]
+                  for worker in range(concurrency)]
+    start = time.time()
+    if processes:
+        pool = multiprocessing.Pool(concurrency)
+        try:
+            results = pool.map(replay_partition, [
+                (uri, partition, start) for partition in partitions])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        owns_client = client is None
+        if owns_client:
+            client = create_client(uri)
+        results = [[] for _ in partitions]
+
+        def worker(index):
+            """Replays one partition into results"""
+            results[index] = replay_scheduled(client, partitions[index],
+                                              start)
+
+        threads = [threading.Thread(target=worker, args=(index,))
+                   for index in range(concurrency)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if owns_client:
+                client.close()
+    elapsed = time.time() - start
+    return ReplayResult([result for partition in results
+                         for result in partition], elapsed, skipped)
+
+
+def main(argv=None):
+    """Replays a capture file against a server and prints the summary"""
+    parser = argparse.ArgumentParser(prog='python -m mongodog.replay')
+    parser.add_argument('capture', help='capture file')
+    parser.add_argument('--uri', default='mongodb://localhost:27017',
+                        help='target server (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='number of workers (default: %(default)s)')
+    parser.add_argument('--processes', action='store_true',
+                        help='use worker processes instead of threads')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time scaling factor, 0 replays as fast as '
+                             'possible (default: %(default)s)')
+    parser.add_argument('--shape', action='append', dest='shapes',
+                        help='replay only commands with this shape')
+    parser.add_argument('--op', action='append', dest='ops',
+                        help='replay only this op')
+    parser.add_argument('--start', type=float,
+                        help='replay only commands started at or after this '
+                             'unix time')
+    parser.add_argument('--end', type=float,
+                        help='replay only commands started at or before '
+                             'this unix time')
+    args = parser.parse_args(argv)
+    # block compressed captures only decompress the matching blocks
+    commands = list(mongodog.capture.read_capture(
+        args.capture, args.start, args.end, args.shapes))
+    result = replay(commands, uri=args.uri, concurrency=args.concurrency,
+                    processes=args.processes, speed=args.speed,
+                    shapes=args.shapes, ops=args.ops)
+    sys.stdout.write(result.format() + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,10 +2,14 @@
 """
 Defines mongodog reporters.
 """
-import json
 import logging
+import threading
+import time
 import traceback as python_traceback
 
+import mongodog.serialization
+import mongodog.utils
+
 
 class BaseReporter(object):
     """Abstract reporter interface"""
@@ -58,11 +62,149 @@ class LoggingReporter(BaseReporter):
         exc_info = None
         if traceback is not None:
             exc_info = self.exc_class, self.exc_class(), traceback
-        command_json = json.dumps(command)
+        command_json = mongodog.serialization.dumps(command)
         log_message = "mongodog: %s" % command_json
         self.logger.info(log_message, exc_info=exc_info)
 
 
+class EventSummary(object):
+    """Count and latency summary of suppressed commands"""
+
+    def __init__(self):
+        self.count = 0
+        self.timed = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, duration=None):
+        """Adds one occurrence of the command"""
+        self.count += 1
+        if duration is None:
+            return
+        self.timed += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+
+    def __str__(self):
+        if not self.timed:
+            return "count=%d" % self.count
+        return "count=%d total=%.6f min=%.6f avg=%.6f max=%.6f" % (
+            self.count, self.total, self.min, self.total / self.timed,
+            self.max)
+
+
+class DeduplicatingLoggingReporter(LoggingReporter):
+    """Reports the calls to configured logger, but collapses identical
+    (command shape, call site) commands within a time window.
+
+    The first occurrence of a command in the window is logged as-is (if the
+    token bucket of its call site allows it), the rest are counted and
+    logged as a single summary line, when the window is flushed.
+
+    Windows are flushed by the next command reported after the window
+    passed and, so that the counts of the last window are not lost when
+    commands stop coming, by a background thread. Call `close` to stop it
+    and flush what is left (e.g. at exit)."""
+
+    requires_timing = True
+
+    def __init__(self, logger_or_name, window=60.0, rate=1.0, burst=10,
+                 clock=time.time, background=True):
+        """
+        :Parameters:
+        - `logger_or_name`: a logging.Logger object or a logger name
+        - `window`: seconds, after which suppressed commands are flushed
+        - `rate`: full log lines per second allowed for each call site
+        - `burst`: token bucket size for each call site
+        - `clock`: function returning current time in seconds
+        - `background`: start the background thread, that flushes windows
+        without new commands (otherwise `flush` has to be called)
+        """
+        super(DeduplicatingLoggingReporter, self).__init__(logger_or_name)
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.suppressed = {}
+        self.buckets = {}
+        self.last_flush = clock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run,
+                                           name='mongodog-dedup-flush')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        """Background thread, that flushes passed windows until closed"""
+        while not self.stopped.wait(self.window):
+            with self.lock:
+                flush = self.clock() - self.last_flush >= self.window
+            if flush:
+                self.flush()
+
+    def close(self):
+        """Stops the background thread and flushes suppressed commands"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def take_token(self, call_site, now):
+        """Takes a token from the call site's bucket, returns False if the
+        bucket is empty"""
+        tokens, last = self.buckets.get(call_site, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[call_site] = tokens, now
+        return allowed
+
+    def report_mongo_command(self, command, traceback=None):
+        """Logs the command, unless it was already seen in this window or its
+        call site is over the rate limit"""
+        call_site = mongodog.utils.get_call_site(traceback)
+        key = mongodog.utils.get_command_shape(command), call_site
+        now = self.clock()
+        with self.lock:
+            summary = self.suppressed.get(key)
+            emit = summary is None and self.take_token(call_site, now)
+            if summary is None:
+                summary = self.suppressed[key] = EventSummary()
+            if not emit:
+                summary.add(command.get('duration'))
+            flush = now - self.last_flush >= self.window
+
+        if emit:
+            super(DeduplicatingLoggingReporter, self).report_mongo_command(
+                command, traceback)
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Logs a summary line for every suppressed (shape, call site) and
+        starts a new window"""
+        with self.lock:
+            suppressed, self.suppressed = self.suppressed, {}
+            self.last_flush = self.clock()
+
+        for (shape, call_site), summary in sorted(suppressed.items(),
+                                                  key=lambda item: item[0][0]):
+            if not summary.count:
+                continue
+            where = "%s:%d in %s" % call_site if call_site else "unknown"
+            self.logger.info("mongodog: suppressed %s at %s (%s)",
+                             shape, where, summary)
+
+
 class MongoReporter(BaseReporter):
     """Reports the calls into the configured mongo collection (does not
     report it's own calls)"""
@@ -90,13 +232,7 @@ class MongoReporter(BaseReporter):
             if isinstance(val, types):
                 document[key] = val
             else:
-                try:
-                    document[key] = json.dumps(val)
-                except TypeError:
-                    # json raises TypeError, when trying to serialize
-                    # something has no support for
-                    document[key] = repr(val)
-                    # ir repr fails - we give up and let the app crash
+                document[key] = mongodog.serialization.dumps(val)
 
         document['_traceback'] = python_traceback.format_tb(traceback)
 
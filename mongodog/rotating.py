@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the rotating file reporter, that buffers capture records in memory
+and writes them on a background thread into segment files, rotated by size
+and age, with a cap on total disk use. Segments are JSON lines captures (see
+mongodog.capture.read_capture).
+"""
+import glob
+import os
+import threading
+import time
+
+import mongodog.capture
+from mongodog.reporters import BaseReporter
+
+MEGABYTE = 1024 * 1024
+
+
+class RotatingFileReporter(BaseReporter):
+    """Writes commands into rotating segment files without blocking the
+    reporting threads on disk I/O.
+
+    Records are serialized on the reporting thread and appended to an
+    in-memory buffer, which is written by the background thread every
+    `flush_interval` seconds or as soon as it holds `flush_bytes`. When the
+    buffer reaches `max_buffer_bytes` (the disk can not keep up), new records
+    are dropped and counted in `dropped`."""
+
+    requires_timing = True
+
+    def __init__(self, directory, prefix='mongodog',
+                 max_segment_bytes=64 * MEGABYTE, max_segment_age=3600.0,
+                 max_total_bytes=1024 * MEGABYTE, flush_bytes=64 * 1024,
+                 flush_interval=1.0, max_buffer_bytes=16 * MEGABYTE,
+                 clock=time.time, background=True):
+        """
+        :Parameters:
+        - `directory`: directory for segment files (created if missing)
+        - `prefix`: segment file name prefix
+        - `max_segment_bytes`: segment size, that triggers rotation
+        - `max_segment_age`: segment age in seconds, that triggers rotation
+        - `max_total_bytes`: oldest segments are deleted, when all segments
+        take more space
+        - `flush_bytes`: buffered size, that triggers a write
+        - `flush_interval`: maximum time in seconds between writes
+        - `max_buffer_bytes`: buffered size, at which records are dropped
+        - `clock`: function returning current time
+        - `background`: start the background thread (otherwise `flush` has
+        to be called)
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.max_total_bytes = max_total_bytes
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_buffer_bytes = max_buffer_bytes
+        self.clock = clock
+        # lock guards the buffer, io_lock guards the segment
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+        self.buffer = []
+        self.buffered = 0
+        self.dropped = 0
+        self.segment = None
+        self.segment_path = None
+        self.segment_bytes = 0
+        self.segment_started = None
+        self.sequence = 0
+        self.closed = False
+        self.wakeup = threading.Event()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run,
+                                           name='mongodog-rotating-writer')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def report_mongo_command(self, command, traceback=None):
+        """Buffers the command's capture record"""
+        line = mongodog.capture.create_record(command) + '\n'
+        size = len(line)
+        with self.lock:
+            if self.closed or self.buffered + size > self.max_buffer_bytes:
+                self.dropped += 1
+                return
+            self.buffer.append(line)
+            self.buffered += size
+            full = self.buffered >= self.flush_bytes
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        """Background thread, that writes the buffer until closed"""
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes buffered records to the current segment (rotating it when
+        needed) and enforces the retention cap"""
+        with self.lock:
+            lines, self.buffer, self.buffered = self.buffer, [], 0
+        with self.io_lock:
+            if self.segment is not None and self.should_rotate():
+                self.close_segment()
+            if not lines:
+                return
+            if self.segment is None:
+                self.open_segment()
+            data = ''.join(lines)
+            self.segment.write(data)
+            self.segment.flush()
+            self.segment_bytes += len(data)
+            if self.should_rotate():
+                self.close_segment()
+            self.enforce_retention()
+
+    def should_rotate(self):
+        """Returns True if the current segment is too big or too old (caller
+        holds io_lock)"""
+        return self.segment_bytes >= self.max_segment_bytes or \
+            self.clock() - self.segment_started >= self.max_segment_age
+
+    def open_segment(self):
+        """Opens a new segment file (caller holds io_lock)"""
+        self.segment_started = self.clock()
+        stamp = time.strftime('%Y%m%d-%H%M%S',
+                              time.gmtime(self.segment_started))
+        self.sequence += 1
+        self.segment_path = os.path.join(self.directory, '%s-%s-%06d.jsonl' % (
+            self.prefix, stamp, self.sequence))
+        self.segment = open(self.segment_path, 'w')
+        self.segment_bytes = 0
+
+    def close_segment(self):
+        """Closes the current segment file (caller holds io_lock)"""
+        self.segment.close()
+        self.segment = None
+        self.segment_path = None
+
+    def segments(self):
+        """Returns paths of all segment files, oldest first"""
+        pattern = os.path.join(self.directory, '%s-*.jsonl' % self.prefix)
+        return sorted(glob.glob(pattern))
+
+    def enforce_retention(self):
+        """Deletes the oldest segments (never the current one), while all
+        segments take more than max_total_bytes (caller holds io_lock)"""
+        segments = [(path, os.path.getsize(path)) for path in self.segments()]
+        total = sum(size for _, size in segments)
+        for path, size in segments:
+            if total <= self.max_total_bytes:
+                break
+            if path == self.segment_path:
+                continue
+            os.remove(path)
+            total -= size
+
+    def close(self):
+        """Stops the background thread, writes the rest of the buffer and
+        closes the current segment"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        with self.io_lock:
+            if self.segment is not None:
+                self.close_segment()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Defines include/exclude rules, used by Sniffer to decide which calls are
+reported.
+"""
+import mongodog.utils
+
+INCLUDE = 'include'
+EXCLUDE = 'exclude'
+
+
+def as_name_set(names):
+    """Returns None (any name) or a frozenset of names"""
+    if names is None:
+        return None
+    if isinstance(names, (list, tuple, set, frozenset)):
+        return frozenset(names)
+    return frozenset([names])
+
+
+class Rule(object):
+    """A single include or exclude rule.
+
+    Every condition, that is not None, has to match for the rule to match:
+    - `op`, `db`, `collection`: a name or a collection of names
+    - `module`: a module name prefix (or a collection of them), that the
+    calling code (innermost application frame) must be in
+    - `predicate`: a function, that accepts the command dict and returns True
+    if the rule matches (e.g. to check the spec)
+    """
+
+    def __init__(self, action, op=None, db=None, collection=None,
+                 module=None, predicate=None):
+        if action not in (INCLUDE, EXCLUDE):
+            raise ValueError("Rule action must be either '%s' or '%s'" %
+                             (INCLUDE, EXCLUDE))
+        self.include = action == INCLUDE
+        self.ops = as_name_set(op)
+        self.dbs = as_name_set(db)
+        self.collections = as_name_set(collection)
+        self.modules = None
+        if module is not None:
+            self.modules = tuple(as_name_set(module))
+        self.predicate = predicate
+
+    @property
+    def deferred(self):
+        """True if the rule can not be decided by op, db and collection
+        alone"""
+        return self.modules is not None or self.predicate is not None
+
+    def matches_target(self, op, db, collection):
+        """Returns True if op, db and collection conditions match"""
+        return ((self.ops is None or op in self.ops) and
+                (self.dbs is None or db in self.dbs) and
+                (self.collections is None or collection in self.collections))
+
+    def matches_details(self, module, command):
+        """Returns True if module and predicate conditions match"""
+        if self.modules is not None:
+            if module is None:
+                return False
+            if not [prefix for prefix in self.modules
+                    if module == prefix or module.startswith(prefix + '.')]:
+                return False
+        return self.predicate is None or bool(self.predicate(command))
+
+
+def include(**kwargs):
+    """Returns an include Rule (see Rule for the arguments)"""
+    return Rule(INCLUDE, **kwargs)
+
+
+def exclude(**kwargs):
+    """Returns an exclude Rule (see Rule for the arguments)"""
+    return Rule(EXCLUDE, **kwargs)
+
+
+class RuleSet(object):
+    """An ordered list of rules, the first matching rule decides. If no rule
+    matches, `default` action is used.
+
+    Rules are compiled into a table keyed by (op, db, collection). Table
+    entries are either True/False (decided), or a tuple of rules, that need
+    the call site module or the command to be decided."""
+
+    def __init__(self, rules, default=INCLUDE):
+        if default not in (INCLUDE, EXCLUDE):
+            raise ValueError("RuleSet default must be either '%s' or '%s'" %
+                             (INCLUDE, EXCLUDE))
+        self.rules = list(rules)
+        self.default = default == INCLUDE
+        self.table = {}
+
+    def compile(self, op, db, collection):
+        """Returns the table entry for the op, db and collection"""
+        remaining = []
+        for rule in self.rules:
+            if not rule.matches_target(op, db, collection):
+                continue
+            if not rule.deferred and not remaining:
+                return rule.include
+            remaining.append(rule)
+            if not rule.deferred:
+                # rules after this one can never be reached
+                break
+        if not remaining:
+            return self.default
+        return tuple(remaining)
+
+    def lookup(self, op, db, collection):
+        """Returns the (cached) table entry for the op, db and collection"""
+        key = op, db, collection
+        try:
+            return self.table[key]
+        except KeyError:
+            entry = self.table[key] = self.compile(op, db, collection)
+            return entry
+
+    def decide(self, entry, command):
+        """Decides a deferred table entry for the command"""
+        module = None
+        for rule in entry:
+            if rule.modules is not None and module is None:
+                module = mongodog.utils.get_caller_module()
+            if rule.matches_details(module, command):
+                return rule.include
+        return self.default
+
+    def accepts(self, op, db, collection, command):
+        """Returns True if the command should be reported"""
+        entry = self.lookup(op, db, collection)
+        if entry is True or entry is False:
+            return entry
+        return self.decide(entry, command)
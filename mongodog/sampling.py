@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the adaptive sampler, that adjusts per op sampling rates of a
+Sniffer to keep mongodog's own overhead under a target fraction of wall
+time.
+"""
+import random
+import threading
+
+import mongodog.utils
+
+
+class AdaptiveSampler(object):
+    """Decides which calls are sniffed (see Sniffer's `sampler`).
+
+    The Sniffer reports the time it spends on every call to `add_cost`.
+    Every `window` seconds the rates are recomputed from the calls and costs
+    of the last window, so that the estimated cost of the next window is
+    `target` of its wall time: ops with at most `rare_calls` calls in the
+    window are always sampled, the other ops share the rest of the budget
+    with the same rate, that never drops below `min_rate`. Ops without
+    sampled calls in the window are estimated with the cost per call of
+    their last sampled window. Overhead is
+    measured as a fraction of one thread's time, costs from all threads are
+    added together."""
+
+    def __init__(self, target=0.01, window=1.0, min_rate=0.001,
+                 rare_calls=10, initial_rate=1.0, clock=mongodog.utils.timer,
+                 random=random.random):
+        """
+        :Parameters:
+        - `target`: overhead budget as a fraction of wall time (0.01 is 1%)
+        - `window`: seconds between rate adjustments
+        - `min_rate`: the lowest rate of any op
+        - `rare_calls`: ops with at most this many calls per window are
+        always sampled
+        - `initial_rate`: rate of ops before their first adjustment
+        - `clock`: function returning current time in seconds
+        - `random`: function returning a random float in [0, 1)
+        """
+        self.target = target
+        self.window = window
+        self.min_rate = min_rate
+        self.rare_calls = rare_calls
+        self.initial_rate = initial_rate
+        self.clock = clock
+        self.random = random
+        self.lock = threading.Lock()
+        self.rates = {}
+        # op: [calls, sampled calls, cost in seconds] of the current window
+        self.counters = {}
+        # op: cost per sampled call in the last window, that sampled it
+        self.costs = {}
+        self.window_started = clock()
+
+    def counters_of(self, op):
+        """Returns counters of the op (caller holds the lock)"""
+        counters = self.counters.get(op)
+        if counters is None:
+            counters = self.counters[op] = [0, 0, 0.0]
+        return counters
+
+    def sample(self, op):
+        """Returns True if the call of the op should be sniffed"""
+        now = self.clock()
+        with self.lock:
+            if now - self.window_started >= self.window:
+                self.adjust(now)
+            counters = self.counters_of(op)
+            counters[0] += 1
+            sampled = self.random() < self.rates.get(op, self.initial_rate)
+            if sampled:
+                counters[1] += 1
+            return sampled
+
+    def add_cost(self, op, seconds):
+        """Adds time spent by mongodog on a call of the op"""
+        with self.lock:
+            self.counters_of(op)[2] += seconds
+
+    def rate(self, op):
+        """Returns current sampling rate of the op"""
+        with self.lock:
+            return self.rates.get(op, self.initial_rate)
+
+    def adjust(self, now):
+        """Recomputes rates from the counters of the window, that ends now
+        (caller holds the lock)"""
+        budget = self.target * (now - self.window_started)
+        full_costs = {}
+        for op, (calls, sampled, cost) in self.counters.items():
+            # cost per sampled call includes the small cost of the calls,
+            # that were not sampled, so the estimate errs on the safe side
+            if sampled:
+                per_call = self.costs[op] = cost / sampled
+            else:
+                # at low rates windows often sample no call of the op
+                per_call = self.costs.get(op, 0.0)
+            if calls <= self.rare_calls:
+                self.rates[op] = 1.0
+                budget -= per_call * calls
+            else:
+                full_costs[op] = per_call * calls
+        total = sum(full_costs.values())
+        rate = 1.0
+        if total > 0:
+            rate = min(1.0, max(self.min_rate, max(budget, 0.0) / total))
+        for op in full_costs:
+            self.rates[op] = rate
+        self.counters = {}
+        self.window_started = now
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Defines sniffing scopes: units of work (e.g. web requests), that collect
+the cost of the commands issued within them in the current thread.
+"""
+import threading
+
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+
+
+class ScopeStack(threading.local):
+    """Thread local stack of open scopes"""
+
+    def __init__(self):
+        super(ScopeStack, self).__init__()
+        self.scopes = []
+
+
+SCOPES = ScopeStack()
+
+
+class Scope(object):
+    """Collects query count, total mongo time, returned documents and cost
+    per call site of the commands reported within it"""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = mongodog.utils.timer()
+        self.finished = None
+        self.queries = 0
+        self.duration = 0.0
+        self.nreturned = 0
+        self.errors = 0
+        self.call_sites = {}
+
+    def add(self, command, traceback=None):
+        """Adds the command to the scope (only its time and documents, if it
+        `continues` an earlier query)"""
+        queries = 0 if command.get('continues') else 1
+        duration = command.get('duration', 0.0)
+        self.queries += queries
+        self.duration += duration
+        self.nreturned += command.get('nreturned', 0)
+        if 'error' in command:
+            self.errors += 1
+        call_site = mongodog.utils.get_call_site(traceback)
+        cost = self.call_sites.get(call_site)
+        if cost is None:
+            cost = self.call_sites[call_site] = [0, 0.0]
+        cost[0] += queries
+        cost[1] += duration
+
+    @property
+    def elapsed(self):
+        """Wall time of the scope in seconds (so far, if still open)"""
+        finished = self.finished
+        if finished is None:
+            finished = mongodog.utils.timer()
+        return finished - self.started
+
+    def top_call_sites(self, limit=5):
+        """Returns a list of (call site, count, total duration) tuples,
+        most expensive first"""
+        rows = sorted(((site, cost[0], cost[1])
+                       for site, cost in self.call_sites.items()),
+                      key=lambda row: (-row[2], -row[1]))
+        return rows[:limit]
+
+    def summary(self):
+        """Returns a dict summarizing the scope"""
+        return {
+            'name': self.name,
+            'queries': self.queries,
+            'duration': self.duration,
+            'nreturned': self.nreturned,
+            'errors': self.errors,
+            'elapsed': self.elapsed,
+            'call_sites': [
+                {'call_site': '%s:%d in %s' % site if site else None,
+                 'count': count, 'duration': duration}
+                for site, count, duration in self.top_call_sites()],
+        }
+
+
+def open_scope(name=None, scope_class=Scope):
+    """Opens a new scope in the current thread and returns it"""
+    scope = scope_class(name)
+    SCOPES.scopes.append(scope)
+    return scope
+
+
+def close_scope(scope):
+    """Closes the scope (and any scopes opened within it, that were left
+    open) in the current thread"""
+    scopes = SCOPES.scopes
+    if scope in scopes:
+        del scopes[scopes.index(scope):]
+    if scope.finished is None:
+        scope.finished = mongodog.utils.timer()
+    return scope
+
+
+def active_scopes():
+    """Returns the list of open scopes in the current thread (outermost
+    first)"""
+    return SCOPES.scopes
+
+
+def has_active_scope():
+    """Returns True if there is an open scope in the current thread. Can be
+    used as Sniffer's `condition`, to skip all work outside of scopes."""
+    return bool(SCOPES.scopes)
+
+
+class ScopeReporter(BaseReporter):
+    """Adds reported commands to all open scopes of the current thread.
+    Commands issued within other sniffed calls (`nested`) are part of the
+    outer call and are not added (see
+    `mongodog.utils.is_included_in_outer_call`)."""
+
+    requires_timing = True
+
+    def report_mongo_command(self, command, traceback=None):
+        """Adds the command to the open scopes"""
+        if mongodog.utils.is_included_in_outer_call(command):
+            return
+        for scope in SCOPES.scopes:
+            scope.add(command, traceback)
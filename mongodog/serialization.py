@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the serializer, used by reporters to turn sniffed commands into
+compact JSON (MongoDB extended JSON for BSON types).
+"""
+import base64
+import calendar
+import datetime
+import json
+import re
+import uuid
+
+import bson.binary
+import bson.code
+import bson.dbref
+import bson.max_key
+import bson.min_key
+import bson.objectid
+import bson.timestamp
+
+try:
+    from bson.int64 import Int64
+except ImportError:
+    # pymongo < 3.0
+    Int64 = None
+try:
+    from bson.decimal128 import Decimal128
+except ImportError:
+    # pymongo < 3.4
+    Decimal128 = None
+try:
+    from bson.regex import Regex
+except ImportError:
+    # pymongo < 2.7
+    Regex = None
+try:
+    from pymongo.read_preferences import _ServerMode
+except ImportError:
+    # pymongo < 3.0 uses plain ints for read preferences
+    _ServerMode = None
+
+try:
+    TEXT_TYPES = (str, unicode)
+    INTEGER_TYPES = (int, long)
+    BYTES_TYPE = None
+except NameError:
+    # must be python3
+    TEXT_TYPES = (str,)
+    INTEGER_TYPES = (int,)
+    BYTES_TYPE = bytes
+
+PATTERN_TYPE = type(re.compile(''))
+
+REGEX_FLAGS = (
+    (re.IGNORECASE, 'i'),
+    (re.LOCALE, 'l'),
+    (re.MULTILINE, 'm'),
+    (re.DOTALL, 's'),
+    (re.UNICODE, 'u'),
+    (re.VERBOSE, 'x'),
+)
+
+
+def encode_identity(_serializer, value):
+    """Encoder for values, that json handles natively"""
+    return value
+
+
+def encode_dict(serializer, value):
+    """Encoder for dicts (including SON)"""
+    to_primitive = serializer.to_primitive
+    return dict(('%s' % key, to_primitive(val))
+                for key, val in value.items())
+
+
+def encode_sequence(serializer, value):
+    """Encoder for lists, tuples and sets"""
+    to_primitive = serializer.to_primitive
+    return [to_primitive(item) for item in value]
+
+
+def encode_repr(_serializer, value):
+    """Fallback encoder for unknown types"""
+    return repr(value)
+
+
+def encode_bytes(_serializer, value, subtype=0):
+    """Encoder for binary data"""
+    data = base64.b64encode(value).decode('ascii')
+    return {'$binary': data, '$type': '%02x' % subtype}
+
+
+def encode_binary(serializer, value):
+    """Encoder for bson.binary.Binary"""
+    return encode_bytes(serializer, bytes(value), value.subtype)
+
+
+def encode_object_id(_serializer, value):
+    """Encoder for bson.objectid.ObjectId"""
+    return {'$oid': str(value)}
+
+
+def encode_datetime(_serializer, value):
+    """Encoder for datetime.datetime (milliseconds since epoch, naive
+    datetimes are treated as UTC, just like pymongo does)"""
+    if value.utcoffset() is not None:
+        value = value - value.utcoffset()
+    millis = calendar.timegm(value.timetuple()) * 1000
+    return {'$date': millis + value.microsecond // 1000}
+
+
+def encode_pattern(_serializer, value):
+    """Encoder for compiled regular expressions and bson.regex.Regex"""
+    flags = value.flags
+    if isinstance(flags, TEXT_TYPES):
+        # bson.regex.Regex may keep flags as a string
+        options = flags
+    else:
+        options = ''.join(letter for flag, letter in REGEX_FLAGS
+                          if flags & flag)
+    return {'$regex': value.pattern, '$options': options}
+
+
+def encode_uuid(_serializer, value):
+    """Encoder for uuid.UUID"""
+    return {'$uuid': value.hex}
+
+
+def encode_code(serializer, value):
+    """Encoder for bson.code.Code"""
+    if value.scope:
+        return {'$code': '%s' % value,
+                '$scope': serializer.to_primitive(value.scope)}
+    return {'$code': '%s' % value}
+
+
+def encode_dbref(serializer, value):
+    """Encoder for bson.dbref.DBRef"""
+    document = {'$ref': value.collection,
+                '$id': serializer.to_primitive(value.id)}
+    if value.database is not None:
+        document['$db'] = value.database
+    return document
+
+
+def encode_timestamp(_serializer, value):
+    """Encoder for bson.timestamp.Timestamp"""
+    return {'$timestamp': {'t': value.time, 'i': value.inc}}
+
+
+def encode_min_key(_serializer, _value):
+    """Encoder for bson.min_key.MinKey"""
+    return {'$minKey': 1}
+
+
+def encode_max_key(_serializer, _value):
+    """Encoder for bson.max_key.MaxKey"""
+    return {'$maxKey': 1}
+
+
+def encode_decimal128(_serializer, value):
+    """Encoder for bson.decimal128.Decimal128"""
+    return {'$numberDecimal': str(value)}
+
+
+def encode_read_preference(_serializer, value):
+    """Encoder for pymongo read preference objects"""
+    return value.name
+
+
+class Serializer(object):
+    """Turns values into JSON compatible primitives.
+
+    Encoders are registered per type and are looked up through a cache keyed
+    by the exact type of the value, so the class hierarchy is only walked
+    once for every type. Values without an encoder are encoded as their
+    `repr`."""
+
+    def __init__(self):
+        self.encoders = {}
+        self.cache = {}
+
+    def register(self, cls, encoder):
+        """Registers encoder for the cls (and its subclasses). Encoder is a
+        function, that accepts the serializer and the value and returns a
+        JSON compatible value."""
+        self.encoders[cls] = encoder
+        self.cache.clear()
+
+    def encoder_for(self, cls):
+        """Returns the encoder used for values of the cls"""
+        try:
+            return self.cache[cls]
+        except KeyError:
+            pass
+        encoder = encode_repr
+        for base in getattr(cls, '__mro__', (cls,)):
+            if base in self.encoders:
+                encoder = self.encoders[base]
+                break
+        self.cache[cls] = encoder
+        return encoder
+
+    def to_primitive(self, value):
+        """Returns JSON compatible representation of the value"""
+        try:
+            encoder = self.cache[type(value)]
+        except KeyError:
+            encoder = self.encoder_for(type(value))
+        return encoder(self, value)
+
+    def dumps(self, value, sort_keys=False):
+        """Returns compact JSON representation of the value"""
+        return json.dumps(self.to_primitive(value), separators=(',', ':'),
+                          sort_keys=sort_keys)
+
+
+def create_default_serializer():
+    """Returns a Serializer with encoders for python built-in and BSON
+    types registered"""
+    serializer = Serializer()
+    for cls in (type(None), bool, float) + INTEGER_TYPES + TEXT_TYPES:
+        serializer.register(cls, encode_identity)
+    for cls in (list, tuple, set, frozenset):
+        serializer.register(cls, encode_sequence)
+    serializer.register(dict, encode_dict)
+    if BYTES_TYPE is not None:
+        serializer.register(BYTES_TYPE, encode_bytes)
+    serializer.register(datetime.datetime, encode_datetime)
+    serializer.register(PATTERN_TYPE, encode_pattern)
+    serializer.register(uuid.UUID, encode_uuid)
+    serializer.register(bson.objectid.ObjectId, encode_object_id)
+    serializer.register(bson.binary.Binary, encode_binary)
+    serializer.register(bson.code.Code, encode_code)
+    serializer.register(bson.dbref.DBRef, encode_dbref)
+    serializer.register(bson.timestamp.Timestamp, encode_timestamp)
+    serializer.register(bson.min_key.MinKey, encode_min_key)
+    serializer.register(bson.max_key.MaxKey, encode_max_key)
+    if Int64 is not None:
+        serializer.register(Int64, encode_identity)
+    if Decimal128 is not None:
+        serializer.register(Decimal128, encode_decimal128)
+    if Regex is not None:
+        serializer.register(Regex, encode_pattern)
+    if _ServerMode is not None:
+        serializer.register(_ServerMode, encode_read_preference)
+    return serializer
+
+
+DEFAULT_SERIALIZER = create_default_serializer()
+
+
+def to_primitive(value):
+    """Returns JSON compatible representation of the value, using the
+    default serializer"""
+    return DEFAULT_SERIALIZER.to_primitive(value)
+
+
+def dumps(value, sort_keys=False):
+    """Returns compact JSON representation of the value, using the default
+    serializer"""
+    return DEFAULT_SERIALIZER.dumps(value, sort_keys)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the snapshotter, that copies sniffed commands with limits on the
+number of list items, nesting depth and string and binary length, or only
+their shape, so big payloads (e.g. batched inserts) are never copied in
+full.
+"""
+import copy
+import datetime
+import re
+import uuid
+
+import bson.binary
+import bson.objectid
+import bson.son
+
+from mongodog.utils import ValueShape, get_value_shape
+
+try:
+    TEXT_TYPES = (str, unicode)
+    BYTES_TYPES = ()
+    IMMUTABLE_TYPES = (int, long, float, bool)
+except NameError:
+    # must be python3
+    TEXT_TYPES = (str,)
+    BYTES_TYPES = (bytes,)
+    IMMUTABLE_TYPES = (int, float, bool)
+
+IMMUTABLE_TYPES += (type(None), datetime.datetime, uuid.UUID,
+                    type(re.compile('')), bson.objectid.ObjectId)
+
+# appended to truncated strings
+ELLIPSIS = '...'
+
+# command fields, that are always kept as they are
+NAME_FIELDS = ('op', 'db', 'collection')
+
+
+class Snapshotter(object):
+    """Copies commands for the reporters (see Sniffer's `snapshotter`).
+
+    Limits, that are not None, are applied while copying:
+    - `max_items`: number of items kept in lists and tuples
+    - `max_depth`: nesting depth of dicts and lists, deeper values are
+    replaced by their shape (`mongodog.utils.ValueShape`)
+    - `max_string`: number of characters kept in strings
+    - `max_binary`: number of bytes kept in binary values
+    With `shape_only`, all values are replaced by their shape and lists keep
+    one item of every shape, so command shapes do not change."""
+
+    def __init__(self, max_items=None, max_depth=None, max_string=None,
+                 max_binary=None, shape_only=False):
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.max_binary = max_binary
+        self.shape_only = shape_only
+
+    def snapshot(self, command):
+        """Returns (copy of the command, number of truncated values)"""
+        truncated = [0]
+        result = dict((key, value if key in NAME_FIELDS
+                       else self.copy(value, 1, truncated))
+                      for key, value in command.items())
+        return result, truncated[0]
+
+    def copy(self, value, depth, truncated):
+        """Returns limited copy of the value at the nesting depth"""
+        if isinstance(value, dict):
+            if self.max_depth is not None and depth > self.max_depth:
+                truncated[0] += 1
+                return ValueShape(get_value_shape(value))
+            result = bson.son.SON() if isinstance(value, bson.son.SON) \
+                else {}
+            for key, item in value.items():
+                result[key] = self.copy(item, depth + 1, truncated)
+            return result
+        if isinstance(value, (list, tuple)):
+            return self.copy_sequence(value, depth, truncated)
+        if self.shape_only:
+            return ValueShape(get_value_shape(value))
+        if isinstance(value, TEXT_TYPES):
+            if self.max_string is not None and len(value) > self.max_string:
+                truncated[0] += 1
+                return value[:self.max_string] + ELLIPSIS
+            return value
+        if isinstance(value, bson.binary.Binary):
+            if self.max_binary is not None and len(value) > self.max_binary:
+                truncated[0] += 1
+                return bson.binary.Binary(bytes(value[:self.max_binary]),
+                                          value.subtype)
+            return value
+        if isinstance(value, BYTES_TYPES):
+            if self.max_binary is not None and len(value) > self.max_binary:
+                truncated[0] += 1
+                return value[:self.max_binary]
+            return value
+        if isinstance(value, IMMUTABLE_TYPES):
+            return value
+        return copy.deepcopy(value)
+
+    def copy_sequence(self, value, depth, truncated):
+        """Returns limited copy of the list or tuple"""
+        if self.max_depth is not None and depth > self.max_depth:
+            truncated[0] += 1
+            return ValueShape(get_value_shape(value))
+        items = value
+        if self.shape_only:
+            # one item of every shape
+            shapes = set()
+            items = []
+            for item in value:
+                shape = get_value_shape(item)
+                if shape not in shapes:
+                    shapes.add(shape)
+                    items.append(item)
+        if self.max_items is not None and len(items) > self.max_items:
+            truncated[0] += 1
+            items = items[:self.max_items]
+        result = [self.copy(item, depth + 1, truncated) for item in items]
+        if isinstance(value, tuple):
+            return tuple(result)
+        return result
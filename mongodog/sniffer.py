@@ -3,11 +3,24 @@
 Defines the Sniffer
 """
 import copy
+import inspect
+import random
+import sys
+import threading
+import time
+import weakref
 
 import pymongo.collection
 import pymongo.cursor
 import pymongo.database
 
+try:
+    import pymongo.command_cursor
+
+    COMMAND_CURSOR_INSTALLED = True
+except ImportError:
+    # pymongo < 2.6
+    COMMAND_CURSOR_INSTALLED = False
 try:
     import mongokit.collection
 
@@ -15,17 +28,48 @@ try:
 except ImportError:
     MONGOKIT_INSTALLED = False
 from bson.binary import OLD_UUID_SUBTYPE
-from pymongo.read_preferences import ReadPreference
 
+import mongodog.overhead
+import mongodog.records
+import mongodog.rules
 import mongodog.utils
 
 
 class SkipCall(Exception):
-    """Used by mongodog_sniffer to skip the call"""
-    pass
+    """Used by mongodog_sniffer to skip the call, the decorated function
+    returns `result` instead"""
+
+    def __init__(self, result=None):
+        super(SkipCall, self).__init__(result)
+        self.result = result
+
+
+class CursorFetch(object):
+    """Number and size of the documents fetched by a cursor so far, and the
+    time spent in its next calls"""
+
+    __slots__ = ('nreturned', 'nbytes', 'with_sizes', 'started', 'duration',
+                 'timer_started')
+
+    def __init__(self, with_sizes):
+        self.nreturned = 0
+        self.nbytes = 0
+        self.with_sizes = with_sizes
+        self.started = time.time()
+        self.duration = 0.0
+        self.timer_started = None
 
 
-def mongodog_sniffer(custom=None, callback_before=None, callback_after=None):
+class ReentrancyGuard(threading.local):
+    """Thread local flag, that is set while reporters run"""
+    active = False
+
+
+REENTRANCY_GUARD = ReentrancyGuard()
+
+
+def mongodog_sniffer(custom=None, callback_before=None, callback_after=None,
+                     callback_error=None):
     """Returns a decorator, that can be used to wrap any function or method.
 
     :Parameters:
@@ -34,10 +78,22 @@ def mongodog_sniffer(custom=None, callback_before=None, callback_after=None):
     positional argument followed by the rest of positional and keyword
     arguments used to call the decorated function. If this callback raises
     `SkipCall` exception the decorated function and `callback_after` will
-    not get called and None will be returned.
+    not get called and the `result` of the exception (None by default) will
+    be returned.
     - `callback_after`: a function that accepts result of the original
     function and `custom` as the first two positional arguments followed
     by the rest of the positional and keyword arguments passed to the call.
+    - `callback_error`: a function that accepts `sys.exc_info()` of the
+    exception raised by the original function and `custom` as the first two
+    positional arguments followed by the rest of the positional and keyword
+    arguments passed to the call. The exception is re-raised afterwards.
+    It is also called for exceptions, that do not derive from Exception
+    (e.g. KeyboardInterrupt or gevent's Timeout), so that callbacks always
+    see the end of the call.
+
+    While `REENTRANCY_GUARD` is active (reporter is running) in the current
+    thread, the decorated function is called directly, without any of the
+    callbacks.
     """
 
     def actual_decorator(func):
@@ -47,16 +103,26 @@ def mongodog_sniffer(custom=None, callback_before=None, callback_after=None):
             """Calls `callback_before`, then calls `func` and finally calls
             `callback_after`.
             Returns whatever `func` returned."""
+            if REENTRANCY_GUARD.active:
+                return func(*args, **kwargs)
+
             result = None
             proceed = True
             try:
                 if callback_before is not None:
                     callback_before(custom, *args, **kwargs)
-            except SkipCall:
+            except SkipCall as skip:
                 proceed = False
+                result = skip.result
 
             if proceed:
-                result = func(*args, **kwargs)
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException:
+                    if callback_error is not None:
+                        callback_error(sys.exc_info(), custom,
+                                       *args, **kwargs)
+                    raise
 
                 if callback_after is not None:
                     callback_after(result, custom, *args, **kwargs)
@@ -68,17 +134,69 @@ def mongodog_sniffer(custom=None, callback_before=None, callback_after=None):
     return actual_decorator
 
 
-SNIFFER_CONFIG = [
+def target_of_database(database):
+    """Returns (db, collection) names of the database method call"""
+    return database.name, None
+
+
+def target_of_collection(collection):
+    """Returns (db, collection) names of the collection method call"""
+    return collection.database.name, collection.name
+
+
+def target_of_cursor(cursor):
+    """Returns (db, collection) names of the cursor method call"""
+    return target_of_collection(cursor.collection)
+
+
+def target_of_command_cursor(cursor):
+    """Returns (db, collection) names of the command cursor method call"""
+    collection = mongodog.utils.get_pymongo_command_cursor_collection(cursor)
+    if collection is None:
+        return None, None
+    return target_of_collection(collection)
+
+
+def target_of_unknown(_obj):
+    """Returns (db, collection) names of unrecognized calls"""
+    return None, None
+
+
+TARGET_GETTERS = [
+    ('database_', target_of_database),
+    ('collection_', target_of_collection),
+    ('cursor_', target_of_cursor),
+    ('command_cursor_', target_of_command_cursor),
+]
+
+
+def get_target_getter(func):
+    """Returns function, that extracts (db, collection) names from the first
+    argument of the call to func"""
+    for prefix, getter in TARGET_GETTERS:
+        if func.startswith(prefix):
+            return getter
+    return target_of_unknown
+
+
+# methods of every pymongo version
+COMMON_CONFIG = [
     # pymongo database methods
     ('database_command', pymongo.database.Database, 'command'),
     # pymongo collection methods
     ('collection_aggregate', pymongo.collection.Collection, 'aggregate'),
-    ('collection_count', pymongo.collection.Collection, 'count'),
     ('collection_distinct', pymongo.collection.Collection, 'distinct'),
     ('collection_find', pymongo.collection.Collection, 'find'),
+    ('collection_find_one', pymongo.collection.Collection, 'find_one'),
+    # pymongo cursor methods
+    ('cursor_iter', pymongo.cursor.Cursor, '__iter__'),
+]
+
+# pymongo 2.x collection methods (deprecated in 3.x, removed in 4.0)
+LEGACY_CONFIG = [
+    ('collection_count', pymongo.collection.Collection, 'count'),
     ('collection_find_and_modify', pymongo.collection.Collection,
      'find_and_modify'),
-    ('collection_find_one', pymongo.collection.Collection, 'find_one'),
     ('collection_group', pymongo.collection.Collection, 'group'),
     ('collection_inline_map_reduce', pymongo.collection.Collection,
      'inline_map_reduce'),
@@ -87,10 +205,161 @@ SNIFFER_CONFIG = [
     ('collection_remove', pymongo.collection.Collection, 'remove'),
     ('collection_save', pymongo.collection.Collection, 'save'),
     ('collection_update', pymongo.collection.Collection, 'update'),
-    # pymongo cursor methods
-    ('cursor_iter', pymongo.cursor.Cursor, '__iter__'),
 ]
 
+# pymongo 3.x+ CRUD collection methods
+CRUD_CONFIG = [
+    ('collection_bulk_write', pymongo.collection.Collection, 'bulk_write'),
+    ('collection_count_documents', pymongo.collection.Collection,
+     'count_documents'),
+    ('collection_delete_many', pymongo.collection.Collection, 'delete_many'),
+    ('collection_delete_one', pymongo.collection.Collection, 'delete_one'),
+    ('collection_estimated_document_count', pymongo.collection.Collection,
+     'estimated_document_count'),
+    ('collection_find_one_and_delete', pymongo.collection.Collection,
+     'find_one_and_delete'),
+    ('collection_find_one_and_replace', pymongo.collection.Collection,
+     'find_one_and_replace'),
+    ('collection_find_one_and_update', pymongo.collection.Collection,
+     'find_one_and_update'),
+    ('collection_insert_many', pymongo.collection.Collection, 'insert_many'),
+    ('collection_insert_one', pymongo.collection.Collection, 'insert_one'),
+    ('collection_replace_one', pymongo.collection.Collection, 'replace_one'),
+    ('collection_update_many', pymongo.collection.Collection, 'update_many'),
+    ('collection_update_one', pymongo.collection.Collection, 'update_one'),
+]
+
+
+def available_entries(config):
+    """Returns the config entries, whose methods exist in the installed
+    pymongo version"""
+    return [entry for entry in config if hasattr(entry[1], entry[2])]
+
+
+SNIFFER_CONFIG = available_entries(COMMON_CONFIG + LEGACY_CONFIG +
+                                   CRUD_CONFIG)
+
+# cursor_next does not report every document, it accounts the fetched
+# documents and the time spent fetching them (pymongo talks to the server
+# in next, not in find or __iter__) and reports them once the cursor is
+# exhausted
+SNIFFER_CONFIG += [('cursor_next', pymongo.cursor.Cursor, method)
+                   for method in ('next', '__next__')
+                   if method in vars(pymongo.cursor.Cursor)]
+
+# command_cursor_next does the same for the cursors returned by commands
+# (e.g. aggregate in pymongo 3.x+)
+if COMMAND_CURSOR_INSTALLED:
+    SNIFFER_CONFIG += [
+        ('command_cursor_next', pymongo.command_cursor.CommandCursor, method)
+        for method in ('next', '__next__')
+        if method in vars(pymongo.command_cursor.CommandCursor)]
+
+# ops, that are only sniffed by default when sizes or timing are enabled
+OPTIONAL_OPS = ('cursor_next', 'command_cursor_next')
+
+# command fields holding the documents sent by write ops
+PAYLOAD_FIELDS = {
+    'collection_insert': 'doc_or_docs',
+    'collection_insert_one': 'document',
+    'collection_replace_one': 'replacement',
+    'collection_save': 'to_save',
+    'collection_update': 'document',
+    'collection_update_many': 'update',
+    'collection_update_one': 'update',
+}
+
+
+def get_arguments(func, skip):
+    """Returns (names, defaults) of the positional arguments of the function
+    after the first `skip` ones, defaults maps names to default values"""
+    getargspec = getattr(inspect, 'getfullargspec', None) or \
+        inspect.getargspec
+    spec = getargspec(func)
+    defaults = dict(zip(reversed(spec.args), reversed(spec.defaults or ())))
+    names = spec.args[skip:]
+    return names, dict((name, defaults[name]) for name in names
+                       if name in defaults)
+
+
+# arguments of find (spec, fields, ... in pymongo 2.x, filter, projection,
+# ... in pymongo 3.x+), that are passed to the cursor
+FIND_ARGUMENTS, FIND_DEFAULTS = get_arguments(
+    pymongo.cursor.Cursor.__init__, 2)
+
+# find_one passes its arguments after the first one (spec_or_id in pymongo
+# 2.x, filter in 3.x+) to find
+FIND_ONE_ARGUMENTS = get_arguments(
+    pymongo.collection.Collection.find_one, 1)[0][:1] + FIND_ARGUMENTS[1:]
+FIND_ONE_DEFAULTS = dict(FIND_DEFAULTS)
+FIND_ONE_DEFAULTS.pop(FIND_ARGUMENTS[0], None)
+FIND_ONE_DEFAULTS[FIND_ONE_ARGUMENTS[0]] = None
+
+# servers (3.6+) accept up to this many writes in one write command, pymongo
+# splits bigger batches
+MAX_WRITE_BATCH_SIZE = 100000
+
+# write commands, that the bulk_write request types are sent with
+WRITE_REQUEST_KINDS = {
+    'InsertOne': 'insert',
+    'ReplaceOne': 'update',
+    'UpdateOne': 'update',
+    'UpdateMany': 'update',
+    'DeleteOne': 'delete',
+    'DeleteMany': 'delete',
+}
+
+# order, in which pymongo sends the batches of unordered bulk writes
+WRITE_KINDS = ('insert', 'update', 'delete')
+
+# (attribute, field) pairs of the bulk_write request objects, that are
+# reported
+WRITE_REQUEST_FIELDS = (
+    ('_filter', 'filter'),
+    ('_doc', 'document'),
+    ('_upsert', 'upsert'),
+    ('_array_filters', 'array_filters'),
+    ('_hint', 'hint'),
+)
+
+
+def get_write_request_fields(request):
+    """Returns a dict describing the bulk_write request object (e.g.
+    pymongo.operations.UpdateOne): its `type` and the fields, that are set"""
+    fields = {'type': type(request).__name__}
+    for attribute, field in WRITE_REQUEST_FIELDS:
+        value = getattr(request, attribute, None)
+        if value is not None:
+            fields[field] = value
+    return fields
+
+
+def get_write_batches(requests, ordered=True):
+    """Returns [(kind, documents)] of the write commands, that pymongo sends
+    the bulk_write requests (dicts from `get_write_request_fields`) with:
+    ordered requests are split whenever their kind changes, unordered ones
+    are grouped by kind. Documents are the inserted documents, the updates
+    and replacements and the filters of deletes. Requests of unknown types
+    are left out."""
+    batches = []
+    by_kind = dict((kind, []) for kind in WRITE_KINDS)
+    for request in requests:
+        kind = WRITE_REQUEST_KINDS.get(request['type'])
+        if kind is None:
+            continue
+        document = request.get('filter' if kind == 'delete' else 'document')
+        if not ordered:
+            by_kind[kind].append(document)
+        elif batches and batches[-1][0] == kind:
+            batches[-1][1].append(document)
+        else:
+            batches.append((kind, [document]))
+    if not ordered:
+        batches = [(kind, by_kind[kind]) for kind in WRITE_KINDS
+                   if by_kind[kind]]
+    return batches
+
+
 if MONGOKIT_INSTALLED:
     SNIFFER_CONFIG += [
         # mongokit overrides collection_find
@@ -98,60 +367,551 @@ if MONGOKIT_INSTALLED:
     ]
 
 
+class PatchRegistry(object):
+    """Keeps track of the sniffers, that patch each method, so that several
+    sniffers can sniff the same method at the same time. Installed function
+    is the original function decorated by every active sniffer, in the order
+    they were started. Once no sniffer is active, the original function is
+    restored."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.originals = {}
+        self.active = {}
+
+    def original(self, cls, method, path):
+        """Returns the original (unpatched) function"""
+        with self.lock:
+            if path in self.originals:
+                return self.originals[path]
+            return getattr(cls, method)
+
+    def add(self, cls, method, path, sniffer):
+        """Adds sniffer to the sniffers patching the method"""
+        with self.lock:
+            if path not in self.originals:
+                self.originals[path] = getattr(cls, method)
+            sniffers = self.active.setdefault(path, [])
+            if sniffer not in sniffers:
+                sniffers.append(sniffer)
+                self.install(cls, method, path)
+
+    def remove(self, cls, method, path, sniffer):
+        """Removes sniffer from the sniffers patching the method"""
+        with self.lock:
+            sniffers = self.active.get(path, [])
+            if sniffer not in sniffers:
+                return
+            sniffers.remove(sniffer)
+            self.install(cls, method, path)
+            if not sniffers:
+                del self.active[path]
+                del self.originals[path]
+
+    def install(self, cls, method, path):
+        """Sets the method to the original function decorated by all active
+        sniffers"""
+        func = self.originals[path]
+        for sniffer in self.active[path]:
+            func = sniffer.wrap(path, func)
+        setattr(cls, method, func)
+
+
+PATCH_REGISTRY = PatchRegistry()
+
+
 class Sniffer(object):
     """Main class that does all the sniffing of pymongo activity"""
 
     config = SNIFFER_CONFIG
+    max_write_batch_size = MAX_WRITE_BATCH_SIZE
+
+    def __init__(self, reporter, with_traceback=True, with_timing=None,
+                 rules=None, ops=None, with_sizes=False, condition=None,
+                 size_sample_rate=1.0, with_stats=False,
+                 with_allocations=False, sampler=None, snapshotter=None):
+        """
+        :Parameters:
+        - `reporter`: object implementing `BaseReporter` interface
+        - `with_traceback`: pass the traceback of the calling code to the
+        reporter
+        - `with_timing`: report commands after the call has finished, with
+        `started` (unix time) and `duration` (seconds) fields added, and an
+        `error` field if the call raised. If None, the `requires_timing`
+        attribute of the reporter decides. Also enables `cursor_next` and
+        `command_cursor_next` ops (unless `ops` are given), which report
+        the time spent fetching the documents of a cursor (see
+        `with_sizes`).
+        - `rules`: `mongodog.rules.RuleSet` or a list of `mongodog.rules.Rule`
+        objects, that decide which calls are reported
+        - `ops`: names of the ops (first column of the config) to sniff, all
+        of them if None. Ops can be enabled or disabled later, see `enable`
+        and `disable`.
+        - `with_sizes`: add encoded BSON size of the documents sent by write
+        ops (`nbytes_sent`, also per batch of insert_many and bulk_write,
+        see `describe_batches`) and, when timing is enabled, of the returned
+        documents (`nbytes`) to the commands. Also enables `cursor_next` and
+        `command_cursor_next` ops (unless `ops` are given), which report
+        number and size of the documents fetched by a cursor, once it is
+        exhausted (with `started` and `duration` of the fetches, when timing
+        is enabled).
+        - `size_sample_rate`: fraction of the calls to compute sizes for
+        - `condition`: a function without arguments, calls are only sniffed
+        while it returns True (checked first, before anything else)
+        - `with_stats`: measure time spent by mongodog itself in every stage
+        of the call (see `stats`)
+        - `with_allocations`: measure memory allocated by mongodog with
+        tracemalloc while the sniffer is running (see `stats`)
+        - `sampler`: object with `sample(op)` method, that decides whether
+        the call is sniffed (checked after the condition), and `add_cost(op,
+        seconds)` method, that receives the time spent by the sniffer on
+        the call, e.g. `mongodog.sampling.AdaptiveSampler`
+        - `snapshotter`: `mongodog.snapshot.Snapshotter`, that copies
+        commands with limits on their size (commands with truncated values
+        get a `truncated` field with their number), instead of a full
+        deepcopy
 
-    def __init__(self, reporter, with_traceback=True):
+        Reporters with `accepts_compact` attribute set receive
+        `mongodog.records.CompactRecord` objects, encoded with the sniffer's
+        `records` dictionary, instead of command dicts.
+        """
         self.reporter = reporter
+        self.overhead = None
+        if with_stats:
+            self.overhead = mongodog.overhead.OverheadStats()
+        self.sampler = sampler
+        self.snapshotter = snapshotter
+        self.allocations = None
+        if with_allocations:
+            self.allocations = mongodog.overhead.AllocationTracker()
+        self.records = None
+        if getattr(reporter, 'accepts_compact', False):
+            self.records = mongodog.records.RecordDictionary()
         self.with_traceback = with_traceback
+        if with_timing is None:
+            with_timing = getattr(reporter, 'requires_timing', False)
+        self.with_timing = with_timing
+        self.with_sizes = with_sizes
+        self.size_sample_rate = size_sample_rate
+        self.fetched = weakref.WeakKeyDictionary()
+        self.found = weakref.WeakKeyDictionary()
+        self.condition = condition
+        if rules is not None and not isinstance(rules,
+                                                mongodog.rules.RuleSet):
+            rules = mongodog.rules.RuleSet(rules)
+        self.rules = rules
         self.last_op = None
+        self.local = threading.local()
+        self.running = False
 
         self.original = {}
         self.decorated = {}
+        self.decorators = {}
 
+        self.entries = []
         for func, cls, method in self.config:
-            custom = {'f': func}
-            callback_before = getattr(self, 'callback_before_%s' % func,
-                                      self.callback_before_generic)
-            callback_after = getattr(self, 'callback_after_%s' % func, None)
-            original_function = getattr(cls, method)
             original_function_path = '%s.%s.%s' % (cls.__module__,
                                                    cls.__name__,
                                                    method)
-            decorator = mongodog_sniffer(custom, callback_before,
-                                         callback_after)
+            self.entries.append((func, cls, method, original_function_path))
+
+        if ops is None:
+            ops = [entry[0] for entry in self.entries
+                   if with_sizes or with_timing or
+                   entry[0] not in OPTIONAL_OPS]
+        self.ops = set()
+        for func in ops:
+            self.check_op(func)
+            self.ops.add(func)
 
-            self.original[original_function_path] = original_function
-            self.decorated[original_function_path] = \
-                decorator(original_function)
+        for entry in self.entries:
+            if entry[0] in self.ops:
+                self.prepare(*entry)
+
+    def check_op(self, func):
+        """Raises ValueError if func is not a known op"""
+        if func not in [entry[0] for entry in self.entries]:
+            raise ValueError("Unknown op: %s" % func)
+
+    def prepare(self, func, cls, method, original_function_path):
+        """Builds the decorated function for the config entry"""
+        if original_function_path in self.decorated:
+            return
+        custom = {
+            'f': func,
+            'before': getattr(self, 'callback_before_%s' % func,
+                              self.callback_before_generic),
+            'after': getattr(self, 'callback_after_%s' % func, None),
+            'error': getattr(self, 'callback_error_%s' % func, None),
+            'target': get_target_getter(func),
+        }
+        original_function = PATCH_REGISTRY.original(cls, method,
+                                                    original_function_path)
+        decorator = mongodog_sniffer(custom, self.callback_before,
+                                     self.callback_after,
+                                     self.callback_error)
+
+        self.original[original_function_path] = original_function
+        self.decorators[original_function_path] = decorator
+        self.decorated[original_function_path] = decorator(original_function)
+
+    def wrap(self, original_function_path, func):
+        """Returns func (the original function or a function decorated by
+        another sniffer) decorated by this sniffer"""
+        if func is self.original[original_function_path]:
+            return self.decorated[original_function_path]
+        return self.decorators[original_function_path](func)
+
+    def patch(self, func):
+        """Patches all config entries of the op"""
+        for entry in self.entries:
+            if entry[0] == func:
+                self.prepare(*entry)
+                _, cls, method, original_function_path = entry
+                PATCH_REGISTRY.add(cls, method, original_function_path, self)
+
+    def unpatch(self, func):
+        """Restores all config entries of the op"""
+        for entry in self.entries:
+            if entry[0] == func:
+                _, cls, method, original_function_path = entry
+                PATCH_REGISTRY.remove(cls, method, original_function_path,
+                                      self)
 
     def start(self):
         """Starts sniffing"""
-        for _, cls, method in self.config:
-            original_function_path = '%s.%s.%s' % (cls.__module__,
-                                                   cls.__name__,
-                                                   method)
-            setattr(cls, method, self.decorated[original_function_path])
+        self.running = True
+        if self.allocations is not None:
+            self.allocations.start()
+        for func in sorted(self.ops):
+            self.patch(func)
 
     def stop(self):
         """Stops sniffing"""
-        for _, cls, method in self.config:
-            original_function_path = '%s.%s.%s' % (cls.__module__,
-                                                   cls.__name__,
-                                                   method)
-            setattr(cls, method, self.original[original_function_path])
+        self.running = False
+        for entry in self.entries:
+            self.unpatch(entry[0])
+        if self.allocations is not None:
+            self.allocations.stop()
+
+    def enable(self, func):
+        """Starts sniffing the op (if the sniffer is running)"""
+        self.check_op(func)
+        self.ops.add(func)
+        if self.running:
+            self.patch(func)
+
+    def disable(self, func):
+        """Stops sniffing the op, it is restored to the original function
+        (unless other sniffers are sniffing it)"""
+        self.check_op(func)
+        self.ops.discard(func)
+        if self.running:
+            self.unpatch(func)
 
-    def report_command(self, command):
-        """Reports command to the configured reporter"""
+    def pending_commands(self):
+        """Returns the stack of commands, that are waiting for their calls to
+        finish in the current thread (used when timing is enabled)"""
+        try:
+            return self.local.pending
+        except AttributeError:
+            self.local.pending = []
+            return self.local.pending
+
+    def accepts_call(self, custom, args):
+        """Returns False if the call is excluded by the condition or the
+        rules. Only db and collection names are read, rules that need the
+        command itself are decided in report_command."""
+        self.local.deferred_rules = None
+        if self.condition is not None and not self.condition():
+            return False
+        if self.sampler is not None and not self.sampler.sample(custom['f']):
+            return False
+        if self.rules is None:
+            return True
+        db, collection = custom['target'](args[0] if args else None)
+        entry = self.rules.lookup(custom['f'], db, collection)
+        if entry is True or entry is False:
+            return entry
+        self.local.deferred_rules = entry
+        return True
+
+    def stats(self, reset=False):
+        """Returns mongodog's own overhead: {'stages': {stage: {'count',
+        'total', 'max', 'mean'}}, 'allocations': {'size', 'count', 'top'}}
+        (see mongodog.overhead). Stages are only measured with `with_stats`
+        and allocations only with `with_allocations`."""
+        stats = {'stages': {}}
+        if self.overhead is not None:
+            stats['stages'] = self.overhead.snapshot(reset)
+        if self.allocations is not None:
+            stats['allocations'] = self.allocations.snapshot()
+        return stats
+
+    def measure(self, stage, started, op=None):
+        """Adds the time since `started` to the stage (with_stats) and, for
+        the stages, that are not nested in other stages (`op` is given), to
+        the cost of the op (with sampler)"""
+        seconds = mongodog.utils.timer() - started
+        if self.overhead is not None:
+            self.overhead.add(stage, seconds)
+        if self.sampler is not None and op is not None:
+            self.sampler.add_cost(op, seconds)
+
+    def sniffed_calls(self):
+        """Returns the stack of sniffed calls in progress in the current
+        thread, True for the calls, that reported a command"""
+        try:
+            return self.local.calls
+        except AttributeError:
+            self.local.calls = []
+            return self.local.calls
+
+    def callback_before(self, custom, *args, **kwargs):
+        """Called before every sniffed call, dispatches to the op specific
+        `callback_before_*` method"""
+        calls = self.sniffed_calls()
+        calls.append(False)
+        started = None
+        if self.overhead is not None or self.sampler is not None:
+            started = mongodog.utils.timer()
+        try:
+            self.dispatch_before(custom, *args, **kwargs)
+        except BaseException:
+            # the call is not made (e.g. SkipCall), so neither
+            # callback_after nor callback_error pop it
+            calls.pop()
+            raise
+        finally:
+            if started is not None:
+                self.measure('callback_before', started, custom['f'])
+
+    def dispatch_before(self, custom, *args, **kwargs):
+        """Checks the call against the condition and the rules and calls the
+        op specific `callback_before_*` method. Sessions are not passed on,
+        they are not part of the command and cannot be copied."""
+        kwargs.pop('session', None)
+        if not self.with_timing:
+            if self.accepts_call(custom, args):
+                custom['before'](custom, *args, **kwargs)
+            return
+
+        # every call pushes an entry, callback_after/callback_error pop it,
+        # unless this callback raises (then the call is not made at all)
+        pending = self.pending_commands()
+        pending.append(None)
+        try:
+            if not self.accepts_call(custom, args):
+                return
+            custom['before'](custom, *args, **kwargs)
+        except BaseException:
+            pending.pop()
+            raise
+        if pending[-1] is not None:
+            command, traceback = pending[-1]
+            pending[-1] = command, traceback, time.time(), \
+                mongodog.utils.timer()
+
+    def callback_after(self, result, custom, *args, **kwargs):
+        """Called after every successful sniffed call, dispatches to the op
+        specific `callback_after_*` method"""
+        finished = mongodog.utils.timer() if self.with_timing else None
+        try:
+            if custom['after'] is not None:
+                if self.overhead is None and self.sampler is None:
+                    custom['after'](result, custom, *args, **kwargs)
+                else:
+                    started = mongodog.utils.timer()
+                    custom['after'](result, custom, *args, **kwargs)
+                    self.measure('callback_after', started, custom['f'])
+        finally:
+            # the pending command is popped even if the callback raised
+            try:
+                if self.with_timing:
+                    self.finish_command(finished)
+            finally:
+                self.sniffed_calls().pop()
+
+    def callback_error(self, exc_info, custom, *args, **kwargs):
+        """Called after every sniffed call, that raised an exception,
+        dispatches to the op specific `callback_error_*` method"""
+        finished = mongodog.utils.timer() if self.with_timing else None
+        try:
+            if custom['error'] is not None:
+                if self.overhead is None and self.sampler is None:
+                    custom['error'](exc_info, custom, *args, **kwargs)
+                else:
+                    started = mongodog.utils.timer()
+                    custom['error'](exc_info, custom, *args, **kwargs)
+                    self.measure('callback_after', started, custom['f'])
+        finally:
+            try:
+                if self.with_timing:
+                    self.finish_command(finished, exc_info[1])
+            finally:
+                self.sniffed_calls().pop()
+
+    def finish_command(self, finished, error=None):
+        """Reports the command of the call, that has just finished"""
+        entry = self.pending_commands().pop()
+        if entry is None:
+            return
+        command, traceback, started, timer_started = entry
+        command['started'] = started
+        command['duration'] = finished - timer_started
+        if error is not None:
+            command['error'] = repr(error)
+        if self.sampler is None:
+            self.deliver(command, traceback)
+            return
+        delivering = mongodog.utils.timer()
+        self.deliver(command, traceback)
+        self.sampler.add_cost(command.get('op'),
+                              mongodog.utils.timer() - delivering)
+
+    def annotate_command(self, **fields):
+        """Adds fields to the command of the call, that has just finished
+        (only possible when timing is enabled, otherwise the command has
+        already been reported)"""
+        if not self.with_timing:
+            return
+        pending = self.pending_commands()
+        if pending and pending[-1] is not None:
+            pending[-1][0].update(fields)
+
+    def annotate_result(self, documents, nreturned=None):
+        """Adds number of returned documents and, if sizes are enabled, their
+        encoded BSON size to the command of the call, that has just
+        finished"""
+        if nreturned is None:
+            nreturned = len(documents)
+        if self.with_sizes and self.sample_size():
+            nbytes = sum(mongodog.utils.get_bson_size(document)
+                         for document in documents)
+            self.annotate_command(nreturned=nreturned, nbytes=nbytes)
+        else:
+            self.annotate_command(nreturned=nreturned)
+
+    def describe_batches(self, command, batches):
+        """Adds the write commands of a batched write to its command:
+        `batches` (`kind`, number of documents `ndocs` and, if sizes are
+        enabled, their encoded BSON size `nbytes_sent` of each), and the
+        totals `ndocs` and `nbytes_sent`.
+
+        :Parameters:
+        - `command`: command of the batched write
+        - `batches`: [(kind, documents)], see `get_write_batches`
+        """
+        measured = self.overhead is not None
+        with_sizes = self.with_sizes and self.sample_size()
+        started = mongodog.utils.timer() if measured and with_sizes \
+            else None
+        described = []
+        for kind, documents in batches:
+            # pymongo splits batches, that are too big for the server
+            for offset in range(0, len(documents), self.max_write_batch_size):
+                chunk = documents[offset:offset + self.max_write_batch_size]
+                batch = {'kind': kind, 'ndocs': len(chunk)}
+                if with_sizes:
+                    batch['nbytes_sent'] = \
+                        mongodog.utils.get_documents_bson_size(chunk)
+                described.append(batch)
+        command['batches'] = described
+        command['ndocs'] = sum(batch['ndocs'] for batch in described)
+        if with_sizes:
+            command['nbytes_sent'] = sum(batch['nbytes_sent']
+                                         for batch in described)
+        if started is not None:
+            self.measure('sizes', started)
+
+    def deliver(self, command, traceback):
+        """Passes the command to the reporter. Calls, that the reporter makes
+        itself, are not sniffed."""
+        if self.records is not None:
+            command = self.records.encode(command)
+        previous = REENTRANCY_GUARD.active
+        REENTRANCY_GUARD.active = True
+        started = mongodog.utils.timer() if self.overhead is not None \
+            else None
+        try:
+            self.reporter.report_mongo_command(command, traceback)
+        finally:
+            REENTRANCY_GUARD.active = previous
+            if started is not None:
+                self.measure('reporter', started)
+
+    def sample_size(self):
+        """Returns True if sizes should be computed for the current call"""
+        return self.size_sample_rate >= 1.0 or \
+            random.random() < self.size_sample_rate
+
+    def accepts_command(self, command):
+        """Returns True if the command, that is reported outside of the
+        sniffed call it describes, passes the condition and the rules"""
+        if self.condition is not None and not self.condition():
+            return False
+        return self.rules is None or self.rules.accepts(
+            command.get('op'), command.get('db'), command.get('collection'),
+            command)
+
+    def report_command(self, command, immediate=False):
+        """Reports command to the configured reporter. Unless `immediate`,
+        the command describes the current sniffed call and, when timing is
+        enabled, is reported once the call finishes.
+
+        Commands issued by pymongo itself within another reported call
+        (e.g. the find behind find_one) and iterations of cursors returned
+        by a reported find get a `nested` field, so that reporters counting
+        queries can count only the outermost calls. Documents fetched by
+        cursors of a reported find outside of other calls also get a
+        `continues` field: they are not a query of their own, but their
+        time is not part of the find (see
+        `mongodog.utils.is_included_in_outer_call`)."""
+        deferred_rules = getattr(self.local, 'deferred_rules', None)
+        if deferred_rules is not None:
+            self.local.deferred_rules = None
+            if not self.rules.decide(deferred_rules, command):
+                return
+        measured = self.overhead is not None
         traceback = None
         if self.with_traceback:
+            started = mongodog.utils.timer() if measured else None
             traceback = mongodog.utils.get_full_traceback()
+            if measured:
+                self.measure('traceback', started)
         # pymongo tends to modify some things within calls
         # let's make a copy
-        command_copy = copy.deepcopy(command)
-        self.reporter.report_mongo_command(command_copy, traceback)
+        started = mongodog.utils.timer() if measured else None
+        if self.snapshotter is None:
+            command_copy = copy.deepcopy(command)
+        else:
+            command_copy, truncated = self.snapshotter.snapshot(command)
+            if truncated:
+                command_copy['truncated'] = truncated
+        if measured:
+            self.measure('deepcopy', started)
+        calls = self.sniffed_calls()
+        if True in calls[:-1]:
+            command_copy['nested'] = True
+            command_copy.pop('continues', None)
+        if calls and not immediate:
+            calls[-1] = True
+        payload_field = PAYLOAD_FIELDS.get(command.get('op'))
+        if self.with_sizes and payload_field and self.sample_size():
+            started = mongodog.utils.timer() if measured else None
+            command_copy['nbytes_sent'] = \
+                mongodog.utils.get_documents_bson_size(
+                    command.get(payload_field))
+            if measured:
+                self.measure('sizes', started)
+        pending = None
+        if self.with_timing and not immediate:
+            pending = self.pending_commands()
+        if pending:
+            # reported once the call finishes
+            pending[-1] = command_copy, traceback
+        else:
+            self.deliver(command_copy, traceback)
 
     def callback_before_generic(self, custom, *args, **kwargs):
         """Generic callback for unrecognized functions"""
@@ -184,7 +944,8 @@ class Sniffer(object):
         self.report_command(cmd)
 
     def callback_before_collection_aggregate(self, custom, collection,
-                                             pipeline, **kwargs):
+                                             pipeline, session=None,
+                                             **kwargs):
         """Callback used with pymongo collection aggregate call"""
         command = {
             'db': collection.database.name,
@@ -195,56 +956,94 @@ class Sniffer(object):
         command.update(kwargs)
         self.report_command(command)
 
-    def callback_before_collection_count(self, custom, collection):
-        """Callback used with pymongo collection count call"""
+    def callback_before_collection_count(self, custom, collection,
+                                         filter=None, session=None,
+                                         **kwargs):
+        """Callback used with pymongo collection count call (`filter` and
+        the options are accepted since pymongo 3.x)"""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+        }
+        if filter is not None:
+            command['filter'] = filter
+        command.update(kwargs)
+        self.report_command(command)
+
+    def callback_before_collection_count_documents(
+            self, custom, collection, filter, session=None, **kwargs):
+        """Callback used with pymongo collection count_documents call"""
         command = {
             'db': collection.database.name,
             'collection': collection.name,
             'op': custom['f'],
+            'filter': filter,
         }
+        command.update(kwargs)
         self.report_command(command)
 
-    def callback_before_collection_distinct(self, custom, collection, key):
-        """Callback used with pymongo collection distinct call"""
+    def callback_before_collection_delete_many(
+            self, custom, collection, filter, collation=None, hint=None,
+            session=None, **kwargs):
+        """Callback used with pymongo collection delete_one and delete_many
+        calls"""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'filter': filter,
+            'collation': collation,
+            'hint': hint,
+        }
+        command.update(kwargs)
+        self.report_command(command)
+
+    callback_before_collection_delete_one = \
+        callback_before_collection_delete_many
+
+    def callback_before_collection_distinct(self, custom, collection, key,
+                                            filter=None, session=None,
+                                            **kwargs):
+        """Callback used with pymongo collection distinct call (`filter`
+        and the options are accepted since pymongo 3.x)"""
         command = {
             'db': collection.database.name,
             'collection': collection.name,
             'op': custom['f'],
             'key': key,
         }
+        if filter is not None:
+            command['filter'] = filter
+        command.update(kwargs)
         self.report_command(command)
 
-    def callback_before_collection_find(
-            self, custom, collection, spec=None, fields=None, skip=0, limit=0,
-            timeout=True, snapshot=False, tailable=False, sort=None,
-            max_scan=None, as_class=None, slave_okay=False, await_data=False,
-            partial=False, manipulate=True,
-            read_preference=ReadPreference.PRIMARY, tag_sets=[{}],
-            secondary_acceptable_latency_ms=None, _must_use_master=False,
-            _uuid_subtype=None, **kwargs):
-        """Callback used with pymongo collection find call"""
+    def callback_before_collection_estimated_document_count(
+            self, custom, collection, **kwargs):
+        """Callback used with pymongo collection estimated_document_count
+        call"""
         command = {
             'db': collection.database.name,
             'collection': collection.name,
             'op': custom['f'],
-            'spec': spec,
-            'fields': fields,
-            'skip': skip,
-            'limit': limit,
-            'timeout': timeout,
-            'snapshot': snapshot,
-            'tailable': tailable,
-            'sort': sort,
-            'await_data': await_data,
-            'partial': partial,
-            'manipulate': manipulate,
-            'read_preference': read_preference,
-            'tag_sets': tag_sets,
-            'secondary_acceptable_latency_ms': secondary_acceptable_latency_ms,
-            '_must_use_master': _must_use_master,
-            '_uuid_subtype': _uuid_subtype,
         }
+        kwargs.pop('session', None)
+        command.update(kwargs)
+        self.report_command(command)
+
+    def callback_before_collection_find(self, custom, collection, *args,
+                                        **kwargs):
+        """Callback used with pymongo collection find call, reports the
+        arguments of the cursor under the names of the installed pymongo"""
+        command = dict(FIND_DEFAULTS)
+        command.update(zip(FIND_ARGUMENTS, args))
         command.update(kwargs)
+        command.pop('session', None)
+        command.update({
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+        })
         self.report_command(command)
 
     def callback_before_collection_find_and_modify(
@@ -264,39 +1063,77 @@ class Sniffer(object):
         command.update(kwargs)
         self.report_command(command)
 
-    def callback_before_collection_find_one(
-            self, custom, collection, spec_or_id=None, fields=None, skip=0,
-            limit=0, timeout=True, snapshot=False, tailable=False, sort=None,
-            max_scan=None, as_class=None, slave_okay=False, await_data=False,
-            partial=False, manipulate=True,
-            read_preference=ReadPreference.PRIMARY, tag_sets=[{}],
-            secondary_acceptable_latency_ms=None, _must_use_master=False,
-            _uuid_subtype=None, **kwargs):
-        """Callback used with pymongo collection find_one call"""
+    def callback_before_collection_find_one_and_delete(
+            self, custom, collection, filter, projection=None, sort=None,
+            hint=None, session=None, **kwargs):
+        """Callback used with pymongo collection find_one_and_delete call"""
         command = {
             'db': collection.database.name,
             'collection': collection.name,
             'op': custom['f'],
-            'spec_or_id': spec_or_id,
-            'fields': fields,
-            'skip': skip,
-            'limit': limit,
-            'timeout': timeout,
-            'snapshot': snapshot,
-            'tailable': tailable,
+            'filter': filter,
+            'projection': projection,
             'sort': sort,
-            'await_data': await_data,
-            'partial': partial,
-            'manipulate': manipulate,
-            'read_preference': read_preference,
-            'tag_sets': tag_sets,
-            'secondary_acceptable_latency_ms': secondary_acceptable_latency_ms,
-            '_must_use_master': _must_use_master,
-            '_uuid_subtype': _uuid_subtype,
+            'hint': hint,
+        }
+        command.update(kwargs)
+        self.report_command(command)
+
+    def callback_before_collection_find_one_and_replace(
+            self, custom, collection, filter, replacement, projection=None,
+            sort=None, upsert=False, return_document=False, hint=None,
+            session=None, **kwargs):
+        """Callback used with pymongo collection find_one_and_replace call"""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'filter': filter,
+            'replacement': replacement,
+            'projection': projection,
+            'sort': sort,
+            'upsert': upsert,
+            'return_document': return_document,
+            'hint': hint,
         }
         command.update(kwargs)
         self.report_command(command)
 
+    def callback_before_collection_find_one_and_update(
+            self, custom, collection, filter, update, projection=None,
+            sort=None, upsert=False, return_document=False,
+            array_filters=None, hint=None, session=None, **kwargs):
+        """Callback used with pymongo collection find_one_and_update call"""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'filter': filter,
+            'update': update,
+            'projection': projection,
+            'sort': sort,
+            'upsert': upsert,
+            'return_document': return_document,
+            'array_filters': array_filters,
+            'hint': hint,
+        }
+        command.update(kwargs)
+        self.report_command(command)
+
+    def callback_before_collection_find_one(self, custom, collection,
+                                            *args, **kwargs):
+        """Callback used with pymongo collection find_one call"""
+        command = dict(FIND_ONE_DEFAULTS)
+        command.update(zip(FIND_ONE_ARGUMENTS, args))
+        command.update(kwargs)
+        command.pop('session', None)
+        command.update({
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+        })
+        self.report_command(command)
+
     def callback_before_collection_group(
             self, custom, collection, key, condition, initial, reduce,
             finalize=None):
@@ -345,6 +1182,39 @@ class Sniffer(object):
         command.update(kwargs)
         self.report_command(command)
 
+    def callback_before_collection_insert_many(
+            self, custom, collection, documents, ordered=True,
+            bypass_document_validation=False, session=None, **kwargs):
+        """Callback used with pymongo collection insert_many call. Documents
+        given by a generator are not reported, it would be consumed."""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'documents': None,
+            'ordered': ordered,
+            'bypass_document_validation': bypass_document_validation,
+        }
+        command.update(kwargs)
+        if isinstance(documents, (list, tuple)):
+            command['documents'] = documents
+            self.describe_batches(command, [('insert', documents)])
+        self.report_command(command)
+
+    def callback_before_collection_insert_one(
+            self, custom, collection, document,
+            bypass_document_validation=False, session=None, **kwargs):
+        """Callback used with pymongo collection insert_one call"""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'document': document,
+            'bypass_document_validation': bypass_document_validation,
+        }
+        command.update(kwargs)
+        self.report_command(command)
+
     def callback_before_collection_map_reduce(
             self, custom, collection, map, reduce, out, full_response=False,
             **kwargs):
@@ -374,6 +1244,25 @@ class Sniffer(object):
         command.update(kwargs)
         self.report_command(command)
 
+    def callback_before_collection_replace_one(
+            self, custom, collection, filter, replacement, upsert=False,
+            bypass_document_validation=False, collation=None, hint=None,
+            session=None, **kwargs):
+        """Callback used with pymongo collection replace_one call"""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'filter': filter,
+            'replacement': replacement,
+            'upsert': upsert,
+            'bypass_document_validation': bypass_document_validation,
+            'collation': collation,
+            'hint': hint,
+        }
+        command.update(kwargs)
+        self.report_command(command)
+
     def callback_before_collection_save(
             self, custom, collection, to_save, manipulate=True, safe=None,
             check_keys=True, **kwargs):
@@ -410,6 +1299,62 @@ class Sniffer(object):
         command.update(kwargs)
         self.report_command(command)
 
+    def callback_before_collection_update_many(
+            self, custom, collection, filter, update, upsert=False,
+            array_filters=None, bypass_document_validation=False,
+            collation=None, hint=None, session=None, **kwargs):
+        """Callback used with pymongo collection update_many call"""
+        self.report_update(custom, collection, filter, update, upsert,
+                           bypass_document_validation, collation,
+                           array_filters, hint, kwargs)
+
+    def callback_before_collection_update_one(
+            self, custom, collection, filter, update, upsert=False,
+            bypass_document_validation=False, collation=None,
+            array_filters=None, hint=None, session=None, **kwargs):
+        """Callback used with pymongo collection update_one call"""
+        self.report_update(custom, collection, filter, update, upsert,
+                           bypass_document_validation, collation,
+                           array_filters, hint, kwargs)
+
+    def report_update(self, custom, collection, filter, update, upsert,
+                      bypass_document_validation, collation, array_filters,
+                      hint, kwargs):
+        """Reports pymongo collection update_one or update_many call (their
+        arguments are in different order)"""
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'filter': filter,
+            'update': update,
+            'upsert': upsert,
+            'bypass_document_validation': bypass_document_validation,
+            'collation': collation,
+            'array_filters': array_filters,
+            'hint': hint,
+        }
+        command.update(kwargs)
+        self.report_command(command)
+
+    def callback_before_collection_bulk_write(
+            self, custom, collection, requests, ordered=True,
+            bypass_document_validation=False, session=None, **kwargs):
+        """Callback used with pymongo collection bulk_write call"""
+        requests = [get_write_request_fields(request)
+                    for request in requests]
+        command = {
+            'db': collection.database.name,
+            'collection': collection.name,
+            'op': custom['f'],
+            'requests': requests,
+            'ordered': ordered,
+            'bypass_document_validation': bypass_document_validation,
+        }
+        command.update(kwargs)
+        self.describe_batches(command, get_write_batches(requests, ordered))
+        self.report_command(command)
+
     def callback_before_cursor_iter(self, custom, cursor):
         """Callback used with pymongo cursor __iter__ call"""
         collection = cursor.collection
@@ -419,4 +1364,149 @@ class Sniffer(object):
             'op': custom['f'],
         }
         command.update(mongodog.utils.get_pymongo_cursor_fields(cursor))
+        if self.found.get(cursor):
+            # the query was already reported by the find, that created the
+            # cursor
+            command['nested'] = True
         self.report_command(command)
+
+    def callback_after_collection_aggregate(self, result, custom, *args,
+                                            **kwargs):
+        """Counts documents returned by pymongo collection aggregate call"""
+        if isinstance(result, dict):
+            self.annotate_result(result.get('result', []))
+
+    def callback_after_collection_find(self, result, custom, *args,
+                                       **kwargs):
+        """Remembers the cursor returned by reported pymongo collection find
+        call, its iteration is reported as nested"""
+        calls = self.sniffed_calls()
+        if calls and calls[-1]:
+            try:
+                self.found[result] = True
+            except TypeError:
+                # not a cursor
+                pass
+
+    def callback_after_collection_distinct(self, result, custom, *args,
+                                           **kwargs):
+        """Counts values returned by pymongo collection distinct call"""
+        self.annotate_result([{'values': result}], len(result))
+
+    def callback_after_collection_find_and_modify(self, result, custom,
+                                                  *args, **kwargs):
+        """Counts documents returned by pymongo collection find_and_modify
+        call"""
+        self.annotate_result([result] if result is not None else [])
+
+    def callback_after_collection_find_one(self, result, custom, *args,
+                                           **kwargs):
+        """Counts documents returned by pymongo collection find_one call"""
+        self.annotate_result([result] if result is not None else [])
+
+    def callback_after_collection_find_one_and_delete(self, result, custom,
+                                                      *args, **kwargs):
+        """Counts documents returned by pymongo collection find_one_and_*
+        calls"""
+        self.annotate_result([result] if result is not None else [])
+
+    callback_after_collection_find_one_and_replace = \
+        callback_after_collection_find_one_and_delete
+    callback_after_collection_find_one_and_update = \
+        callback_after_collection_find_one_and_delete
+
+    def callback_after_collection_insert_many(self, result, custom, *args,
+                                              **kwargs):
+        """Counts documents inserted by pymongo collection insert_many call
+        (also when they were given by a generator)"""
+        inserted_ids = getattr(result, 'inserted_ids', None)
+        if inserted_ids is not None:
+            self.annotate_command(ndocs=len(inserted_ids))
+
+    def callback_after_collection_inline_map_reduce(self, result, custom,
+                                                    *args, **kwargs):
+        """Counts documents returned by pymongo collection inline_map_reduce
+        call (the whole response, when called with `full_response`)"""
+        if isinstance(result, dict):
+            result = result.get('results', [])
+        self.annotate_result(result)
+
+    def cursor_fetch(self, cursor):
+        """Returns the CursorFetch of the cursor, a new one on its first
+        next call"""
+        fetch = self.fetched.get(cursor)
+        if fetch is None:
+            fetch = self.fetched[cursor] = CursorFetch(
+                self.with_sizes and self.sample_size())
+        return fetch
+
+    def finish_fetch(self, cursor):
+        """Returns the CursorFetch of the cursor with the time of the next
+        call, that has just finished, added"""
+        fetch = self.cursor_fetch(cursor)
+        if fetch.timer_started is not None:
+            fetch.duration += mongodog.utils.timer() - fetch.timer_started
+            fetch.timer_started = None
+        return fetch
+
+    def callback_before_cursor_next(self, custom, cursor):
+        """Callback used with pymongo cursor next call (reports nothing,
+        starts timing the fetch, when timing is enabled)"""
+        if self.with_timing:
+            self.cursor_fetch(cursor).timer_started = mongodog.utils.timer()
+
+    callback_before_command_cursor_next = callback_before_cursor_next
+
+    def callback_after_cursor_next(self, result, custom, cursor):
+        """Accounts the document fetched by pymongo cursor next call"""
+        fetch = self.finish_fetch(cursor)
+        fetch.nreturned += 1
+        if fetch.with_sizes:
+            fetch.nbytes += mongodog.utils.get_bson_size(result)
+
+    callback_after_command_cursor_next = callback_after_cursor_next
+
+    def callback_error_cursor_next(self, exc_info, custom, cursor):
+        """Reports documents fetched by the cursor, once it is exhausted"""
+        self.report_fetched(exc_info, custom, cursor, cursor.collection, {
+            'spec': mongodog.utils.get_pymongo_cursor_fields(cursor)['spec'],
+        })
+
+    def callback_error_command_cursor_next(self, exc_info, custom, cursor):
+        """Reports documents fetched by the command cursor (e.g. returned by
+        aggregate), once it is exhausted"""
+        collection = \
+            mongodog.utils.get_pymongo_command_cursor_collection(cursor)
+        self.report_fetched(exc_info, custom, cursor, collection, {})
+
+    def report_fetched(self, exc_info, custom, cursor, collection, fields):
+        """Reports number and size of documents fetched by the cursor and,
+        when timing is enabled, the time spent fetching them, if next raised
+        StopIteration"""
+        if cursor not in self.fetched:
+            return
+        fetch = self.finish_fetch(cursor)
+        if not isinstance(exc_info[1], StopIteration):
+            return
+        del self.fetched[cursor]
+        command = {
+            'db': collection.database.name if collection is not None
+            else None,
+            'collection': collection.name if collection is not None
+            else None,
+            'op': custom['f'],
+            'nreturned': fetch.nreturned,
+        }
+        command.update(fields)
+        if fetch.with_sizes:
+            command['nbytes'] = fetch.nbytes
+        if self.with_timing:
+            command['started'] = fetch.started
+            command['duration'] = fetch.duration
+        if self.found.get(cursor):
+            # the query was already reported by the find, that created the
+            # cursor, the fetches continue it
+            command['nested'] = True
+            command['continues'] = True
+        if self.accepts_command(command):
+            self.report_command(command, immediate=True)
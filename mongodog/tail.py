@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Defines tail-based sampling: commands issued within a scope (e.g. a request
+or a task) are buffered as compact records and only forwarded to the
+reporter, when the scope turns out to be slow or to have failed.
+"""
+import contextlib
+
+import mongodog.records
+import mongodog.scope
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+from mongodog.sniffer import REENTRANCY_GUARD
+
+
+class TailScope(mongodog.scope.Scope):
+    """Scope, that buffers its commands instead of aggregating them per call
+    site"""
+
+    def __init__(self, name=None):
+        super(TailScope, self).__init__(name)
+        self.records = []
+        self.dropped = 0
+        self.max_records = None
+        self.dictionary = None
+        self.failed = False
+
+    def add(self, command, traceback=None):
+        """Counts the command (unless it is nested in another sniffed call,
+        see `mongodog.utils.is_included_in_outer_call`) and buffers its
+        compact record"""
+        if not mongodog.utils.is_included_in_outer_call(command):
+            if not command.get('continues'):
+                self.queries += 1
+            self.duration += command.get('duration', 0.0)
+            if 'error' in command:
+                self.errors += 1
+        if self.max_records is not None and \
+                len(self.records) >= self.max_records:
+            self.dropped += 1
+            return
+        self.records.append((self.dictionary.encode(command), traceback))
+
+
+class TailSamplingReporter(BaseReporter):
+    """Buffers commands of the outermost open TailScope of the current thread
+    and forwards them to `reporter` once the scope closes, if it took at
+    least `min_elapsed` seconds, spent at least `min_duration` seconds in
+    mongo, or failed (a command raised or the scope was closed with an
+    error). Otherwise they are discarded. Commands issued outside of tail
+    scopes are forwarded right away, unless `forward_unscoped` is False.
+
+    Usage::
+
+        tail = TailSamplingReporter(LoggingReporter('slow'), min_elapsed=0.5)
+        sniffer = Sniffer(tail)
+        sniffer.start()
+        with tail.scope('GET /users'):
+            handle_request()
+    """
+
+    requires_timing = True
+
+    def __init__(self, reporter, min_elapsed=None, min_duration=None,
+                 on_error=True, max_records=1000, forward_unscoped=True):
+        """
+        :Parameters:
+        - `reporter`: reporter, that receives the commands of kept scopes
+        - `min_elapsed`: keep scopes with at least this wall time
+        - `min_duration`: keep scopes with at least this total mongo time
+        - `on_error`: keep scopes, that failed
+        - `max_records`: maximum number of buffered commands per scope,
+        the rest are counted in the scope's `dropped`
+        - `forward_unscoped`: forward commands issued outside of tail scopes
+        """
+        self.reporter = reporter
+        self.min_elapsed = min_elapsed
+        self.min_duration = min_duration
+        self.on_error = on_error
+        self.max_records = max_records
+        self.forward_unscoped = forward_unscoped
+        self.dictionary = mongodog.records.RecordDictionary()
+        self.kept = 0
+        self.discarded = 0
+
+    def report_mongo_command(self, command, traceback=None):
+        """Buffers the command in the outermost open tail scope"""
+        for scope in mongodog.scope.active_scopes():
+            if isinstance(scope, TailScope):
+                scope.add(command, traceback)
+                return
+        if self.forward_unscoped:
+            self.reporter.report_mongo_command(command, traceback)
+
+    def open_scope(self, name=None):
+        """Opens a tail scope in the current thread and returns it"""
+        scope = mongodog.scope.open_scope(name, TailScope)
+        scope.max_records = self.max_records
+        scope.dictionary = self.dictionary
+        return scope
+
+    def keeps(self, scope):
+        """Returns True if the commands of the closed scope are forwarded"""
+        if self.on_error and (scope.failed or scope.errors):
+            return True
+        if self.min_elapsed is not None and scope.elapsed >= self.min_elapsed:
+            return True
+        return self.min_duration is not None and \
+            scope.duration >= self.min_duration
+
+    def close_scope(self, scope, failed=False):
+        """Closes the scope and forwards or discards its commands. Returns
+        True if they were forwarded."""
+        mongodog.scope.close_scope(scope)
+        scope.failed = scope.failed or failed
+        records, scope.records = scope.records, []
+        if not self.keeps(scope):
+            self.discarded += 1
+            return False
+        self.kept += 1
+        # the reporter may issue mongo calls, that must not be sniffed
+        previous = REENTRANCY_GUARD.active
+        REENTRANCY_GUARD.active = True
+        try:
+            for record, traceback in records:
+                self.reporter.report_mongo_command(record.decode(), traceback)
+        finally:
+            REENTRANCY_GUARD.active = previous
+        return True
+
+    @contextlib.contextmanager
+    def scope(self, name=None):
+        """Context manager, that opens a tail scope and closes it on exit
+        (as failed, if an exception is raised, also e.g. gevent's Timeout or
+        KeyboardInterrupt)"""
+        scope = self.open_scope(name)
+        try:
+            yield scope
+        except BaseException:
+            self.close_scope(scope, failed=True)
+            raise
+        self.close_scope(scope)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Defines test helpers, that fail tests when code issues more mongo queries
+than expected.
+"""
+import functools
+
+import mongodog.rules
+import mongodog.utils
+from mongodog.reporters import MemoryReporter
+from mongodog.sniffer import Sniffer
+
+try:
+    STRING_TYPES = basestring
+except NameError:
+    # must be python3
+    STRING_TYPES = str, bytes
+
+
+def outermost_commands(reported_commands):
+    """Returns (command, traceback) pairs of the queries issued by the
+    code itself, without the calls pymongo makes within them (see
+    Sniffer.report_command)"""
+    return [(command, traceback) for command, traceback in reported_commands
+            if not command.get('nested')]
+
+
+def describe_commands(reported_commands):
+    """Returns lines describing commands grouped by shape and call site,
+    most frequent first"""
+    groups = {}
+    for command, traceback in reported_commands:
+        call_site = mongodog.utils.get_call_site(traceback)
+        key = mongodog.utils.get_command_shape(command), call_site
+        groups[key] = groups.get(key, 0) + 1
+    lines = []
+    for (shape, call_site), count in sorted(
+            groups.items(), key=lambda item: (-item[1], item[0][0])):
+        where = '%s:%d in %s' % call_site if call_site else 'unknown'
+        lines.append('%5d x %s at %s' % (count, shape, where))
+    return lines
+
+
+class AssertMaxQueries(object):
+    """Context manager and decorator, that fails with AssertionError when
+    more than `max_queries` matching commands are issued within it. Only
+    the outermost sniffed calls are counted, e.g. find_one counts as one
+    query, not also as the find and the cursor iteration behind it, and a
+    find counts as one query together with the iteration of its cursor."""
+
+    def __init__(self, max_queries, ops=None, collection=None, db=None,
+                 sniffer_class=Sniffer):
+        """
+        :Parameters:
+        - `max_queries`: maximum number of matching commands
+        - `ops`: op name or list of op names to count (all if None), ops
+        that are not counted are not patched at all
+        - `collection`: collection name or list of names to count
+        - `db`: database name or list of names to count
+        - `sniffer_class`: Sniffer class to use
+        """
+        if isinstance(ops, STRING_TYPES):
+            ops = [ops]
+        self.max_queries = max_queries
+        self.ops = ops
+        self.collection = collection
+        self.db = db
+        self.sniffer_class = sniffer_class
+        self.reporter = None
+        self.sniffer = None
+
+    def __enter__(self):
+        rules = None
+        if self.collection is not None or self.db is not None:
+            rules = [mongodog.rules.include(collection=self.collection,
+                                            db=self.db),
+                     mongodog.rules.exclude()]
+        self.reporter = MemoryReporter()
+        self.sniffer = self.sniffer_class(self.reporter, rules=rules,
+                                          ops=self.ops)
+        self.sniffer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.sniffer.stop()
+        if exc_type is not None:
+            return
+        commands = outermost_commands(self.reporter.reported_commands)
+        if len(commands) > self.max_queries:
+            lines = ["Expected at most %d queries, but %d were issued:" % (
+                self.max_queries, len(commands))]
+            lines.extend(describe_commands(commands))
+            raise AssertionError('\n'.join(lines))
+
+    @property
+    def queries(self):
+        """Number of matching commands issued so far"""
+        if self.reporter is None:
+            return 0
+        return len(outermost_commands(self.reporter.reported_commands))
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            """Calls func within a fresh AssertMaxQueries"""
+            with AssertMaxQueries(self.max_queries, self.ops,
+                                  self.collection, self.db,
+                                  self.sniffer_class):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def assert_max_queries(max_queries, ops=None, collection=None, db=None,
+                       sniffer_class=Sniffer):
+    """Returns a context manager / decorator, that fails with AssertionError
+    listing the offending command shapes and call sites, when more than
+    `max_queries` matching commands are issued within it.
+
+    Usage::
+
+        with mongodog.assert_max_queries(2, ops='collection_find'):
+            load_users()
+
+        @mongodog.assert_max_queries(0, collection='users')
+        def test_cached_user():
+            ...
+    """
+    return AssertMaxQueries(max_queries, ops, collection, db, sniffer_class)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the trace event reporter, that writes sniffed commands as Chrome
+trace events (viewable in Perfetto or chrome://tracing).
+"""
+import os
+import threading
+import time
+
+import mongodog.serialization
+import mongodog.utils
+from mongodog.reporters import BaseReporter
+
+try:
+    STRING_TYPES = basestring
+except NameError:
+    # must be python3
+    STRING_TYPES = str, bytes
+
+
+def format_stack(traceback):
+    """Returns the traceback as a list of 'function (file:line)' strings,
+    outermost frame first"""
+    return ['%s (%s:%d)' % (name, filename, lineno)
+            for _, filename, lineno, name
+            in mongodog.utils.iter_traceback_frames(traceback)]
+
+
+class TraceEventReporter(BaseReporter):
+    """Streams commands as complete ('X') trace events in JSON array format.
+
+    Events are buffered and written to the output every `buffer_size`
+    events, so only the buffer is kept in memory. Call `close` to flush the
+    rest and terminate the JSON array (the viewers also accept files, that
+    were not terminated). Events reported after `close` are dropped and
+    counted in `dropped`."""
+
+    requires_timing = True
+
+    def __init__(self, output, buffer_size=1000, with_stack=True):
+        """
+        :Parameters:
+        - `output`: file name or a file-like object (opened in text mode)
+        - `buffer_size`: number of events to buffer before writing
+        - `with_stack`: include the call stack in event args
+        """
+        self.owns_output = isinstance(output, STRING_TYPES)
+        if self.owns_output:
+            output = open(output, 'w')
+        self.output = output
+        self.buffer_size = buffer_size
+        self.with_stack = with_stack
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.threads = set()
+        self.started = False
+        self.closed = False
+        self.dropped = 0
+
+    def report_mongo_command(self, command, traceback=None):
+        """Buffers the trace event of the command"""
+        started = command.get('started')
+        if started is None:
+            started = time.time()
+        args = dict((key, val) for key, val in command.items()
+                    if key not in ('started', 'duration'))
+        if self.with_stack and traceback is not None:
+            args['stack'] = format_stack(traceback)
+        thread = threading.current_thread()
+        event = {
+            'name': command.get('op'),
+            'cat': 'mongo',
+            'ph': 'X',
+            'ts': int(started * 1000000),
+            'dur': int(command.get('duration', 0) * 1000000),
+            'pid': self.pid,
+            'tid': thread.ident,
+            'args': args,
+        }
+        events = [mongodog.serialization.dumps(event)]
+        if thread.ident not in self.threads:
+            metadata = {'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                        'tid': thread.ident, 'args': {'name': thread.name}}
+            events.insert(0, mongodog.serialization.dumps(metadata))
+
+        with self.lock:
+            if self.closed:
+                self.dropped += 1
+                return
+            self.threads.add(thread.ident)
+            self.buffer.extend(events)
+            if len(self.buffer) >= self.buffer_size:
+                self.write_buffer()
+
+    def write_buffer(self):
+        """Writes buffered events to the output (caller holds the lock)"""
+        if not self.buffer or self.closed:
+            return
+        separator = ',\n' if self.started else '[\n'
+        self.output.write(separator + ',\n'.join(self.buffer))
+        self.buffer = []
+        self.started = True
+
+    def flush(self):
+        """Writes buffered events to the output"""
+        with self.lock:
+            self.write_buffer()
+            self.output.flush()
+
+    def close(self):
+        """Writes buffered events and terminates the JSON array"""
+        with self.lock:
+            if self.closed:
+                return
+            self.write_buffer()
+            self.output.write('\n]\n' if self.started else '[]\n')
+            self.closed = True
+            if self.owns_output:
+                self.output.close()
+            else:
+                self.output.flush()
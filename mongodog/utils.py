@@ -1,6 +1,20 @@
 # -*- coding: utf-8 -*-
 """Helper functions"""
 import sys
+import time
+
+import bson
+
+# most precise clock available for measuring durations
+timer = getattr(time, 'perf_counter', time.time)
+
+# modules, that are never considered to be the calling code
+LIBRARY_MODULES = ('mongodog', 'pymongo', 'mongokit', 'bson', 'gridfs')
+
+# command fields, that do not describe the command itself
+COMMAND_META_FIELDS = ('started', 'duration', 'error', 'nreturned', 'nbytes',
+                       'nbytes_sent', 'thread', 'truncated', 'ndocs',
+                       'batches', 'nested', 'continues', 'shape')
 
 
 def get_full_traceback(skip=0):
@@ -50,6 +64,34 @@ def get_full_traceback(skip=0):
     return head
 
 
+def is_included_in_outer_call(command):
+    """Returns True if the command is nested in another reported call, that
+    already includes its time and documents. Commands, that continue the
+    outer call (the documents fetched by the cursor of a reported find,
+    see Sniffer), are nested, but add their own time and documents."""
+    return bool(command.get('nested')) and not command.get('continues')
+
+
+def get_bson_size(document):
+    """Get the size of the document encoded as BSON (0 if it can not be
+    encoded)"""
+    if not isinstance(document, dict):
+        return 0
+    try:
+        return len(bson.BSON.encode(document))
+    except Exception:
+        return 0
+
+
+def get_documents_bson_size(documents):
+    """Get the total encoded BSON size of a document or a (nested) list of
+    documents"""
+    if isinstance(documents, (list, tuple)):
+        return sum(get_documents_bson_size(document)
+                   for document in documents)
+    return get_bson_size(documents)
+
+
 def get_pymongo_cursor_fields(cursor):
     """Get a dictionary with all (or most) significant field values of the
     pymongo Cursor object"""
@@ -63,3 +105,115 @@ def get_pymongo_cursor_fields(cursor):
               "kwargs")
     return {field: cursor.__dict__.get('_Cursor__%s' % field, None)
             for field in fields}
+
+
+def get_pymongo_command_cursor_collection(cursor):
+    """Get the collection of the pymongo CommandCursor object (e.g. returned
+    by aggregate), None if it is not known"""
+    for attribute in ('_CommandCursor__collection', '_collection',
+                      'collection'):
+        collection = getattr(cursor, attribute, None)
+        if collection is not None:
+            return collection
+    return None
+
+
+def iter_traceback_frames(traceback):
+    """Iterate over (module name, file name, line number, function name)
+    tuples of the traceback (outermost first). Works with both real and
+    `get_full_traceback` tracebacks."""
+    while traceback is not None:
+        frame = traceback.tb_frame
+        yield (frame.f_globals.get('__name__', ''),
+               frame.f_code.co_filename,
+               traceback.tb_lineno,
+               frame.f_code.co_name)
+        traceback = traceback.tb_next
+
+
+def is_library_module(module):
+    """Returns True if module belongs to mongodog or one of the libraries it
+    sniffs on"""
+    for library in LIBRARY_MODULES:
+        if module == library or module.startswith(library + '.'):
+            return True
+    return False
+
+
+def get_call_site(traceback):
+    """Get the innermost frame of the traceback, that belongs to the
+    application (not mongodog or pymongo).
+
+    :Returns:
+    A (file name, line number, function name) tuple or None.
+    """
+    call_site = None
+    for module, filename, lineno, name in iter_traceback_frames(traceback):
+        if not is_library_module(module):
+            call_site = filename, lineno, name
+    return call_site
+
+
+def get_caller_module():
+    """Get the name of the innermost module on the current stack, that
+    belongs to the application (not mongodog or pymongo). Cheaper than
+    capturing the full traceback."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not is_library_module(module):
+            return module
+        frame = frame.f_back
+    return None
+
+
+class ValueShape(object):
+    """Stands in for a value, that was not captured, keeping only its shape
+    (see `get_value_shape`)"""
+
+    __slots__ = ('shape',)
+
+    def __init__(self, shape):
+        self.shape = shape
+
+    def __eq__(self, other):
+        return isinstance(other, ValueShape) and self.shape == other.shape
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.shape)
+
+    def __repr__(self):
+        return '<%s>' % self.shape
+
+
+def get_value_shape(value):
+    """Get a canonical string describing the structure of the value (keys
+    and types), but not the values themselves. Lists are described by the
+    set of shapes of their items, so lists of different length, but same
+    kind of items, have the same shape."""
+    if isinstance(value, ValueShape):
+        return value.shape
+    if isinstance(value, dict):
+        items = sorted('%s:%s' % (key, get_value_shape(val))
+                       for key, val in value.items())
+        return '{%s}' % ','.join(items)
+    if isinstance(value, (list, tuple)):
+        items = sorted(set(get_value_shape(item) for item in value))
+        return '[%s]' % ','.join(items)
+    if value is None:
+        return 'null'
+    return type(value).__name__
+
+
+def get_command_shape(command):
+    """Get a canonical string identifying the kind of the command: op,
+    database, collection and the shape of the rest of the fields"""
+    rest = dict((key, val) for key, val in command.items()
+                if key not in ('op', 'db', 'collection') and
+                key not in COMMAND_META_FIELDS)
+    return '%s %s.%s %s' % (command.get('op'), command.get('db'),
+                            command.get('collection'),
+                            get_value_shape(rest))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Defines WSGI middleware, that counts mongo queries of every request and
+warns about requests, that go over the configured budgets.
+"""
+import logging
+import random
+
+import mongodog.scope
+from mongodog.sniffer import Sniffer
+
+
+class ScopedResponse(object):
+    """Response iterable, that closes the request's scope once the response
+    is closed"""
+
+    def __init__(self, result, on_close):
+        self.result = result
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        """Closes the wrapped response and then the scope"""
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.on_close()
+
+
+class MongoBudgetMiddleware(object):
+    """Opens a sniffing scope for every (sampled) request, counts queries,
+    mongo time and returned documents, puts the scope into the WSGI environ
+    and the numbers into response headers, and logs a warning with the most
+    expensive call sites, when the request goes over the budget.
+
+    Headers reflect the queries made before the application called
+    `start_response`; the budget check covers the whole request, including
+    iterating the response."""
+
+    def __init__(self, app, max_queries=None, max_time=None, sample_rate=1.0,
+                 headers=True, logger='mongodog.wsgi',
+                 environ_key='mongodog.scope', sniffer=None):
+        """
+        :Parameters:
+        - `app`: WSGI application
+        - `max_queries`: query count budget of a request (None - unlimited)
+        - `max_time`: total mongo time budget of a request in seconds
+        - `sample_rate`: fraction of requests to sniff
+        - `headers`: add X-Mongodog-* headers to responses
+        - `logger`: logging.Logger or logger name to warn to
+        - `environ_key`: WSGI environ key to put the scope under
+        - `sniffer`: Sniffer to use, by default one reporting to
+        `mongodog.scope.ScopeReporter` only while a scope is open
+        """
+        self.app = app
+        self.max_queries = max_queries
+        self.max_time = max_time
+        self.sample_rate = sample_rate
+        self.headers = headers
+        if not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.environ_key = environ_key
+        if sniffer is None:
+            sniffer = Sniffer(mongodog.scope.ScopeReporter(),
+                              condition=mongodog.scope.has_active_scope)
+        self.sniffer = sniffer
+        self.sniffer.start()
+
+    def stop(self):
+        """Stops sniffing"""
+        self.sniffer.stop()
+
+    def is_sampled(self):
+        """Returns True if the request should be sniffed"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def over_budget(self, scope):
+        """Returns True if the scope went over any of the budgets"""
+        return ((self.max_queries is not None and
+                 scope.queries > self.max_queries) or
+                (self.max_time is not None and scope.duration > self.max_time))
+
+    def response_headers(self, scope):
+        """Returns the list of headers describing the scope"""
+        return [
+            ('X-Mongodog-Queries', '%d' % scope.queries),
+            ('X-Mongodog-Time', '%.3f' % (scope.duration * 1000)),
+            ('X-Mongodog-Documents', '%d' % scope.nreturned),
+        ]
+
+    def finish(self, scope, environ):
+        """Closes the scope and checks the budgets"""
+        mongodog.scope.close_scope(scope)
+        if not self.over_budget(scope):
+            return
+        summary = scope.summary()
+        call_sites = '; '.join('%s (%d queries, %.3f ms)' % (
+            row['call_site'], row['count'], row['duration'] * 1000)
+            for row in summary['call_sites'])
+        self.logger.warning(
+            "mongodog: %s went over budget: %d queries, %.3f ms of mongo "
+            "time, top call sites: %s", scope.name, scope.queries,
+            scope.duration * 1000, call_sites,
+            extra={'mongodog': summary})
+
+    def __call__(self, environ, start_response):
+        if not self.is_sampled():
+            return self.app(environ, start_response)
+
+        name = '%s %s' % (environ.get('REQUEST_METHOD'),
+                          environ.get('PATH_INFO'))
+        scope = mongodog.scope.open_scope(name)
+        environ[self.environ_key] = scope
+
+        def scoped_start_response(status, headers, exc_info=None):
+            """Adds scope headers to the response"""
+            if self.headers:
+                headers = list(headers) + self.response_headers(scope)
+            if exc_info is None:
+                return start_response(status, headers)
+            return start_response(status, headers, exc_info)
+
+        try:
+            result = self.app(environ, scoped_start_response)
+        except BaseException:
+            # also e.g. gevent's Timeout, the scope must not leak into later
+            # requests of the thread
+            self.finish(scope, environ)
+            raise
+        return ScopedResponse(result, lambda: self.finish(scope, environ))
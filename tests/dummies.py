@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Defines stand-ins for pymongo collections and cursors and sniffers of them,
+shared by unit tests
+"""
+import mongodog.sniffer
+
+
+class DummyCollection(object):
+    """Stands in for a pymongo collection"""
+
+    class Database(object):
+        name = 'test'
+
+    database = Database()
+
+    def __init__(self, name='dummy'):
+        self.name = name
+
+    def insert(self, doc_or_docs, **kwargs):
+        return doc_or_docs
+
+    def find(self, spec=None, **kwargs):
+        return DummyCursor(self, [{'a': 1}])
+
+    def find_one(self, spec_or_id=None, **kwargs):
+        for document in self.find(spec_or_id):
+            return document
+
+    def count(self):
+        return 0
+
+    def distinct(self, key):
+        return []
+
+
+class DummyCursor(object):
+    """Stands in for a pymongo cursor"""
+
+    def __init__(self, collection, documents):
+        self.collection = collection
+        self.documents = list(documents)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self.documents:
+            raise StopIteration()
+        return self.documents.pop(0)
+
+    __next__ = next
+
+
+class DummySniffer(mongodog.sniffer.Sniffer):
+    """Sniffer of DummyCollection inserts and find_ones"""
+
+    config = [('collection_insert', DummyCollection, 'insert'),
+              ('collection_find_one', DummyCollection, 'find_one')]
+
+
+class FindSniffer(mongodog.sniffer.Sniffer):
+    """Sniffer of DummyCollection finds and DummyCursor iteration (and
+    fetches, when sizes or timing are enabled), find_one reports the find
+    and the iteration behind it as nested"""
+
+    config = [('collection_find', DummyCollection, 'find'),
+              ('collection_find_one', DummyCollection, 'find_one'),
+              ('cursor_iter', DummyCursor, '__iter__'),
+              ('cursor_next', DummyCursor, 'next'),
+              ('cursor_next', DummyCursor, '__next__')]
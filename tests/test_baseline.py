@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog query shape baselines"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import mongodog.baseline
+import mongodog.sniffer
+from dummies import DummyCollection
+
+
+class AggregatingCollection(DummyCollection):
+    """DummyCollection, whose aggregate issues a distinct"""
+
+    def aggregate(self, pipeline):
+        return self.distinct('a')
+
+
+class DummySniffer(mongodog.sniffer.Sniffer):
+    """Sniffer of DummyCollection"""
+    config = [('collection_count', DummyCollection, 'count'),
+              ('collection_distinct', DummyCollection, 'distinct'),
+              ('collection_aggregate', AggregatingCollection, 'aggregate')]
+
+
+class TestShapeBaseline(unittest.TestCase):
+    """Unit tests for ShapeBaseline and compare"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'baseline.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def scenario(self, counts=1, distinct=False):
+        collection = DummyCollection('users')
+        with mongodog.baseline.ShapeBaseline(self.path, update=False, sniffer_class=DummySniffer):
+            for _ in range(counts):
+                collection.count()
+            if distinct:
+                collection.distinct('a')
+
+    def test_writes_baseline_when_missing(self):
+        """ShapeBaseline writes sorted, indented baseline when there is none"""
+        self.scenario(2)
+
+        baseline = mongodog.baseline.load_baseline(self.path)
+        self.assertEqual(['collection_count test.users {}'], list(baseline))
+        entry = baseline['collection_count test.users {}']
+        self.assertEqual(2, entry['count'])
+        self.assertEqual(1, len(entry['call_sites']))
+        self.assertTrue(entry['call_sites'][0].endswith('test_baseline.py:scenario'))
+        with open(self.path) as baseline_file:
+            self.assertLess(5, len(baseline_file.readlines()))
+
+    def test_passes_when_shapes_match(self):
+        """ShapeBaseline passes when the shapes and counts did not grow"""
+        self.scenario(2)
+        self.scenario(1)
+
+    def test_fails_on_new_shapes_and_count_increases(self):
+        """ShapeBaseline fails listing new shapes and count increases"""
+        self.scenario(1)
+        try:
+            self.scenario(2, distinct=True)
+        except AssertionError as error:
+            message = str(error)
+        else:
+            self.fail('AssertionError not raised')
+
+        self.assertIn('new: collection_distinct test.users {key:str} (1)', message)
+        self.assertIn('increased: collection_count test.users {} (1 -> 2)', message)
+
+    def test_records_only_outermost_calls(self):
+        """ShapeBaseline does not record calls made within other sniffed calls"""
+        with mongodog.baseline.ShapeBaseline(self.path, update=True, sniffer_class=DummySniffer):
+            AggregatingCollection('users').aggregate([])
+
+        baseline = mongodog.baseline.load_baseline(self.path)
+        self.assertEqual(['collection_aggregate test.users {pipeline:[]}'], list(baseline))
+
+    def test_compare_respects_tolerance_and_reports_removed_shapes(self):
+        """compare ignores increases within tolerance and lists removed shapes"""
+        baseline = {'a': {'count': 10, 'call_sites': []}, 'b': {'count': 1, 'call_sites': []}}
+        current = {'a': {'count': 11, 'call_sites': []}}
+
+        diff = mongodog.baseline.compare(baseline, current, tolerance=0.1)
+        self.assertFalse(diff.regressed)
+        self.assertEqual([('b', baseline['b'])], diff.removed)
+        self.assertTrue(mongodog.baseline.compare(baseline, current).regressed)
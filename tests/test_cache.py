@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog request-scoped cache"""
+import unittest
+
+import mongodog.cache
+from mongodog.reporters import MemoryReporter
+import dummies
+
+
+class DummyCollection(dummies.DummyCollection):
+    """DummyCollection, that counts the calls, that reach it"""
+
+    calls = []
+
+    def find_one(self, spec_or_id=None, **kwargs):
+        self.calls.append('find_one')
+        return {'_id': spec_or_id, 'tags': []}
+
+    def count(self):
+        self.calls.append('count')
+        return 3
+
+    def update(self, spec, document, **kwargs):
+        self.calls.append('update')
+
+    def update_one(self, filter, update, **kwargs):
+        self.calls.append('update_one')
+
+
+class DummyCache(mongodog.cache.RequestCache):
+    """RequestCache of DummyCollection"""
+
+    config = [('collection_find_one', DummyCollection, 'find_one'),
+              ('collection_count', DummyCollection, 'count'),
+              ('collection_update', DummyCollection, 'update'),
+              ('collection_update_one', DummyCollection, 'update_one')]
+
+
+def load_user(user_id):
+    """Application code reading a user"""
+    return DummyCollection('users').find_one(user_id)
+
+
+class TestRequestCache(unittest.TestCase):
+    """Unit tests for RequestCache class"""
+
+    def setUp(self):
+        del DummyCollection.calls[:]
+        self.cache = DummyCache()
+        self.cache.start()
+
+    def tearDown(self):
+        self.cache.stop()
+
+    def test_repeated_reads_are_answered_from_cache(self):
+        """RequestCache answers repeated reads with the same arguments from memory"""
+        with self.cache.request():
+            first = load_user(1)
+            first['tags'].append('modified')
+            second = load_user(1)
+            load_user(2)
+            DummyCollection('users').count()
+            DummyCollection('users').count()
+
+        self.assertEqual(['find_one', 'find_one', 'count'], DummyCollection.calls)
+        self.assertEqual({'_id': 1, 'tags': []}, second)
+
+    def test_writes_invalidate_the_collection(self):
+        """RequestCache forgets cached reads of the collection, that was written to"""
+        with self.cache.request():
+            load_user(1)
+            DummyCollection('other').update({}, {})
+            load_user(1)
+            DummyCollection('users').update({'_id': 1}, {'$set': {'a': 1}})
+            load_user(1)
+
+        self.assertEqual(['find_one', 'update', 'update', 'find_one'], DummyCollection.calls)
+
+    def test_crud_writes_invalidate_the_collection(self):
+        """RequestCache forgets cached reads on writes made with the pymongo 3.x+ CRUD API"""
+        with self.cache.request():
+            load_user(1)
+            DummyCollection('users').update_one({'_id': 1}, {'$set': {'a': 1}})
+            load_user(1)
+
+        self.assertEqual(['find_one', 'update_one', 'find_one'], DummyCollection.calls)
+
+    def test_nothing_is_cached_outside_of_requests(self):
+        """RequestCache does not touch calls outside of requests, each request has its own cache"""
+        load_user(1)
+        with self.cache.request():
+            load_user(1)
+        with self.cache.request():
+            load_user(1)
+
+        self.assertEqual(['find_one'] * 3, DummyCollection.calls)
+
+    def test_hit_rates_per_call_site(self):
+        """RequestCache counts hits and misses per call site"""
+        with self.cache.request():
+            for _ in range(4):
+                load_user(1)
+
+        (call_site, (hits, misses, rate)), = self.cache.hit_rates().items()
+        self.assertEqual('load_user', call_site[2])
+        self.assertEqual((3, 1, 0.75), (hits, misses, rate))
+
+    def test_misses_are_reported(self):
+        """RequestCache passes reads, that were not cached, to the reporter"""
+        reporter = MemoryReporter()
+        cache = DummyCache(reporter)
+        cache.start()
+        try:
+            with cache.request():
+                load_user(1)
+                load_user(1)
+        finally:
+            cache.stop()
+
+        self.assertEqual(['collection_find_one'], [command['op'] for command, _ in reporter.reported_commands])
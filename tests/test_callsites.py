@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog call site reporter"""
+import unittest
+
+import mongodog.callsites
+import mongodog.utils
+from dummies import DummyCollection, FindSniffer
+
+
+def dummy_cheap_call_site():
+    """Returns the traceback of the cheap call site"""
+    return mongodog.utils.get_full_traceback()
+
+
+def dummy_expensive_call_site():
+    """Returns the traceback of the expensive call site"""
+    return mongodog.utils.get_full_traceback()
+
+
+class TestCallSiteReporter(unittest.TestCase):
+    """Unit tests for CallSiteReporter class"""
+
+    def setUp(self):
+        self.reporter = mongodog.callsites.CallSiteReporter()
+        self.reporter.report_mongo_command({'duration': 0.1, 'nreturned': 1, 'nbytes': 100},
+                                           dummy_cheap_call_site())
+        self.reporter.report_mongo_command({'duration': 0.5, 'nreturned': 10}, dummy_expensive_call_site())
+        self.reporter.report_mongo_command({'duration': 0.3, 'error': 'boom'}, dummy_expensive_call_site())
+
+    def test_aggregates_cost_per_call_site(self):
+        """CallSiteReporter aggregates cost by the innermost application frame"""
+        rows = mongodog.callsites.rank(self.reporter.snapshot())
+
+        self.assertEqual(['dummy_expensive_call_site', 'dummy_cheap_call_site'],
+                         [call_site[2] for call_site, _ in rows])
+        stats = rows[0][1]
+        self.assertEqual(2, stats.count)
+        self.assertAlmostEqual(0.8, stats.total)
+        self.assertEqual(0.5, stats.max)
+        self.assertEqual(10, stats.nreturned)
+        self.assertEqual(1, stats.errors)
+
+    def test_ranks_by_any_column(self):
+        """rank orders call sites by the requested column and limits the rows"""
+        rows = mongodog.callsites.rank(self.reporter.snapshot(), order_by='nbytes', limit=1)
+        self.assertEqual(1, len(rows))
+        self.assertEqual('dummy_cheap_call_site', rows[0][0][2])
+        self.assertRaises(ValueError, mongodog.callsites.rank, {}, 'unknown')
+
+    def test_diff_between_snapshots(self):
+        """diff_snapshots returns only the cost between the snapshots"""
+        before = self.reporter.snapshot()
+        self.reporter.report_mongo_command({'duration': 0.2}, dummy_cheap_call_site())
+        diff = mongodog.callsites.diff_snapshots(before, self.reporter.snapshot())
+
+        self.assertEqual(1, len(diff))
+        stats = list(diff.values())[0]
+        self.assertEqual(1, stats.count)
+        self.assertAlmostEqual(0.2, stats.total)
+
+    def test_formats_table(self):
+        """format_table outputs header and a line per call site"""
+        table = mongodog.callsites.format_table(mongodog.callsites.rank(self.reporter.snapshot()))
+        lines = table.splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].endswith('in dummy_expensive_call_site'))
+
+    def test_nested_calls_are_not_added(self):
+        """CallSiteReporter charges find_one once, not also the find and the iteration behind it"""
+        reporter = mongodog.callsites.CallSiteReporter()
+        sniffer = FindSniffer(reporter)
+        sniffer.start()
+        try:
+            DummyCollection().find_one({'a': 1})
+        finally:
+            sniffer.stop()
+
+        rows = mongodog.callsites.rank(reporter.snapshot())
+        self.assertEqual([('test_nested_calls_are_not_added', 1)],
+                         [(call_site[2], stats.count) for call_site, stats in rows])
+        self.assertEqual(1, rows[0][1].nreturned)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog workload capture"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import bson
+import pymongo
+
+import mongodog.capture
+import mongodog.sniffer
+import mongodog.utils
+
+
+class FanOutReporter(object):
+    """Reports commands to all the reporters and remembers them"""
+
+    def __init__(self, *reporters):
+        self.reporters = reporters
+        self.commands = []
+
+    def report_mongo_command(self, command, traceback=None):
+        self.commands.append(command)
+        for reporter in self.reporters:
+            reporter.report_mongo_command(command, traceback)
+
+
+class TestCaptureReporter(unittest.TestCase):
+    """Unit tests for CaptureReporter class and read_capture function"""
+
+    def test_commands_are_read_back_with_bson_types(self):
+        """CaptureReporter writes commands, that read_capture decodes back"""
+        output = io.StringIO()
+        reporter = mongodog.capture.CaptureReporter(output)
+        object_id = bson.ObjectId()
+        reporter.report_mongo_command({'op': 'collection_find_one', 'db': 'test', 'collection': 'foo',
+                                       'spec_or_id': {'_id': object_id}, 'started': 12.5, 'duration': 0.25})
+        reporter.report_mongo_command({'op': 'collection_count', 'db': 'test', 'collection': 'foo',
+                                       'started': 13.0, 'duration': 0.5})
+
+        output.seek(0)
+        commands = list(mongodog.capture.read_capture(output))
+        self.assertEqual(2, len(commands))
+        self.assertEqual({'_id': object_id}, commands[0]['spec_or_id'])
+        self.assertEqual(12.5, commands[0]['started'])
+        self.assertIn('thread', commands[0])
+        self.assertEqual('collection_count', commands[1]['op'])
+
+    def test_capture_file_by_name(self):
+        """CaptureReporter writes into the named file, read_capture reads it"""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'capture.jsonl')
+            reporter = mongodog.capture.CaptureReporter(path)
+            reporter.report_mongo_command({'op': 'collection_count', 'started': 1.0})
+            reporter.close()
+
+            self.assertEqual(['collection_count'],
+                             [command['op'] for command in mongodog.capture.read_capture(path)])
+        finally:
+            shutil.rmtree(directory)
+
+
+def dummy_commands(count):
+    """Returns `count` commands, one per second, with two shapes"""
+    commands = []
+    for i in range(count):
+        spec = {'a': i} if i % 2 else {'b': 'x%d' % i}
+        commands.append({'op': 'collection_find', 'db': 'test', 'collection': 'foo',
+                         'spec': spec, 'started': 100.0 + i, 'duration': 0.1})
+    return commands
+
+
+class TestBlockCapture(unittest.TestCase):
+    """Unit tests for BlockCaptureReporter and BlockCaptureReader classes"""
+
+    def capture(self, commands, close=True, **kwargs):
+        """Returns binary capture of the commands"""
+        output = io.BytesIO()
+        reporter = mongodog.capture.BlockCaptureReporter(output, block_size=4, **kwargs)
+        for command in commands:
+            reporter.report_mongo_command(command)
+        if close:
+            reporter.close()
+        else:
+            reporter.flush()
+        output.seek(0)
+        return output
+
+    def test_commands_are_read_back(self):
+        """BlockCaptureReader reads all commands from all blocks"""
+        commands = dummy_commands(10)
+        reader = mongodog.capture.BlockCaptureReader(self.capture(commands))
+
+        self.assertEqual([4, 4, 2], [block['count'] for block in reader.blocks])
+        self.assertEqual([0, 4, 8], [block['first_record'] for block in reader.blocks])
+        self.assertEqual([command['spec'] for command in commands],
+                         [command['spec'] for command in reader.read()])
+
+    def test_time_window_decompresses_only_covering_blocks(self):
+        """BlockCaptureReader only reads blocks covering the time window"""
+        reader = mongodog.capture.BlockCaptureReader(self.capture(dummy_commands(10)))
+
+        self.assertEqual([1], [block['first_record'] // 4 for block in reader.matching_blocks(104.5, 106.0)])
+        self.assertEqual([105.0, 106.0], [command['started'] for command in reader.read(104.5, 106.0)])
+
+    def test_shape_filter(self):
+        """BlockCaptureReader only returns commands with requested shapes"""
+        commands = dummy_commands(10)
+        shape = mongodog.utils.get_command_shape(commands[1])
+        started = [command['started'] for command in mongodog.capture.read_capture(self.capture(commands),
+                                                                                     shapes=[shape])]
+
+        self.assertEqual([101.0, 103.0, 105.0, 107.0, 109.0], started)
+
+    def test_shape_filter_matches_shapes_of_sniffed_commands(self):
+        """Captures are filtered on the shapes of the sniffed commands, not of the decoded records"""
+        lines = io.StringIO()
+        blocks = io.BytesIO()
+        reporter = FanOutReporter(mongodog.capture.CaptureReporter(lines),
+                                  mongodog.capture.BlockCaptureReporter(blocks, block_size=4))
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, ops=['collection_find'])
+        sniffer.start()
+        try:
+            pymongo.MongoClient('mongodb://localhost:1', connect=False)['test']['foo'].find({'a': 1})
+        finally:
+            sniffer.stop()
+        reporter.reporters[1].close()
+        shape = mongodog.utils.get_command_shape(reporter.commands[0])
+
+        for output in (lines, blocks):
+            output.seek(0)
+            self.assertEqual([shape], [command['shape'] for command in
+                                       mongodog.capture.read_capture(output, shapes=[shape])])
+
+    def test_unclosed_capture_is_recovered(self):
+        """BlockCaptureReader scans blocks of captures without index"""
+        reader = mongodog.capture.BlockCaptureReader(self.capture(dummy_commands(6), close=False))
+
+        self.assertEqual([4, 2], [block['count'] for block in reader.blocks])
+        self.assertEqual(6, len(list(reader.read(start=100.0))))
+
+    @unittest.skipIf(mongodog.capture.lzma is None, "lzma is not available")
+    def test_lzma_compression(self):
+        """BlockCaptureReader detects lzma compression"""
+        reader = mongodog.capture.BlockCaptureReader(self.capture(dummy_commands(3), compression='lzma'))
+
+        self.assertEqual('lzma', reader.compression)
+        self.assertEqual(3, len(list(reader.read())))
+
+    def test_read_capture_detects_json_lines(self):
+        """read_capture reads plain JSON lines captures"""
+        output = io.BytesIO()
+        for command in dummy_commands(3):
+            output.write((mongodog.capture.create_record(command) + '\n').encode('utf-8'))
+        output.seek(0)
+
+        self.assertEqual([102.0], [command['started'] for command in
+                                   mongodog.capture.read_capture(output, start=101.5)])
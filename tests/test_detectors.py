@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog detectors"""
+import threading
+import unittest
+
+import mongodog.detectors
+import mongodog.utils
+
+
+def dummy_insert_loop(detector, count, started=0.0, duration=0.01):
+    """Reports `count` single document inserts from one stack"""
+    for i in range(count):
+        command = {'op': 'collection_insert', 'db': 'test', 'collection': 'foo',
+                   'doc_or_docs': {'a': i}, 'started': started + i * duration, 'duration': duration}
+        detector.report_mongo_command(command, mongodog.utils.get_full_traceback())
+
+
+class TestBulkWriteDetector(unittest.TestCase):
+    """Unit tests for BulkWriteDetector class"""
+
+    def setUp(self):
+        self.findings = []
+        self.detector = mongodog.detectors.BulkWriteDetector(min_run=3, callback=self.findings.append,
+                                                             background=False)
+
+    def test_reports_runs_of_single_document_writes(self):
+        """BulkWriteDetector reports a run of writes from the same stack once it ends"""
+        dummy_insert_loop(self.detector, 10)
+        self.assertEqual([], self.findings)
+        self.detector.flush()
+
+        self.assertEqual(1, len(self.findings))
+        finding = self.findings[0]
+        self.assertEqual(10, finding['length'])
+        self.assertEqual('foo', finding['collection'])
+        self.assertAlmostEqual(0.1, finding['total_duration'])
+        self.assertAlmostEqual(0.09, finding['estimated_savings'])
+        self.assertEqual('dummy_insert_loop', finding['call_site'][2])
+
+    def test_gap_longer_than_window_ends_the_run(self):
+        """BulkWriteDetector ends the run, when writes are further apart than the window"""
+        dummy_insert_loop(self.detector, 4)
+        dummy_insert_loop(self.detector, 1, started=10.0)
+
+        self.assertEqual([4], [finding['length'] for finding in self.findings])
+
+    def test_short_runs_and_batched_writes_are_ignored(self):
+        """BulkWriteDetector ignores runs shorter than min_run and multi document writes"""
+        dummy_insert_loop(self.detector, 2)
+        for i in range(5):
+            self.detector.report_mongo_command(
+                {'op': 'collection_insert', 'doc_or_docs': [{}, {}], 'started': i, 'duration': 0})
+            self.detector.report_mongo_command(
+                {'op': 'collection_update', 'multi': True, 'started': i, 'duration': 0})
+        self.detector.flush()
+
+        self.assertEqual([], self.findings)
+
+    def test_number_of_open_runs_is_bounded(self):
+        """BulkWriteDetector keeps no more than max_runs open runs"""
+        detector = mongodog.detectors.BulkWriteDetector(min_run=1, max_runs=2, callback=self.findings.append,
+                                                        background=False)
+        for name in ('a', 'b', 'c'):
+            detector.report_mongo_command({'op': 'collection_save', 'collection': name,
+                                           'started': 0, 'duration': 0})
+
+        self.assertEqual(2, len(detector.runs))
+        self.assertEqual(['a'], [finding['collection'] for finding in self.findings])
+
+    def test_background_thread_reports_idle_runs(self):
+        """BulkWriteDetector reports the last run, even if no more writes arrive"""
+        reported = threading.Event()
+
+        def callback(finding):
+            self.findings.append(finding)
+            reported.set()
+
+        detector = mongodog.detectors.BulkWriteDetector(min_run=3, callback=callback, interval=0.01,
+                                                        clock=lambda: 100.0)
+        try:
+            dummy_insert_loop(detector, 5)
+            reported.wait(5)
+        finally:
+            detector.close()
+
+        self.assertEqual([5], [finding['length'] for finding in self.findings])
+        self.assertEqual(0, len(detector.runs))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog flame graph reporter"""
+import unittest
+import xml.dom.minidom
+
+import mongodog.flamegraph
+import mongodog.utils
+from dummies import DummyCollection, FindSniffer
+
+
+def dummy_flame_caller():
+    """Returns the traceback of the caller"""
+    return mongodog.utils.get_full_traceback()
+
+
+class TestFlameGraphReporter(unittest.TestCase):
+    """Unit tests for FlameGraphReporter class"""
+
+    def test_aggregates_folded_stacks_by_count(self):
+        """FlameGraphReporter counts commands per folded stack"""
+        reporter = mongodog.flamegraph.FlameGraphReporter()
+        command = {'op': 'collection_find', 'db': 'test', 'collection': 'foo'}
+        reporter.report_mongo_command(command, dummy_flame_caller())
+        reporter.report_mongo_command(command, dummy_flame_caller())
+
+        lines = reporter.folded()
+        self.assertEqual(1, len(lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertEqual('2', count)
+        frames = stack.split(';')
+        self.assertEqual('%s:dummy_flame_caller' % __name__, frames[-2])
+        self.assertEqual('collection_find_test.foo', frames[-1])
+
+    def test_weights_stacks_by_duration(self):
+        """FlameGraphReporter can weight stacks by mongo time in microseconds"""
+        reporter = mongodog.flamegraph.FlameGraphReporter('duration')
+        self.assertTrue(reporter.requires_timing)
+        reporter.report_mongo_command({'op': 'collection_count', 'duration': 0.25})
+        reporter.report_mongo_command({'op': 'collection_count', 'duration': 0.5})
+
+        self.assertEqual(['collection_count_None.None 750000'], reporter.folded())
+
+    def test_nested_calls_are_not_added(self):
+        """FlameGraphReporter counts find_one once, not also the find and the iteration behind it"""
+        reporter = mongodog.flamegraph.FlameGraphReporter()
+        sniffer = FindSniffer(reporter)
+        sniffer.start()
+        try:
+            DummyCollection().find_one({'a': 1})
+        finally:
+            sniffer.stop()
+
+        self.assertEqual(['collection_find_one_test.dummy 1'],
+                         [line.rsplit(';', 1)[1] for line in reporter.folded()])
+
+    def test_raises_value_error_on_unknown_weight(self):
+        """FlameGraphReporter raises ValueError on unknown weight"""
+        self.assertRaises(ValueError, mongodog.flamegraph.FlameGraphReporter, 'bytes')
+
+
+class TestRenderSvg(unittest.TestCase):
+    """Unit tests for render_svg function"""
+
+    def test_renders_a_rectangle_per_frame(self):
+        """render_svg renders valid SVG with a rectangle per frame"""
+        stacks = mongodog.flamegraph.parse_folded(['a;b 3\n', 'a;c<& 1\n', '\n'])
+        svg = mongodog.flamegraph.render_svg(stacks)
+
+        document = xml.dom.minidom.parseString(svg)
+        titles = [node.firstChild.data for node in document.getElementsByTagName('title')]
+        self.assertEqual(['all (4 calls, 100.00%)', 'a (4 calls, 100.00%)',
+                          'b (3 calls, 75.00%)', 'c<& (1 calls, 25.00%)'], titles)
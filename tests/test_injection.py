@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog fault injection"""
+import unittest
+
+import mongodog.injection
+import mongodog.utils
+from mongodog.reporters import MemoryReporter
+import dummies
+
+
+class DummyCollection(dummies.DummyCollection):
+    """DummyCollection, that counts the calls, that reach it"""
+
+    calls = []
+
+    def find_one(self, spec_or_id=None, **kwargs):
+        self.calls.append(('find_one', self.name))
+        return {'_id': spec_or_id}
+
+    def insert(self, doc_or_docs, **kwargs):
+        self.calls.append(('insert', self.name))
+        return doc_or_docs
+
+
+class DummyInjector(mongodog.injection.FaultInjector):
+    """FaultInjector of DummyCollection"""
+
+    config = [('collection_find_one', DummyCollection, 'find_one'),
+              ('collection_insert', DummyCollection, 'insert')]
+
+
+class TestFaultInjector(unittest.TestCase):
+    """Unit tests for FaultInjector class"""
+
+    def setUp(self):
+        del DummyCollection.calls[:]
+        self.sleeps = []
+        self.injector = DummyInjector(sleep=self.sleeps.append, random=lambda: 0.5)
+        self.injector.start()
+
+    def tearDown(self):
+        self.injector.stop()
+
+    def test_latency_is_added_to_matching_calls(self):
+        """FaultInjector delays calls matching the fault"""
+        fault = self.injector.add_fault(mongodog.injection.Fault(collection='users', latency=0.2))
+        DummyCollection('users').find_one(1)
+        DummyCollection('other').find_one(1)
+
+        self.assertEqual([0.2], self.sleeps)
+        self.assertEqual(1, fault.injected)
+        self.assertEqual(2, len(DummyCollection.calls))
+
+    def test_errors_replace_the_call(self):
+        """FaultInjector raises the fault's error instead of making the call"""
+        self.injector.set_faults([{'op': 'collection_insert', 'error': 'socket.timeout'}])
+
+        import socket
+        self.assertRaises(socket.timeout, DummyCollection().insert, {'a': 1})
+        self.assertEqual([], DummyCollection.calls)
+
+    def test_probability_and_shape(self):
+        """FaultInjector applies faults to matching shapes with the given probability"""
+        reporter = MemoryReporter()
+        injector = DummyInjector(reporter=reporter, sleep=self.sleeps.append, random=lambda: 0.5)
+        injector.start()
+        try:
+            DummyCollection('users').find_one({'email': 'x'})
+            shape = mongodog.utils.get_command_shape(reporter.reported_commands[0][0])
+            injector.set_faults([mongodog.injection.Fault(shape=shape, latency=0.1, probability=0.6),
+                                 mongodog.injection.Fault(latency=0.3, probability=0.4)])
+            DummyCollection('users').find_one({'email': 'a@b.c'})
+            DummyCollection('users').find_one({'_id': 1})
+        finally:
+            injector.stop()
+
+        # the first fault matches the first call, the second fault matches the other call, but is not sampled
+        self.assertEqual([0.1], self.sleeps)
+
+    def test_pause_and_resume(self):
+        """FaultInjector does not inject faults while paused"""
+        self.injector.add_fault(mongodog.injection.Fault(latency=0.1))
+        self.injector.pause()
+        DummyCollection().find_one(1)
+        self.injector.resume()
+        DummyCollection().find_one(1)
+
+        self.assertEqual([0.1], self.sleeps)
+
+    def test_calls_are_reported(self):
+        """FaultInjector passes calls to the reporter, if there is one"""
+        reporter = MemoryReporter()
+        injector = DummyInjector([mongodog.injection.Fault(latency=0.01)], reporter, sleep=self.sleeps.append)
+        injector.start()
+        try:
+            DummyCollection().find_one(1)
+        finally:
+            injector.stop()
+
+        self.assertEqual(1, len(reporter.reported_commands))
+
+    def test_jitter_and_distributions(self):
+        """Fault delay adds jitter to the latency, that may come from a distribution"""
+        fault = mongodog.injection.Fault(latency=mongodog.injection.exponential(0.05), jitter=0.01)
+        delays = [fault.delay() for _ in range(100)]
+
+        self.assertTrue(all(delay >= 0 for delay in delays))
+        self.assertNotEqual(1, len(set(delays)))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog metrics reporter"""
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    # python2
+    from urllib2 import urlopen
+
+import mongodog.metrics
+from dummies import DummyCollection, FindSniffer
+
+
+class TestHistogram(unittest.TestCase):
+    """Unit tests for Histogram class"""
+
+    def test_cumulative_counts_include_upper_bounds(self):
+        """Histogram counts values up to and including the bucket upper bound"""
+        histogram = mongodog.metrics.Histogram([1, 2])
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual([(1, 2), (2, 3), (float('inf'), 4)], histogram.cumulative())
+        self.assertEqual(4, histogram.count)
+        self.assertEqual(6.0, histogram.sum)
+
+
+class TestMetricsReporter(unittest.TestCase):
+    """Unit tests for MetricsReporter class"""
+
+    def setUp(self):
+        self.reporter = mongodog.metrics.MetricsReporter(buckets=[0.1, 1])
+        self.reporter.report_mongo_command(
+            {'db': 'test', 'collection': 'foo', 'op': 'collection_find', 'duration': 0.05})
+        self.reporter.report_mongo_command(
+            {'db': 'test', 'collection': 'foo', 'op': 'collection_find', 'duration': 0.5, 'error': 'boom'})
+
+    def test_nested_calls_are_not_counted(self):
+        """MetricsReporter counts find_one once, not also the find and the iteration behind it"""
+        reporter = mongodog.metrics.MetricsReporter()
+        sniffer = FindSniffer(reporter)
+        sniffer.start()
+        try:
+            DummyCollection().find_one({'a': 1})
+        finally:
+            sniffer.stop()
+
+        self.assertEqual([(('test', 'dummy', 'collection_find_one'), 1, 1)],
+                         [(key, calls, count) for key, calls, _, _, _, count in reporter.snapshot()])
+
+    def test_renders_prometheus_text_format(self):
+        """MetricsReporter renders counters and histograms per db, collection and op"""
+        text = self.reporter.render()
+        labels = 'db="test",collection="foo",op="collection_find"'
+
+        self.assertIn('# TYPE mongodog_commands_total counter', text)
+        self.assertIn('mongodog_commands_total{%s} 2' % labels, text)
+        self.assertIn('mongodog_command_errors_total{%s} 1' % labels, text)
+        self.assertIn('mongodog_command_duration_seconds_bucket{%s,le="0.1"} 1' % labels, text)
+        self.assertIn('mongodog_command_duration_seconds_bucket{%s,le="1.0"} 2' % labels, text)
+        self.assertIn('mongodog_command_duration_seconds_bucket{%s,le="+Inf"} 2' % labels, text)
+        self.assertIn('mongodog_command_duration_seconds_count{%s} 2' % labels, text)
+
+    def test_escapes_label_values(self):
+        """MetricsReporter escapes quotes in label values"""
+        self.reporter.report_mongo_command({'op': 'dummy', 'collection': 'a"b'})
+        self.assertIn('collection="a\\"b"', self.reporter.render())
+
+    def test_writes_metrics_to_file(self):
+        """MetricsReporter writes metrics to a file"""
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'mongodog.prom')
+            self.reporter.write_to_file(path)
+            with open(path) as metrics_file:
+                self.assertEqual(self.reporter.render(), metrics_file.read())
+            self.assertEqual(['mongodog.prom'], os.listdir(directory))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_serves_metrics_over_http(self):
+        """MetricsReporter serves metrics over HTTP"""
+        server = self.reporter.serve(0)
+        try:
+            response = urlopen('http://127.0.0.1:%d/metrics' % server.server_port)
+            self.assertEqual(self.reporter.render(), response.read().decode('utf-8'))
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog self-instrumentation"""
+import logging
+import unittest
+
+import mongodog.overhead
+from mongodog.reporters import MemoryReporter
+from dummies import DummyCollection, DummySniffer
+
+
+class TimingMemoryReporter(MemoryReporter):
+    """MemoryReporter, that requires timing"""
+
+    requires_timing = True
+
+
+class ListHandler(logging.Handler):
+    """Collects log records"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestOverheadStats(unittest.TestCase):
+    """Unit tests for OverheadStats class"""
+
+    def test_snapshot_aggregates_stages(self):
+        """OverheadStats counts, sums and keeps max time per stage"""
+        stats = mongodog.overhead.OverheadStats()
+        stats.add('deepcopy', 0.25)
+        stats.add('deepcopy', 0.75)
+
+        self.assertEqual({'deepcopy': {'count': 2, 'total': 1.0, 'max': 0.75, 'mean': 0.5}},
+                         stats.snapshot(reset=True))
+        self.assertEqual({}, stats.snapshot())
+
+
+class TestSnifferStats(unittest.TestCase):
+    """Unit tests for Sniffer stats"""
+
+    def sniff(self, reporter, **kwargs):
+        """Sniffs an insert and a find_one, returns the sniffer"""
+        sniffer = DummySniffer(reporter, with_stats=True, **kwargs)
+        sniffer.start()
+        try:
+            DummyCollection().insert({'a': 1})
+            DummyCollection().find_one(1)
+        finally:
+            sniffer.stop()
+        return sniffer
+
+    def test_stages_are_measured(self):
+        """Sniffer measures time spent in every stage"""
+        sniffer = self.sniff(TimingMemoryReporter(), with_sizes=True)
+        stages = sniffer.stats()['stages']
+
+        for stage in ('callback_before', 'traceback', 'deepcopy', 'reporter'):
+            self.assertEqual(2, stages[stage]['count'], stage)
+        self.assertEqual(1, stages['callback_after']['count'])
+        self.assertEqual(1, stages['sizes']['count'])
+        self.assertNotIn('allocations', sniffer.stats())
+
+    def test_nothing_is_measured_without_stats(self):
+        """Sniffer does not measure anything unless with_stats is set"""
+        sniffer = DummySniffer(MemoryReporter())
+        sniffer.start()
+        try:
+            DummyCollection().insert({'a': 1})
+        finally:
+            sniffer.stop()
+
+        self.assertEqual({'stages': {}}, sniffer.stats())
+
+    @unittest.skipIf(mongodog.overhead.tracemalloc is None, "tracemalloc is not available")
+    def test_allocations_are_measured_while_running(self):
+        """Sniffer reports memory allocated by mongodog with tracemalloc"""
+        reporter = MemoryReporter()
+        sniffer = DummySniffer(reporter, with_allocations=True)
+        sniffer.start()
+        try:
+            for i in range(10):
+                DummyCollection().insert({'a': i})
+            allocations = sniffer.stats()['allocations']
+        finally:
+            sniffer.stop()
+
+        self.assertLess(0, allocations['size'])
+        self.assertTrue(all('mongodog' in site for site, _, _ in allocations['top']))
+
+    def test_self_report_logs_and_resets_stats(self):
+        """SelfReport logs the stats and starts counting from zero"""
+        sniffer = self.sniff(MemoryReporter())
+        logger = logging.getLogger('mongodog.tests.overhead')
+        logger.setLevel(logging.INFO)
+        handler = ListHandler()
+        logger.addHandler(handler)
+        try:
+            mongodog.overhead.SelfReport(sniffer, logger=logger).report()
+        finally:
+            logger.removeHandler(handler)
+
+        self.assertEqual(1, len(handler.records))
+        self.assertIn('callback_before 2 x', handler.records[0].getMessage())
+        self.assertEqual({}, sniffer.stats()['stages'])
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog payload size reporter"""
+import unittest
+
+import mongodog.payloads
+
+
+class TestPayloadSizeReporter(unittest.TestCase):
+    """Unit tests for PayloadSizeReporter class"""
+
+    def test_ignores_commands_without_sizes(self):
+        """PayloadSizeReporter ignores commands, whose size was not sampled"""
+        reporter = mongodog.payloads.PayloadSizeReporter()
+        reporter.report_mongo_command({'op': 'collection_count'})
+        self.assertEqual([], reporter.shapes())
+        self.assertEqual([], reporter.largest_payloads())
+
+    def test_keeps_histograms_per_shape_and_call_site(self):
+        """PayloadSizeReporter keeps size histograms per shape and per call site"""
+        reporter = mongodog.payloads.PayloadSizeReporter(buckets=[100, 1000])
+        reporter.report_mongo_command({'op': 'collection_insert', 'doc_or_docs': {'a': 1}, 'nbytes_sent': 50})
+        reporter.report_mongo_command({'op': 'collection_insert', 'doc_or_docs': {'a': 2}, 'nbytes_sent': 500})
+        reporter.report_mongo_command({'op': 'collection_find_one', 'nbytes': 10})
+
+        shapes = reporter.shapes()
+        self.assertEqual(2, len(shapes))
+        shape, count, total, buckets = shapes[0]
+        self.assertTrue(shape.startswith('collection_insert'))
+        self.assertEqual((2, 550), (count, total))
+        self.assertEqual([(100, 1), (1000, 2), (float('inf'), 2)], buckets)
+        self.assertEqual([(None, 3, 560)], [row[:3] for row in reporter.call_sites()])
+
+    def test_keeps_top_k_largest_payloads(self):
+        """PayloadSizeReporter keeps only the largest payloads"""
+        reporter = mongodog.payloads.PayloadSizeReporter(top=2)
+        for size in (5, 50, 1, 20):
+            reporter.report_mongo_command({'op': 'collection_find_one', 'nbytes': size})
+
+        self.assertEqual([50, 20], [payload['size'] for payload in reporter.largest_payloads()])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog compact records"""
+import unittest
+
+import mongodog.records
+from dummies import DummyCollection, DummySniffer
+
+
+class TestRecordDictionary(unittest.TestCase):
+    """Unit tests for RecordDictionary class"""
+
+    def test_records_decode_to_original_commands(self):
+        """RecordDictionary decodes records back to the command dicts"""
+        dictionary = mongodog.records.RecordDictionary()
+        commands = [{'op': 'collection_find', 'db': 'test', 'collection': 'foo', 'spec': {'a': 1}, 'limit': 0},
+                    {'op': 'generic', 'args': (1,), 'kwargs': {}}]
+        records = [dictionary.encode(command) for command in commands]
+
+        self.assertEqual(commands, [mongodog.records.decode(record) for record in records])
+        self.assertIsNone(records[1].db)
+
+    def test_names_and_schemas_are_interned(self):
+        """RecordDictionary stores every name and schema once"""
+        dictionary = mongodog.records.RecordDictionary()
+        record1 = dictionary.encode({'op': 'collection_count', 'db': 'test', 'collection': 'foo', 'started': 1.0})
+        record2 = dictionary.encode({'op': 'collection_count', 'db': 'test', 'collection': 'bar', 'started': 2.0})
+
+        self.assertEqual((0, 1, 2, 0, (1.0,)), record1.as_tuple())
+        self.assertEqual((0, 1, 3, 0, (2.0,)), record2.as_tuple())
+        self.assertEqual({'strings': ['collection_count', 'test', 'foo', 'bar'], 'schemas': [['started']]},
+                         dictionary.snapshot())
+
+    def test_decode_returns_dicts_as_they_are(self):
+        """decode passes command dicts through"""
+        command = {'op': 'collection_count'}
+        self.assertIs(command, mongodog.records.decode(command))
+
+
+class TestSnifferWithCompactReporter(unittest.TestCase):
+    """Unit tests for Sniffer reporting compact records"""
+
+    def test_sniffer_passes_compact_records_to_accepting_reporters(self):
+        """Sniffer encodes commands for reporters with accepts_compact"""
+        reporter = mongodog.records.CompactMemoryReporter()
+        sniffer = DummySniffer(reporter)
+        sniffer.start()
+        try:
+            DummyCollection().insert({'a': 1})
+        finally:
+            sniffer.stop()
+
+        record, _ = reporter.reported_records[0]
+        self.assertIsInstance(record, mongodog.records.CompactRecord)
+        command, _ = reporter.reported_commands[0]
+        self.assertEqual('collection_insert', command['op'])
+        self.assertEqual('dummy', command['collection'])
+        self.assertEqual({'a': 1}, command['doc_or_docs'])
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog replay"""
+import unittest
+
+import pymongo.operations
+
+import mongodog.utils
+
+import mongodog.replay
+
+
+class DummyCollection(object):
+    """Collection, that records replayed calls"""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def find(self, spec=None, fields=None, skip=0, limit=0):
+        """Records the call"""
+        self.calls.append(('find', (spec, fields)))
+        return []
+
+    def find_one(self, spec_or_id=None, fields=None):
+        """Records the call"""
+        self.calls.append(('find_one', spec_or_id))
+        return None
+
+    def update(self, spec, document, upsert=False, multi=False):
+        """Fails"""
+        raise ValueError("update failed")
+
+    def count(self, *args):
+        """Records the call"""
+        self.calls.append(('count', args))
+
+    def distinct(self, key, *args):
+        """Records the call"""
+        self.calls.append(('distinct', (key,) + args))
+
+    def bulk_write(self, requests, ordered=True):
+        """Records the call"""
+        self.calls.append(('bulk_write', requests))
+
+
+class DummyClient(object):
+    """Client, that returns DummyCollections"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getitem__(self, name):
+        return {'foo': DummyCollection(self.calls)}
+
+
+def dummy_command(op, started, duration=0.0, thread=1, **fields):
+    """Returns a captured command"""
+    command = {'op': op, 'db': 'test', 'collection': 'foo', 'started': started, 'duration': duration,
+               'thread': thread}
+    command.update(fields)
+    return command
+
+
+class TestReplay(unittest.TestCase):
+    """Unit tests for replay functions"""
+
+    def test_select_commands_drops_nested_and_unreplayable_commands(self):
+        """select_commands drops calls nested within other calls on the same thread and cursor ops"""
+        commands = [
+            dummy_command('database_command', 1.1, 0.1, command='count'),
+            dummy_command('collection_count', 1.0, 0.5),
+            dummy_command('collection_count', 1.2, 0.1, thread=2),
+            dummy_command('cursor_iter', 2.0),
+        ]
+        selected, skipped = mongodog.replay.select_commands(commands)
+
+        self.assertEqual([(1.0, 1), (1.2, 2)], [(command['started'], command['thread']) for command in selected])
+        self.assertEqual(2, skipped)
+
+    def test_select_commands_filters_shapes(self):
+        """select_commands keeps only commands with given shapes"""
+        commands = [dummy_command('collection_find_one', 1.0, spec_or_id={'a': 1}),
+                    dummy_command('collection_find_one', 2.0, spec_or_id={'b': 1})]
+        shape = mongodog.utils.get_command_shape(commands[1])
+        selected, skipped = mongodog.replay.select_commands(commands, shapes=[shape])
+
+        self.assertEqual([2.0], [command['started'] for command in selected])
+        self.assertEqual(1, skipped)
+
+    def test_schedule_scales_time(self):
+        """schedule divides offsets by speed, or replays everything at once without speed"""
+        commands = [dummy_command('collection_count', 10.0), dummy_command('collection_count', 12.0)]
+
+        self.assertEqual([0.0, 1.0], [offset for offset, _ in mongodog.replay.schedule(commands, 2.0)])
+        self.assertEqual([0.0, 0.0], [offset for offset, _ in mongodog.replay.schedule(commands, 0)])
+
+    def test_percentile(self):
+        """percentile returns the nearest-rank percentile"""
+        values = list(range(1, 101))
+
+        self.assertEqual(50, mongodog.replay.percentile(values, 0.5))
+        self.assertEqual(99, mongodog.replay.percentile(values, 0.99))
+        self.assertEqual(100, mongodog.replay.percentile(values, 1.0))
+        self.assertIsNone(mongodog.replay.percentile([], 0.5))
+
+    def test_replay_issues_commands_and_reports_latencies(self):
+        """replay issues commands through the client and counts latencies and errors per op"""
+        client = DummyClient()
+        commands = [dummy_command('collection_find_one', i, spec_or_id={'_id': i}) for i in range(6)]
+        commands.append(dummy_command('collection_update', 7, spec={}, document={}))
+        result = mongodog.replay.replay(commands, client=client, concurrency=3, speed=None)
+
+        self.assertEqual(list(range(6)), sorted(spec['_id'] for _, spec in client.calls))
+        self.assertEqual(7, result.count)
+        self.assertEqual({'collection_update': 1}, result.errors)
+        self.assertEqual(6, len(result.latencies['collection_find_one']))
+        self.assertIsNotNone(result.percentile(0.99))
+        self.assertIn('collection_find_one', result.format())
+
+    def test_replay_rebuilds_bulk_write_requests(self):
+        """replay turns captured bulk_write requests back into pymongo operations"""
+        client = DummyClient()
+        requests = [{'type': 'InsertOne', 'document': {'a': 1}},
+                    {'type': 'UpdateOne', 'filter': {'a': 1}, 'document': {'$set': {'b': 1}}, 'upsert': True},
+                    {'type': 'DeleteOne', 'filter': {'a': 1}}]
+        mongodog.replay.replay([dummy_command('collection_bulk_write', 0, requests=requests)],
+                               client=client, speed=None)
+
+        self.assertEqual([('bulk_write', [pymongo.operations.InsertOne({'a': 1}),
+                                          pymongo.operations.UpdateOne({'a': 1}, {'$set': {'b': 1}}, upsert=True),
+                                          pymongo.operations.DeleteOne({'a': 1})])], client.calls)
+
+    def test_replay_passes_filters_of_count_and_distinct(self):
+        """replay issues counts and distincts with their captured filters"""
+        client = DummyClient()
+        commands = [dummy_command('collection_count', 0, filter={'a': 1}),
+                    dummy_command('collection_count', 1),
+                    dummy_command('collection_distinct', 2, key='b', filter={'a': 2})]
+        mongodog.replay.replay(commands, client=client, speed=None)
+
+        self.assertEqual([('count', ({'a': 1},)), ('count', ()), ('distinct', ('b', {'a': 2}))],
+                         client.calls)
+
+    def test_replay_passes_filters_and_projections_of_pymongo_3_finds(self):
+        """replay issues finds with the filters and projections captured under pymongo 3.x names"""
+        client = DummyClient()
+        commands = [dummy_command('collection_find', 0, filter={'a': 1}, projection={'b': 1}),
+                    dummy_command('collection_find', 1, spec={'a': 2}, fields={'c': 1}),
+                    dummy_command('collection_find_one', 2, filter={'a': 3})]
+        mongodog.replay.replay(commands, client=client, speed=None)
+
+        self.assertEqual([('find', ({'a': 1}, {'b': 1})), ('find', ({'a': 2}, {'c': 1})), ('find_one', {'a': 3})],
+                         client.calls)
+
+    def test_result_of_replay_without_commands_is_formatted(self):
+        """ReplayResult formats replays, that replayed nothing, without the all row"""
+        result = mongodog.replay.replay([dummy_command('collection_find_one', 0)], client=DummyClient(),
+                                        speed=None, ops=['collection_count'])
+        lines = result.format().splitlines()
+
+        self.assertEqual(0, result.count)
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith('replayed 0 commands'))
+        self.assertEqual('-', mongodog.replay.format_latency(result.percentile(0.5)))
+
+    def test_select_commands_drops_commands_marked_nested(self):
+        """select_commands drops commands, that the sniffer marked as nested"""
+        commands = [dummy_command('collection_find_one', 0),
+                    dummy_command('collection_find', 0, thread=2, nested=True)]
+        selected, skipped = mongodog.replay.select_commands(commands)
+
+        self.assertEqual(['collection_find_one'], [command['op'] for command in selected])
+        self.assertEqual(1, skipped)
+
+    def test_replay_in_processes_requires_uri(self):
+        """replay refuses to use processes without uri"""
+        self.assertRaises(ValueError, mongodog.replay.replay, [], client=DummyClient(), processes=True)
@@ -7,6 +7,7 @@ except ImportError:
     # python3
     import io
 import logging
+import time
 import unittest
 
 try:
@@ -105,6 +106,90 @@ class TestLoggingReporter(unittest.TestCase):
         self.assertTrue(content.find("dummy_traceback_marker") != -1)
 
 
+class TestDeduplicatingLoggingReporter(unittest.TestCase):
+    """Unit tests for DeduplicatingLoggingReporter class"""
+
+    def setUp(self):
+        self.now = 1000.0
+        self.lbuf = io.StringIO()
+        self.logger = logging.getLogger("mongodog.tests.dummy.dedup")
+        self.logger.handlers = []
+        self.logger.addHandler(logging.StreamHandler(self.lbuf))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def clock(self):
+        return self.now
+
+    def test_identical_commands_are_logged_once_and_summarized_on_flush(self):
+        """DeduplicatingLoggingReporter logs the first command and a summary of the rest"""
+        reporter = mongodog.reporters.DeduplicatingLoggingReporter(self.logger, clock=self.clock)
+        for i in range(5):
+            reporter.report_mongo_command({"op": "collection_find", "spec": {"a": i}, "duration": 0.5})
+
+        lines = self.lbuf.getvalue().splitlines()
+        self.assertEqual(1, len(lines))
+        self.assertTrue(lines[0].startswith("mongodog: {"))
+
+        reporter.flush()
+        lines = self.lbuf.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[1].find("count=4 total=2.000000") != -1)
+
+    def test_window_expiry_flushes_suppressed_commands(self):
+        """DeduplicatingLoggingReporter flushes suppressed commands once the window passes"""
+        reporter = mongodog.reporters.DeduplicatingLoggingReporter(self.logger, window=10, clock=self.clock)
+        reporter.report_mongo_command({"op": "collection_count"})
+        reporter.report_mongo_command({"op": "collection_count"})
+        self.now += 11
+        reporter.report_mongo_command({"op": "collection_count"})
+
+        lines = self.lbuf.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[1].find("suppressed") != -1)
+        self.assertTrue(lines[1].find("count=2") != -1)
+
+    def test_background_thread_flushes_window_without_new_commands(self):
+        """DeduplicatingLoggingReporter flushes the last window, even if no more commands arrive"""
+        reporter = mongodog.reporters.DeduplicatingLoggingReporter(self.logger, window=0.01)
+        try:
+            reporter.report_mongo_command({"op": "collection_count"})
+            reporter.report_mongo_command({"op": "collection_count"})
+            for _ in range(200):
+                if "suppressed" in self.lbuf.getvalue():
+                    break
+                time.sleep(0.01)
+        finally:
+            reporter.close()
+
+        self.assertIn("suppressed", self.lbuf.getvalue())
+
+    def test_close_flushes_suppressed_commands(self):
+        """DeduplicatingLoggingReporter logs suppressed commands when closed"""
+        reporter = mongodog.reporters.DeduplicatingLoggingReporter(self.logger, clock=self.clock,
+                                                                   background=False)
+        reporter.report_mongo_command({"op": "collection_count"})
+        reporter.report_mongo_command({"op": "collection_count"})
+        reporter.close()
+
+        lines = self.lbuf.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertIn("suppressed", lines[1])
+
+    def test_call_site_is_rate_limited(self):
+        """DeduplicatingLoggingReporter does not log more than the token bucket allows"""
+        reporter = mongodog.reporters.DeduplicatingLoggingReporter(
+            self.logger, rate=0, burst=1, clock=self.clock)
+        reporter.report_mongo_command({"op": "collection_count"})
+        reporter.report_mongo_command({"op": "collection_distinct", "key": "a"})
+
+        self.assertEqual(1, len(self.lbuf.getvalue().splitlines()))
+        reporter.flush()
+        lines = self.lbuf.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[1].find("collection_distinct") != -1)
+
+
 class TestMongoReporter(BaseMongoBoxedTestCase):
     """Unit tests for MongoReporter class"""
 
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog rotating file reporter"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import mongodog.capture
+import mongodog.rotating
+
+
+class DummyClock(object):
+    """Clock, that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def dummy_command(i):
+    """Returns a command with capture record of about 200 bytes"""
+    return {'op': 'collection_find_one', 'db': 'test', 'collection': 'foo',
+            'spec_or_id': {'_id': i}, 'started': float(i), 'duration': 0.01}
+
+
+class TestRotatingFileReporter(unittest.TestCase):
+    """Unit tests for RotatingFileReporter class"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = DummyClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reporter(self, **kwargs):
+        """Returns a reporter without background thread"""
+        return mongodog.rotating.RotatingFileReporter(self.directory, clock=self.clock, background=False,
+                                                      **kwargs)
+
+    def read_all(self, reporter):
+        """Returns started times of all commands in all segments"""
+        return [command['started'] for path in reporter.segments()
+                for command in mongodog.capture.read_capture(path)]
+
+    def test_records_are_buffered_until_flushed(self):
+        """RotatingFileReporter writes buffered records only on flush"""
+        reporter = self.reporter()
+        for i in range(3):
+            reporter.report_mongo_command(dummy_command(i))
+        self.assertEqual([], reporter.segments())
+
+        reporter.flush()
+        self.assertEqual([0.0, 1.0, 2.0], self.read_all(reporter))
+        reporter.close()
+
+    def test_segments_rotate_by_size_and_age(self):
+        """RotatingFileReporter starts new segment, when the current one is too big or too old"""
+        reporter = self.reporter(max_segment_bytes=250)
+        for i in range(6):
+            reporter.report_mongo_command(dummy_command(i))
+            reporter.flush()
+        self.assertEqual(3, len(reporter.segments()))
+
+        reporter = self.reporter(prefix='aged', max_segment_age=60)
+        reporter.report_mongo_command(dummy_command(0))
+        reporter.flush()
+        self.clock.now += 61
+        reporter.report_mongo_command(dummy_command(1))
+        reporter.flush()
+        reporter.close()
+        self.assertEqual(2, len(reporter.segments()))
+        self.assertEqual([0.0, 1.0], self.read_all(reporter))
+
+    def test_retention_deletes_oldest_segments(self):
+        """RotatingFileReporter deletes oldest segments above the total size cap"""
+        reporter = self.reporter(max_segment_bytes=1, max_total_bytes=420)
+        for i in range(10):
+            reporter.report_mongo_command(dummy_command(i))
+            reporter.flush()
+        reporter.close()
+
+        self.assertEqual([8.0, 9.0], self.read_all(reporter))
+
+    def test_records_are_dropped_when_buffer_is_full(self):
+        """RotatingFileReporter drops records instead of growing the buffer without limit"""
+        reporter = self.reporter(max_buffer_bytes=420)
+        for i in range(5):
+            reporter.report_mongo_command(dummy_command(i))
+        reporter.close()
+
+        self.assertEqual(3, reporter.dropped)
+        self.assertEqual([0.0, 1.0], self.read_all(reporter))
+
+    def test_background_thread_writes_records(self):
+        """RotatingFileReporter writes records on the background thread and on close"""
+        reporter = mongodog.rotating.RotatingFileReporter(self.directory, flush_bytes=1, flush_interval=0.01)
+        for i in range(20):
+            reporter.report_mongo_command(dummy_command(i))
+        reporter.close()
+
+        self.assertEqual([float(i) for i in range(20)], self.read_all(reporter))
+        self.assertFalse(reporter.thread.is_alive())
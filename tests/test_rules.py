@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog include/exclude rules"""
+import unittest
+
+import mongodog.rules
+
+
+class TestRule(unittest.TestCase):
+    """Unit tests for Rule class"""
+
+    def test_raises_value_error_on_unknown_action(self):
+        """Rule raises ValueError, when action is neither include nor exclude"""
+        self.assertRaises(ValueError, mongodog.rules.Rule, 'ignore')
+
+    def test_matches_target_by_names_or_collections_of_names(self):
+        """Rule matches op, db and collection by name or by collection of names"""
+        rule = mongodog.rules.exclude(op=('collection_find', 'collection_count'), db='test')
+        self.assertTrue(rule.matches_target('collection_find', 'test', 'foo'))
+        self.assertTrue(rule.matches_target('collection_count', 'test', None))
+        self.assertFalse(rule.matches_target('collection_insert', 'test', 'foo'))
+        self.assertFalse(rule.matches_target('collection_find', 'other', 'foo'))
+
+    def test_matches_module_by_prefix(self):
+        """Rule matches call site module by package prefix"""
+        rule = mongodog.rules.include(module='app.models')
+        self.assertTrue(rule.matches_details('app.models', {}))
+        self.assertTrue(rule.matches_details('app.models.user', {}))
+        self.assertFalse(rule.matches_details('app.modelsx', {}))
+        self.assertFalse(rule.matches_details(None, {}))
+
+
+class TestRuleSet(unittest.TestCase):
+    """Unit tests for RuleSet class"""
+
+    def test_first_matching_rule_decides(self):
+        """RuleSet uses the first rule matching op, db and collection"""
+        rules = mongodog.rules.RuleSet([
+            mongodog.rules.include(collection='important'),
+            mongodog.rules.exclude(db='test'),
+        ])
+        self.assertTrue(rules.lookup('collection_find', 'test', 'important'))
+        self.assertFalse(rules.lookup('collection_find', 'test', 'other'))
+        self.assertTrue(rules.lookup('collection_find', 'prod', 'other'))
+
+    def test_default_action_is_used_when_no_rule_matches(self):
+        """RuleSet uses default action, when no rule matches"""
+        rules = mongodog.rules.RuleSet([mongodog.rules.include(op='collection_find')], default='exclude')
+        self.assertTrue(rules.lookup('collection_find', 'db', 'c'))
+        self.assertFalse(rules.lookup('collection_count', 'db', 'c'))
+
+    def test_lookups_are_cached_in_the_table(self):
+        """RuleSet compiles the decision for (op, db, collection) only once"""
+        rules = mongodog.rules.RuleSet([mongodog.rules.exclude(db='test')])
+        rules.lookup('collection_find', 'test', 'c')
+        self.assertEqual({('collection_find', 'test', 'c'): False}, rules.table)
+
+    def test_predicates_are_deferred_until_the_command_is_known(self):
+        """RuleSet defers rules with predicates and decides them with the command"""
+        rules = mongodog.rules.RuleSet([
+            mongodog.rules.exclude(predicate=lambda command: not command.get('spec')),
+            mongodog.rules.include(op='collection_find'),
+            mongodog.rules.exclude(),
+        ])
+        entry = rules.lookup('collection_find', 'db', 'c')
+        self.assertIsInstance(entry, tuple)
+        self.assertEqual(2, len(entry))
+        self.assertFalse(rules.decide(entry, {'spec': None}))
+        self.assertTrue(rules.decide(entry, {'spec': {'a': 1}}))
+        self.assertFalse(rules.accepts('collection_count', 'db', 'c', {'spec': {'a': 1}}))
+
+    def test_module_rules_use_the_calling_module(self):
+        """RuleSet matches module rules against the calling application module"""
+        rules = mongodog.rules.RuleSet([mongodog.rules.exclude(module=__name__)])
+        self.assertFalse(rules.accepts('collection_find', 'db', 'c', {}))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog adaptive sampling"""
+import random
+import unittest
+
+import mongodog.sampling
+from mongodog.reporters import MemoryReporter
+from dummies import DummyCollection, DummySniffer
+
+
+class DummyClock(object):
+    """Clock, that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdaptiveSampler(unittest.TestCase):
+    """Unit tests for AdaptiveSampler class"""
+
+    def setUp(self):
+        self.clock = DummyClock()
+        self.sampler = mongodog.sampling.AdaptiveSampler(target=0.01, window=1.0, min_rate=0.05, rare_calls=10,
+                                                         clock=self.clock, random=lambda: 0.5)
+
+    def run_window(self, calls):
+        """Samples {op: (count, cost per sampled call)} calls and ends the window"""
+        for op, (count, cost) in calls.items():
+            for _ in range(count):
+                if self.sampler.sample(op):
+                    self.sampler.add_cost(op, cost)
+        self.clock.now += 1.0
+
+    def test_rate_keeps_cost_within_target(self):
+        """AdaptiveSampler lowers the rate, so that the estimated cost fits the budget"""
+        # 1000 calls at 50us each cost 50ms, the budget is 10ms
+        self.run_window({'collection_find': (1000, 0.00005)})
+        self.sampler.sample('collection_find')
+
+        self.assertAlmostEqual(0.2, self.sampler.rate('collection_find'))
+
+    def test_rate_recovers_when_traffic_drops(self):
+        """AdaptiveSampler raises the rate again in quiet periods"""
+        self.run_window({'collection_find': (1000, 0.00005)})
+        self.run_window({'collection_find': (100, 0.00005)})
+        self.sampler.sample('collection_find')
+
+        self.assertEqual(1.0, self.sampler.rate('collection_find'))
+
+    def test_rare_ops_are_always_sampled_and_rate_has_a_floor(self):
+        """AdaptiveSampler samples rare ops fully and never goes below min_rate"""
+        self.run_window({'collection_find': (1000, 0.001), 'collection_remove': (5, 0.001)})
+        self.sampler.sample('collection_find')
+
+        self.assertEqual(1.0, self.sampler.rate('collection_remove'))
+        self.assertEqual(0.05, self.sampler.rate('collection_find'))
+
+
+    def test_windows_without_sampled_calls_keep_the_rate(self):
+        """AdaptiveSampler estimates windows, that sampled no call, with the last known cost per call"""
+        # 1000 calls at 10ms each, at rate 0.001 about a third of the windows sample no call
+        self.sampler = mongodog.sampling.AdaptiveSampler(target=0.01, window=1.0, min_rate=0.001, rare_calls=10,
+                                                         clock=self.clock, random=random.Random(42).random)
+        rates = []
+        for _ in range(15):
+            self.run_window({'collection_find': (1000, 0.01)})
+            self.sampler.sample('collection_find')
+            rates.append(round(self.sampler.rate('collection_find'), 6))
+
+        self.assertEqual([0.001] * 15, rates)
+
+class TestSnifferWithSampler(unittest.TestCase):
+    """Unit tests for Sniffer with a sampler"""
+
+    def test_sniffer_reports_sampled_calls_and_their_cost(self):
+        """Sniffer only reports calls, that the sampler samples, and tells it their cost"""
+        decisions = [True, False, True]
+        costs = []
+
+        class DummySampler(object):
+            def sample(self, op):
+                return decisions.pop(0)
+
+            def add_cost(self, op, seconds):
+                costs.append(op)
+
+        reporter = MemoryReporter()
+        sniffer = DummySniffer(reporter, sampler=DummySampler())
+        sniffer.start()
+        try:
+            for i in range(3):
+                DummyCollection().insert({'a': i})
+        finally:
+            sniffer.stop()
+
+        self.assertEqual([{'a': 0}, {'a': 2}], [command['doc_or_docs'] for command, _ in reporter.reported_commands])
+        self.assertEqual(['collection_insert'] * 3, costs)
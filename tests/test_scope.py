@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog sniffing scopes"""
+import unittest
+
+import mongodog.scope
+from dummies import DummyCollection, FindSniffer
+
+
+class TestScope(unittest.TestCase):
+    """Unit tests for scope functions and ScopeReporter"""
+
+    def tearDown(self):
+        del mongodog.scope.active_scopes()[:]
+
+    def test_reporter_adds_commands_to_all_open_scopes(self):
+        """ScopeReporter adds commands to all scopes open in the current thread"""
+        reporter = mongodog.scope.ScopeReporter()
+        outer = mongodog.scope.open_scope('outer')
+        reporter.report_mongo_command({'duration': 0.5, 'nreturned': 3})
+        inner = mongodog.scope.open_scope('inner')
+        reporter.report_mongo_command({'duration': 0.25, 'error': 'boom'})
+        mongodog.scope.close_scope(inner)
+        mongodog.scope.close_scope(outer)
+        reporter.report_mongo_command({'duration': 1.0})
+
+        self.assertEqual((2, 0.75, 3, 1), (outer.queries, outer.duration, outer.nreturned, outer.errors))
+        self.assertEqual((1, 0.25, 0, 1), (inner.queries, inner.duration, inner.nreturned, inner.errors))
+        self.assertFalse(mongodog.scope.has_active_scope())
+
+    def test_reporter_adds_fetches_of_a_find_to_the_find(self):
+        """ScopeReporter counts a find and the fetches of its cursor as one query with their documents"""
+        reporter = mongodog.scope.ScopeReporter()
+        sniffer = FindSniffer(reporter)
+        scope = mongodog.scope.open_scope()
+        sniffer.start()
+        try:
+            documents = list(DummyCollection().find({'a': 1}))
+        finally:
+            sniffer.stop()
+        mongodog.scope.close_scope(scope)
+
+        self.assertEqual([{'a': 1}], documents)
+        self.assertEqual((1, 1), (scope.queries, scope.nreturned))
+
+    def test_closing_scope_closes_scopes_opened_within_it(self):
+        """close_scope also closes nested scopes, that were left open"""
+        outer = mongodog.scope.open_scope()
+        mongodog.scope.open_scope()
+        mongodog.scope.close_scope(outer)
+
+        self.assertEqual([], mongodog.scope.active_scopes())
+        self.assertIsNotNone(outer.finished)
+
+    def test_summary_lists_most_expensive_call_sites(self):
+        """Scope summary lists call sites, most expensive first"""
+        scope = mongodog.scope.Scope('test')
+        scope.add({'duration': 0.1})
+        scope.add({'duration': 0.2})
+
+        summary = scope.summary()
+        self.assertEqual(2, summary['queries'])
+        self.assertEqual([{'call_site': None, 'count': 2, 'duration': summary['duration']}],
+                         summary['call_sites'])
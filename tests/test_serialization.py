@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the mongodog serializer"""
+import datetime
+import json
+import re
+import unittest
+import uuid
+
+import bson
+import bson.json_util
+
+import mongodog.serialization
+
+
+class TestSerializer(unittest.TestCase):
+    """Unit tests for Serializer class"""
+
+    def test_encodes_bson_types_as_extended_json(self):
+        """Serializer encodes BSON types, so that bson.json_util can read them back"""
+        value = {
+            '_id': bson.ObjectId(),
+            'when': datetime.datetime(2014, 5, 6, 7, 8, 9, 123000),
+            'name': re.compile('^foo', re.IGNORECASE),
+            'uuid': uuid.uuid4(),
+            'data': bson.Binary(b'\x00\x01', 5),
+            'sort': bson.SON([('b', -1), ('a', 1)]),
+        }
+        result = bson.json_util.loads(mongodog.serialization.dumps(value))
+
+        self.assertEqual(value['_id'], result['_id'])
+        self.assertEqual(value['when'], result['when'].replace(tzinfo=None))
+        self.assertEqual('^foo', result['name'].pattern)
+        self.assertEqual(value['uuid'], result['uuid'])
+        self.assertEqual(value['data'], result['data'])
+        self.assertEqual({'b': -1, 'a': 1}, result['sort'])
+
+    def test_output_is_compact(self):
+        """Serializer does not put whitespace between tokens"""
+        self.assertEqual('{"a":[1,2,null]}', mongodog.serialization.dumps({'a': (1, 2, None)}))
+
+    def test_unknown_types_are_encoded_as_repr(self):
+        """Serializer falls back to repr for unknown types"""
+        class Unknown(object):
+            def __repr__(self):
+                return '<unknown>'
+
+        self.assertEqual('"<unknown>"', mongodog.serialization.dumps(Unknown()))
+
+    def test_encoders_are_inherited_and_cached_by_type(self):
+        """Serializer uses encoder of the closest registered base class and caches it"""
+        class Base(object):
+            pass
+
+        class Derived(Base):
+            pass
+
+        serializer = mongodog.serialization.Serializer()
+        serializer.register(Base, lambda _serializer, _value: 'base')
+
+        self.assertEqual('base', serializer.to_primitive(Derived()))
+        self.assertIn(Derived, serializer.cache)
+
+        serializer.register(Derived, lambda _serializer, _value: 'derived')
+        self.assertEqual('derived', serializer.to_primitive(Derived()))
+
+    def test_sort_keys(self):
+        """Serializer can output keys in sorted order"""
+        result = mongodog.serialization.dumps({'b': 1, 'a': 2}, sort_keys=True)
+        self.assertEqual(json.dumps({'a': 2, 'b': 1}, sort_keys=True, separators=(',', ':')), result)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog snapshots"""
+import unittest
+
+import bson
+
+import mongodog.snapshot
+import mongodog.utils
+from mongodog.reporters import MemoryReporter
+from mongodog.utils import ValueShape
+from dummies import DummyCollection, DummySniffer
+
+
+class TestSnapshotter(unittest.TestCase):
+    """Unit tests for Snapshotter class"""
+
+    def test_values_are_copied_within_limits(self):
+        """Snapshotter truncates lists, strings and binary values while copying"""
+        snapshotter = mongodog.snapshot.Snapshotter(max_items=2, max_string=3, max_binary=2)
+        command = {'op': 'collection_insert', 'collection': 'a_long_name',
+                   'doc_or_docs': [{'name': 'abcdef', 'data': bson.Binary(b'1234')}, {}, {}]}
+        result, truncated = snapshotter.snapshot(command)
+
+        self.assertEqual({'op': 'collection_insert', 'collection': 'a_long_name',
+                          'doc_or_docs': [{'name': 'abc...', 'data': bson.Binary(b'12')}, {}]}, result)
+        self.assertEqual(3, truncated)
+        self.assertIsNot(command['doc_or_docs'][1], result['doc_or_docs'][1])
+
+    def test_deep_values_are_replaced_by_their_shape(self):
+        """Snapshotter replaces values nested deeper than max_depth with their shape"""
+        snapshotter = mongodog.snapshot.Snapshotter(max_depth=1)
+        command = {'spec': {'a': {'b': {'c': 1}}, 'd': [1]}}
+        result, truncated = snapshotter.snapshot(command)
+
+        self.assertEqual({'spec': {'a': ValueShape('{b:{c:int}}'), 'd': ValueShape('[int]')}}, result)
+        self.assertEqual(2, truncated)
+        self.assertEqual(mongodog.utils.get_command_shape(command), mongodog.utils.get_command_shape(result))
+
+    def test_shape_only_keeps_command_shape(self):
+        """Snapshotter in shape only mode keeps keys and types, one list item per shape"""
+        snapshotter = mongodog.snapshot.Snapshotter(shape_only=True)
+        command = {'op': 'collection_insert', 'db': 'test',
+                   'doc_or_docs': [{'a': i, 'b': 'x'} for i in range(1000)] + [{'a': None}]}
+        result, _ = snapshotter.snapshot(command)
+
+        self.assertEqual([{'a': ValueShape('int'), 'b': ValueShape('str')}, {'a': ValueShape('null')}],
+                         result['doc_or_docs'])
+        self.assertEqual('test', result['db'])
+        self.assertEqual(mongodog.utils.get_command_shape(command), mongodog.utils.get_command_shape(result))
+
+
+class TestSnifferWithSnapshotter(unittest.TestCase):
+    """Unit tests for Sniffer with a snapshotter"""
+
+    def test_sniffer_reports_truncated_commands(self):
+        """Sniffer copies commands with the snapshotter and marks truncated ones"""
+        reporter = MemoryReporter()
+        sniffer = DummySniffer(reporter, snapshotter=mongodog.snapshot.Snapshotter(max_items=10))
+        sniffer.start()
+        try:
+            DummyCollection().insert([{'a': i} for i in range(10000)])
+            DummyCollection().insert({'a': 1})
+        finally:
+            sniffer.stop()
+
+        batch, single = [command for command, _ in reporter.reported_commands]
+        self.assertEqual(10, len(batch['doc_or_docs']))
+        self.assertEqual(1, batch['truncated'])
+        self.assertNotIn('truncated', single)
@@ -2,10 +2,19 @@
 """
 Unit tests for MongoDog
 """
+import threading
+import time
 import unittest
 
+import pymongo
+import pymongo.collection
+import pymongo.operations
+
 import mongodog.reporters
+import mongodog.rules
 import mongodog.sniffer
+import mongodog.testing
+import mongodog.utils
 
 
 class TestMongodogSnifferDecorator(unittest.TestCase):
@@ -59,6 +68,17 @@ class TestMongodogSnifferDecorator(unittest.TestCase):
         self.assertEqual(1, len(calls))
         self.assertEqual({'f': 'before', 'c': None, 'args': (1,), 'kwargs': {'a': 2}}, calls[0])
 
+    def test_decorator_returns_result_of_skipcall(self):
+        """decorator returns the result carried by SkipCall instead of calling the function"""
+        def before(custom, *args, **kwargs):
+            raise mongodog.sniffer.SkipCall({'cached': True})
+
+        @mongodog.sniffer.mongodog_sniffer(callback_before=before)
+        def dummy(*args, **kwargs):
+            raise AssertionError("dummy should not be called")
+
+        self.assertEqual({'cached': True}, dummy())
+
     def test_decorator_calls_callback_after_after_calling_function(self):
         """decorator calls function and then calls callback_after"""
         calls = []
@@ -78,6 +98,78 @@ class TestMongodogSnifferDecorator(unittest.TestCase):
         self.assertEqual({'f': 'after', 'r': 31373, 'c': None, 'args': (1,), 'kwargs': {'a': 2}}, calls[1])
         self.assertEqual(31373, result)
 
+    def test_decorator_calls_callback_error_and_reraises_when_function_raises(self):
+        """decorator calls callback_error, when the function raises, and re-raises the exception"""
+        calls = []
+
+        def after(result, custom, *args, **kwargs):
+            calls.append('after')
+
+        def error(exc_info, custom, *args, **kwargs):
+            calls.append(('error', exc_info[0], args))
+
+        @mongodog.sniffer.mongodog_sniffer(callback_after=after, callback_error=error)
+        def dummy(*args, **kwargs):
+            raise KeyError()
+
+        self.assertRaises(KeyError, dummy, 1)
+        self.assertEqual([('error', KeyError, (1,))], calls)
+
+
+class DummyCollection(object):
+    """Stands in for a pymongo collection"""
+
+    class Database(object):
+        name = 'test'
+
+    database = Database()
+    name = 'dummy'
+
+    def insert(self, doc_or_docs, **kwargs):
+        return doc_or_docs
+
+    def find(self, spec=None, **kwargs):
+        return DummyCursor([{'a': 1}])
+
+    def find_one(self, spec_or_id=None, **kwargs):
+        for document in self.find(spec_or_id):
+            return document
+
+
+class DummyCursor(object):
+    """Stands in for a pymongo cursor"""
+
+    collection = DummyCollection()
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self.documents:
+            raise StopIteration()
+        return self.documents.pop(0)
+
+    __next__ = next
+
+
+class SizesSniffer(mongodog.sniffer.Sniffer):
+    """Sniffer of DummyCollection and DummyCursor"""
+
+    config = [('collection_insert', DummyCollection, 'insert'),
+              ('cursor_next', DummyCursor, 'next'),
+              ('cursor_next', DummyCursor, '__next__')]
+
+
+class FindSniffer(mongodog.sniffer.Sniffer):
+    """Sniffer of DummyCollection finds and DummyCursor iteration"""
+
+    config = [('collection_find', DummyCollection, 'find'),
+              ('collection_find_one', DummyCollection, 'find_one'),
+              ('cursor_iter', DummyCursor, '__iter__')]
+
 
 class TestSniffer(unittest.TestCase):
     """Unit tests for the Sniffer class"""
@@ -86,6 +178,12 @@ class TestSniffer(unittest.TestCase):
         self.calls.append(('dummy', args, kwargs))
         return self.return_value
 
+    def failing_dummy(self, *args, **kwargs):
+        raise ValueError('boom')
+
+    def interrupted_dummy(self, *args, **kwargs):
+        raise KeyboardInterrupt()
+
     def setUp(self):
         super(TestSniffer, self).setUp()
         self.calls = []
@@ -122,3 +220,493 @@ class TestSniffer(unittest.TestCase):
 
         self.assertEqual([('dummy', (1,), {}), ('dummy', (2,), {}), ('dummy', (3,), {})], self.calls)
         self.assertEqual([({'op': 'dummy', 'args': (2,), 'kwargs': {}}, None)], reporter.reported_commands)
+
+    def test_sniffer_with_timing_reports_duration_after_the_call(self):
+        """Sniffer with timing reports started and duration fields after the call"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, with_timing=True)
+
+        sniffer.start()
+        self.dummy(1)
+        sniffer.stop()
+
+        self.assertEqual(1, len(reporter.reported_commands))
+        command = reporter.reported_commands[0][0]
+        self.assertEqual('dummy', command['op'])
+        self.assertIn('started', command)
+        self.assertLessEqual(0, command['duration'])
+        self.assertEqual([], sniffer.pending_commands())
+
+    def test_sniffer_with_timing_reports_errors(self):
+        """Sniffer with timing reports the error raised by the call"""
+        reporter = mongodog.reporters.MemoryReporter()
+        mongodog.sniffer.Sniffer.config = [('dummy', TestSniffer, 'failing_dummy')]
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, with_timing=True)
+
+        sniffer.start()
+        try:
+            self.assertRaises(ValueError, self.failing_dummy)
+        finally:
+            sniffer.stop()
+
+        self.assertEqual(1, len(reporter.reported_commands))
+        self.assertIn('boom', reporter.reported_commands[0][0]['error'])
+
+    def test_sniffer_with_timing_pops_pending_command_on_base_exceptions(self):
+        """Sniffer with timing finishes calls interrupted by exceptions, that do not derive from Exception"""
+        reporter = mongodog.reporters.MemoryReporter()
+        mongodog.sniffer.Sniffer.config = [('dummy', TestSniffer, 'interrupted_dummy')]
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, with_timing=True)
+
+        sniffer.start()
+        try:
+            self.assertRaises(KeyboardInterrupt, self.interrupted_dummy)
+        finally:
+            sniffer.stop()
+
+        self.assertEqual([], sniffer.pending_commands())
+        self.assertIn('KeyboardInterrupt', reporter.reported_commands[0][0]['error'])
+
+    def test_calls_made_by_reporter_are_not_sniffed(self):
+        """Sniffer does not sniff calls, that are made by the reporter itself"""
+        test = self
+
+        class CallingReporter(mongodog.reporters.MemoryReporter):
+            def report_mongo_command(self, command, traceback=None):
+                test.dummy('from reporter')
+                super(CallingReporter, self).report_mongo_command(command, traceback)
+
+        reporter = CallingReporter()
+        sniffer = mongodog.sniffer.Sniffer(reporter, False)
+
+        sniffer.start()
+        self.dummy(1)
+        sniffer.stop()
+
+        self.assertEqual([('dummy', ('from reporter',), {}), ('dummy', (1,), {})], self.calls)
+        self.assertEqual([({'op': 'dummy', 'args': (1,), 'kwargs': {}}, None)], reporter.reported_commands)
+        self.assertFalse(mongodog.sniffer.REENTRANCY_GUARD.active)
+
+    def test_sniffer_does_not_report_calls_excluded_by_rules(self):
+        """Sniffer does not report calls excluded by rules, but still calls the function"""
+        reporter = mongodog.reporters.MemoryReporter()
+        rules = [mongodog.rules.exclude(predicate=lambda command: command['args'] == (1,))]
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, with_timing=True, rules=rules)
+
+        sniffer.start()
+        self.dummy(1)
+        self.dummy(2)
+        sniffer.stop()
+
+        self.assertEqual([('dummy', (1,), {}), ('dummy', (2,), {})], self.calls)
+        self.assertEqual(1, len(reporter.reported_commands))
+        self.assertEqual((2,), reporter.reported_commands[0][0]['args'])
+
+    def test_sniffer_short_circuits_calls_excluded_by_op(self):
+        """Sniffer does not even build the command for calls excluded by op"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, with_timing=True,
+                                           rules=[mongodog.rules.exclude(op='dummy')])
+        sniffer.report_command = lambda command: self.fail('command was reported')
+
+        sniffer.start()
+        self.dummy(1)
+        sniffer.stop()
+
+        self.assertEqual([], reporter.reported_commands)
+        self.assertEqual([], sniffer.pending_commands())
+
+    def test_sniffer_patches_only_selected_ops(self):
+        """Sniffer leaves ops, that were not selected, as original functions"""
+        original = TestSniffer.__dict__['dummy']
+        mongodog.sniffer.Sniffer.config = [('dummy', TestSniffer, 'dummy'),
+                                           ('failing', TestSniffer, 'failing_dummy')]
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, ops=['failing'])
+
+        sniffer.start()
+        try:
+            self.assertIs(original, TestSniffer.__dict__['dummy'])
+            self.assertIsNot(original, TestSniffer.__dict__['failing_dummy'])
+        finally:
+            sniffer.stop()
+
+    def test_sniffer_raises_value_error_on_unknown_op(self):
+        """Sniffer raises ValueError, when asked to sniff unknown op"""
+        reporter = mongodog.reporters.MemoryReporter()
+        self.assertRaises(ValueError, mongodog.sniffer.Sniffer, reporter, ops=['unknown'])
+
+    def test_ops_can_be_enabled_and_disabled_at_runtime(self):
+        """Sniffer ops can be enabled and disabled while the sniffer is running"""
+        original = TestSniffer.__dict__['dummy']
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = mongodog.sniffer.Sniffer(reporter, False, ops=[])
+
+        sniffer.start()
+        self.dummy(1)
+        sniffer.enable('dummy')
+        self.dummy(2)
+        sniffer.disable('dummy')
+        self.assertIs(original, TestSniffer.__dict__['dummy'])
+        self.dummy(3)
+        sniffer.stop()
+
+        self.assertEqual([({'op': 'dummy', 'args': (2,), 'kwargs': {}}, None)], reporter.reported_commands)
+
+    def test_several_sniffers_can_sniff_at_the_same_time(self):
+        """Sniffers do not interfere with each other, regardless of the order they are stopped in"""
+        original = TestSniffer.__dict__['dummy']
+        reporter1 = mongodog.reporters.MemoryReporter()
+        reporter2 = mongodog.reporters.MemoryReporter()
+        sniffer1 = mongodog.sniffer.Sniffer(reporter1, False)
+        sniffer2 = mongodog.sniffer.Sniffer(reporter2, False)
+
+        sniffer1.start()
+        sniffer2.start()
+        self.dummy(1)
+        sniffer1.stop()
+        self.dummy(2)
+        sniffer2.stop()
+        self.dummy(3)
+
+        self.assertIs(original, TestSniffer.__dict__['dummy'])
+        self.assertEqual([(1,)], [cmd['args'] for cmd, _ in reporter1.reported_commands])
+        self.assertEqual([(1,), (2,)], [cmd['args'] for cmd, _ in reporter2.reported_commands])
+        self.assertEqual([('dummy', (1,), {}), ('dummy', (2,), {}), ('dummy', (3,), {})], self.calls)
+
+    def test_sniffer_annotates_results_when_timing_is_enabled(self):
+        """Sniffer adds returned document count and size to the command from after callbacks"""
+        class FindOneSniffer(mongodog.sniffer.Sniffer):
+            config = [('collection_find_one', TestSniffer, 'dummy')]
+
+            def callback_before_collection_find_one(self, custom, *args):
+                self.report_command({'op': custom['f']})
+
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = FindOneSniffer(reporter, False, with_timing=True, with_sizes=True)
+        self.return_value = {'a': 1}
+        sniffer.start()
+        self.dummy()
+        sniffer.stop()
+
+        command = reporter.reported_commands[0][0]
+        self.assertEqual(1, command['nreturned'])
+        self.assertEqual(12, command['nbytes'])
+
+    def test_sniffer_counts_results_of_full_inline_map_reduce_response(self):
+        """Sniffer counts the results of inline_map_reduce, not the keys of its full response"""
+        class MapReduceSniffer(mongodog.sniffer.Sniffer):
+            config = [('collection_inline_map_reduce', TestSniffer, 'dummy')]
+
+            def callback_before_collection_inline_map_reduce(self, custom, *args, **kwargs):
+                self.report_command({'op': custom['f']})
+
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = MapReduceSniffer(reporter, False, with_timing=True)
+        self.return_value = {'results': [{'_id': 1}, {'_id': 2}, {'_id': 3}], 'ok': 1.0,
+                             'timeMillis': 5, 'counts': {}}
+        sniffer.start()
+        self.dummy('map', 'reduce', full_response=True)
+        sniffer.stop()
+
+        self.assertEqual(3, reporter.reported_commands[0][0]['nreturned'])
+
+    def test_sniffer_marks_calls_nested_in_reported_calls(self):
+        """Sniffer marks calls made within other reported calls and iterations of reported finds as nested"""
+        for with_timing in (False, True):
+            reporter = mongodog.reporters.MemoryReporter()
+            sniffer = FindSniffer(reporter, False, with_timing=with_timing)
+            sniffer.start()
+            DummyCollection().find_one({'a': 1})
+            list(DummyCollection().find({'a': 1}))
+            list(DummyCursor([]))
+            sniffer.stop()
+
+            commands = sorted((command['op'], command.get('nested', False))
+                              for command, _ in reporter.reported_commands)
+            self.assertEqual([('collection_find', False), ('collection_find', True),
+                              ('collection_find_one', False), ('cursor_iter', False),
+                              ('cursor_iter', True), ('cursor_iter', True)], commands)
+            self.assertEqual([], sniffer.sniffed_calls())
+
+    def test_sniffer_reports_size_of_written_documents(self):
+        """Sniffer with sizes adds encoded size of documents sent by write ops"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = SizesSniffer(reporter, False, with_sizes=True)
+        sniffer.start()
+        DummyCollection().insert([{'a': 1}, {'a': 2}])
+        sniffer.stop()
+
+        self.assertEqual(1, len(reporter.reported_commands))
+        self.assertEqual(24, reporter.reported_commands[0][0]['nbytes_sent'])
+
+    def test_sniffer_does_not_compute_sizes_for_unsampled_calls(self):
+        """Sniffer with sizes computes them only for sampled calls"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = SizesSniffer(reporter, False, with_sizes=True, size_sample_rate=0.0)
+        sniffer.start()
+        DummyCollection().insert({'a': 1})
+        sniffer.stop()
+
+        self.assertNotIn('nbytes_sent', reporter.reported_commands[0][0])
+
+    def test_sniffer_reports_documents_fetched_by_exhausted_cursor(self):
+        """Sniffer with sizes reports number and size of documents, once a cursor is exhausted"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = SizesSniffer(reporter, False, with_timing=True, with_sizes=True)
+        sniffer.start()
+        documents = list(DummyCursor([{'a': 1}, {'a': 2}, {'a': 3}]))
+        sniffer.stop()
+
+        self.assertEqual(3, len(documents))
+        self.assertEqual(1, len(reporter.reported_commands))
+        command = reporter.reported_commands[0][0]
+        self.assertEqual('cursor_next', command['op'])
+        self.assertEqual('dummy', command['collection'])
+        self.assertEqual(3, command['nreturned'])
+        self.assertEqual(36, command['nbytes'])
+        self.assertEqual([], sniffer.pending_commands())
+
+    def test_sniffer_reports_time_spent_fetching_documents_of_exhausted_cursor(self):
+        """Sniffer with timing reports the time spent in next calls of a cursor, once it is exhausted"""
+        class SlowCursor(DummyCursor):
+            def next(self):
+                time.sleep(0.01)
+                return DummyCursor.next(self)
+
+            __next__ = next
+
+        class SlowCursorSniffer(mongodog.sniffer.Sniffer):
+            config = [('cursor_next', SlowCursor, 'next'),
+                      ('cursor_next', SlowCursor, '__next__')]
+
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = SlowCursorSniffer(reporter, False, with_timing=True)
+        started = time.time()
+        sniffer.start()
+        for _ in SlowCursor([{'a': 1}, {'a': 2}]):
+            pass
+        sniffer.stop()
+
+        command = reporter.reported_commands[0][0]
+        self.assertEqual(2, command['nreturned'])
+        self.assertNotIn('nbytes', command)
+        self.assertLessEqual(started, command['started'])
+        self.assertLessEqual(0.03, command['duration'])
+
+    def test_sniffer_marks_fetches_of_reported_finds_as_continuing_them(self):
+        """Sniffer reports documents fetched by the cursor of a reported find as nested, continuing the find"""
+        class FetchSniffer(FindSniffer):
+            config = FindSniffer.config + [('cursor_next', DummyCursor, 'next'),
+                                           ('cursor_next', DummyCursor, '__next__')]
+
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = FetchSniffer(reporter, False, with_timing=True, with_sizes=True)
+        sniffer.start()
+        list(DummyCollection().find({'a': 1}))
+        list(DummyCursor([{'a': 2}]))
+        sniffer.stop()
+
+        self.assertEqual([('collection_find', None, None), ('cursor_iter', True, None),
+                          ('cursor_next', True, True), ('cursor_iter', None, None), ('cursor_next', None, None)],
+                         [(command['op'], command.get('nested'), command.get('continues'))
+                          for command, _ in reporter.reported_commands])
+        self.assertEqual(1, len(mongodog.testing.outermost_commands(reporter.reported_commands[:3])))
+
+    def test_cursor_next_is_only_sniffed_by_default_with_sizes_or_timing(self):
+        """Sniffer does not patch cursor next unless sizes or timing are enabled"""
+        reporter = mongodog.reporters.MemoryReporter()
+        self.assertNotIn('cursor_next', SizesSniffer(reporter).ops)
+        self.assertIn('cursor_next', SizesSniffer(reporter, with_sizes=True).ops)
+        self.assertIn('cursor_next', SizesSniffer(reporter, with_timing=True).ops)
+
+
+class InsertManyResult(object):
+    """Stands in for pymongo InsertManyResult"""
+
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
+class DummyCrudCollection(DummyCollection):
+    """Stands in for a pymongo 3.x+ collection"""
+
+    def insert_many(self, documents, ordered=True, bypass_document_validation=False, session=None):
+        return InsertManyResult([index for index, _ in enumerate(documents)])
+
+    def bulk_write(self, requests, ordered=True, bypass_document_validation=False, session=None):
+        return None
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=False, array_filters=None, hint=None, session=None,
+                            **kwargs):
+        return {'_id': 1}
+
+    def count(self, filter=None, session=None, **kwargs):
+        return 0
+
+
+class DummyCommandCursor(DummyCursor):
+    """Stands in for a pymongo command cursor (e.g. returned by aggregate)"""
+
+    def __init__(self, documents):
+        super(DummyCommandCursor, self).__init__(documents)
+        self._CommandCursor__collection = DummyCollection()
+
+    # command cursors have no public collection
+    collection = None
+
+
+class CrudSniffer(mongodog.sniffer.Sniffer):
+    """Sniffer of DummyCrudCollection and DummyCommandCursor"""
+
+    config = [('collection_insert_many', DummyCrudCollection, 'insert_many'),
+              ('collection_bulk_write', DummyCrudCollection, 'bulk_write'),
+              ('collection_find_one_and_update', DummyCrudCollection, 'find_one_and_update'),
+              ('collection_count', DummyCrudCollection, 'count'),
+              ('command_cursor_next', DummyCommandCursor, 'next'),
+              ('command_cursor_next', DummyCommandCursor, '__next__')]
+
+
+class TestCrudSniffer(unittest.TestCase):
+    """Unit tests for sniffing the pymongo 3.x+ CRUD API"""
+
+    def test_config_only_contains_methods_of_installed_pymongo(self):
+        """SNIFFER_CONFIG is picked at import time from the methods, that exist"""
+        for _, cls, method in mongodog.sniffer.SNIFFER_CONFIG:
+            self.assertTrue(hasattr(cls, method))
+        ops = set(entry[0] for entry in mongodog.sniffer.SNIFFER_CONFIG)
+        self.assertEqual(hasattr(pymongo.collection.Collection, 'insert_many'),
+                         'collection_insert_many' in ops)
+        self.assertEqual(hasattr(pymongo.collection.Collection, 'insert'),
+                         'collection_insert' in ops)
+
+    def test_insert_many_is_reported_with_batches(self):
+        """Sniffer reports number and size of documents of insert_many per batch"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = CrudSniffer(reporter, False, with_sizes=True)
+        sniffer.max_write_batch_size = 2
+        sniffer.start()
+        DummyCrudCollection().insert_many([{'a': 1}, {'a': 2}, {'a': 3}])
+        sniffer.stop()
+
+        command = reporter.reported_commands[0][0]
+        self.assertEqual(3, command['ndocs'])
+        self.assertEqual(36, command['nbytes_sent'])
+        self.assertEqual([{'kind': 'insert', 'ndocs': 2, 'nbytes_sent': 24},
+                          {'kind': 'insert', 'ndocs': 1, 'nbytes_sent': 12}], command['batches'])
+
+    def test_insert_many_counts_documents_of_generators(self):
+        """Sniffer does not consume generators passed to insert_many, it counts inserted ids"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = CrudSniffer(reporter, False, with_timing=True)
+        sniffer.start()
+        result = DummyCrudCollection().insert_many({'a': i} for i in range(4))
+        sniffer.stop()
+
+        self.assertEqual(4, len(result.inserted_ids))
+        command = reporter.reported_commands[0][0]
+        self.assertIsNone(command['documents'])
+        self.assertEqual(4, command['ndocs'])
+
+    def test_bulk_write_batches_follow_pymongo_grouping(self):
+        """Sniffer splits ordered bulk writes whenever the kind changes and groups unordered ones by kind"""
+        requests = [pymongo.operations.InsertOne({'a': 1}),
+                    pymongo.operations.UpdateOne({'a': 1}, {'$set': {'b': 1}}),
+                    pymongo.operations.InsertOne({'a': 2}),
+                    pymongo.operations.DeleteOne({'a': 2})]
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = CrudSniffer(reporter, False)
+        sniffer.start()
+        DummyCrudCollection().bulk_write(requests)
+        DummyCrudCollection().bulk_write(requests, ordered=False)
+        sniffer.stop()
+
+        ordered = reporter.reported_commands[0][0]
+        self.assertEqual(4, ordered['ndocs'])
+        self.assertEqual(['insert', 'update', 'insert', 'delete'],
+                         [batch['kind'] for batch in ordered['batches']])
+        self.assertEqual({'type': 'UpdateOne', 'filter': {'a': 1}, 'document': {'$set': {'b': 1}},
+                          'upsert': False}, ordered['requests'][1])
+        unordered = reporter.reported_commands[1][0]
+        self.assertEqual([{'kind': 'insert', 'ndocs': 2}, {'kind': 'update', 'ndocs': 1},
+                          {'kind': 'delete', 'ndocs': 1}], unordered['batches'])
+
+    def test_batches_do_not_change_the_command_shape(self):
+        """Commands of bulk writes with different numbers of documents have the same shape"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = CrudSniffer(reporter, False, with_sizes=True)
+        sniffer.start()
+        DummyCrudCollection().insert_many([{'a': 1}])
+        DummyCrudCollection().insert_many([{'a': 1}, {'a': 2}])
+        sniffer.stop()
+
+        shapes = set(mongodog.utils.get_command_shape(command)
+                     for command, _ in reporter.reported_commands)
+        self.assertEqual(1, len(shapes))
+
+    def test_sessions_are_not_copied_into_commands(self):
+        """Sniffer reports calls with sessions (which cannot be deep-copied) without them"""
+        session = threading.Lock()
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffers = [mongodog.sniffer.Sniffer(reporter, False, ops=['collection_find']),
+                    CrudSniffer(reporter, False, with_timing=True),
+                    FindSniffer(reporter, False, ops=['collection_find_one'])]
+        for sniffer in sniffers:
+            sniffer.start()
+        try:
+            pymongo.MongoClient('mongodb://localhost:1', connect=False)['test']['foo'].find(
+                {'a': 1}, {'b': 1}, session=session)
+            DummyCrudCollection().count({'a': 2}, session=session)
+            DummyCollection().find_one({'a': 3}, session=session)
+        finally:
+            for sniffer in sniffers:
+                sniffer.stop()
+
+        commands = [command for command, _ in reporter.reported_commands]
+        self.assertEqual(['collection_find', 'collection_count', 'collection_find_one'],
+                         [command['op'] for command in commands])
+        self.assertEqual({'a': 1}, commands[0][mongodog.sniffer.FIND_ARGUMENTS[0]])
+        self.assertEqual({'a': 2}, commands[1]['filter'])
+        self.assertEqual({'a': 3}, commands[2][mongodog.sniffer.FIND_ONE_ARGUMENTS[0]])
+        self.assertTrue(all('session' not in command for command in commands))
+
+    def test_find_one_and_update_annotates_result(self):
+        """Sniffer counts the document returned by find_one_and_update"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = CrudSniffer(reporter, False, with_timing=True)
+        sniffer.start()
+        DummyCrudCollection().find_one_and_update({'_id': 1}, {'$inc': {'n': 1}}, session=object())
+        sniffer.stop()
+
+        command = reporter.reported_commands[0][0]
+        self.assertEqual('collection_find_one_and_update', command['op'])
+        self.assertEqual(1, command['nreturned'])
+        self.assertNotIn('session', command)
+
+    def test_count_accepts_pymongo3_filter(self):
+        """Sniffer reports the filter of pymongo 3.x count calls"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = CrudSniffer(reporter, False)
+        sniffer.start()
+        DummyCrudCollection().count({'a': 1})
+        DummyCrudCollection().count()
+        sniffer.stop()
+
+        self.assertEqual({'a': 1}, reporter.reported_commands[0][0]['filter'])
+        self.assertNotIn('filter', reporter.reported_commands[1][0])
+
+    def test_sniffer_reports_documents_fetched_by_exhausted_command_cursor(self):
+        """Sniffer with sizes reports documents fetched by command cursors, once exhausted"""
+        reporter = mongodog.reporters.MemoryReporter()
+        sniffer = CrudSniffer(reporter, False, with_sizes=True)
+        sniffer.start()
+        documents = list(DummyCommandCursor([{'a': 1}, {'a': 2}]))
+        sniffer.stop()
+
+        self.assertEqual(2, len(documents))
+        command = reporter.reported_commands[0][0]
+        self.assertEqual('command_cursor_next', command['op'])
+        self.assertEqual(('test', 'dummy'), (command['db'], command['collection']))
+        self.assertEqual(2, command['nreturned'])
+        self.assertEqual(24, command['nbytes'])
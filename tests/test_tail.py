@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog tail-based sampling"""
+import unittest
+
+import mongodog.scope
+import mongodog.tail
+from mongodog.reporters import MemoryReporter
+
+
+def dummy_command(duration=0.01, **fields):
+    """Returns a timed command"""
+    command = {'op': 'collection_find_one', 'db': 'test', 'collection': 'foo', 'spec_or_id': 1,
+               'started': 1.0, 'duration': duration}
+    command.update(fields)
+    return command
+
+
+class TestTailSamplingReporter(unittest.TestCase):
+    """Unit tests for TailSamplingReporter class"""
+
+    def setUp(self):
+        self.memory = MemoryReporter()
+        self.reporter = mongodog.tail.TailSamplingReporter(self.memory, min_duration=0.1, max_records=3)
+
+    def tearDown(self):
+        del mongodog.scope.active_scopes()[:]
+
+    def test_fast_scopes_are_discarded(self):
+        """TailSamplingReporter discards commands of fast scopes"""
+        with self.reporter.scope('fast') as scope:
+            self.reporter.report_mongo_command(dummy_command(), 'tb')
+
+        self.assertEqual([], self.memory.reported_commands)
+        self.assertEqual(1, scope.queries)
+        self.assertEqual(1, self.reporter.discarded)
+
+    def test_slow_scopes_are_forwarded_in_full(self):
+        """TailSamplingReporter forwards all buffered commands of slow scopes"""
+        with self.reporter.scope('slow'):
+            self.reporter.report_mongo_command(dummy_command(0.05, spec_or_id=1), 'tb1')
+            self.reporter.report_mongo_command(dummy_command(0.06, spec_or_id=2), 'tb2')
+
+        self.assertEqual([(1, 'tb1'), (2, 'tb2')],
+                         [(command['spec_or_id'], tb) for command, tb in self.memory.reported_commands])
+        self.assertEqual(dummy_command(0.05), self.memory.reported_commands[0][0])
+        self.assertEqual(1, self.reporter.kept)
+
+    def test_failed_scopes_are_forwarded(self):
+        """TailSamplingReporter forwards commands of scopes with errors or exceptions"""
+        with self.reporter.scope('error'):
+            self.reporter.report_mongo_command(dummy_command(error='ValueError()'))
+        try:
+            with self.reporter.scope('exception'):
+                self.reporter.report_mongo_command(dummy_command())
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(2, len(self.memory.reported_commands))
+
+    def test_scope_is_closed_on_base_exceptions(self):
+        """TailSamplingReporter closes the scope as failed also on exceptions, that do not derive from Exception"""
+        try:
+            with self.reporter.scope('interrupted') as scope:
+                self.reporter.report_mongo_command(dummy_command())
+                raise KeyboardInterrupt()
+        except KeyboardInterrupt:
+            pass
+        self.reporter.report_mongo_command(dummy_command())
+
+        self.assertEqual([], mongodog.scope.active_scopes())
+        self.assertTrue(scope.failed)
+        self.assertEqual(1, scope.queries)
+        self.assertEqual(2, len(self.memory.reported_commands))
+
+    def test_buffer_is_bounded(self):
+        """TailSamplingReporter buffers at most max_records commands per scope"""
+        with self.reporter.scope('slow') as scope:
+            for _ in range(5):
+                self.reporter.report_mongo_command(dummy_command(0.1))
+
+        self.assertEqual(3, len(self.memory.reported_commands))
+        self.assertEqual(2, scope.dropped)
+        self.assertEqual(5, scope.queries)
+
+    def test_commands_go_to_the_outermost_tail_scope(self):
+        """TailSamplingReporter buffers commands of nested scopes in the outermost tail scope"""
+        with self.reporter.scope('outer'):
+            with self.reporter.scope('inner'):
+                self.reporter.report_mongo_command(dummy_command(0.2))
+            self.assertEqual([], self.memory.reported_commands)
+
+        self.assertEqual(1, len(self.memory.reported_commands))
+
+    def test_unscoped_commands_are_forwarded(self):
+        """TailSamplingReporter forwards commands outside of tail scopes, unless told otherwise"""
+        self.reporter.report_mongo_command(dummy_command())
+        mongodog.tail.TailSamplingReporter(self.memory, forward_unscoped=False).report_mongo_command(dummy_command())
+
+        self.assertEqual(1, len(self.memory.reported_commands))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog test helpers"""
+import unittest
+
+import mongodog
+import mongodog.sniffer
+from dummies import DummyCollection, FindSniffer
+
+
+ORIGINAL_FIND = DummyCollection.__dict__['find']
+
+
+class TestAssertMaxQueries(unittest.TestCase):
+    """Unit tests for assert_max_queries"""
+
+    def test_passes_when_within_the_limit(self):
+        """assert_max_queries does not fail, when the limit is not exceeded"""
+        with mongodog.assert_max_queries(2, sniffer_class=FindSniffer) as counter:
+            DummyCollection('users').find({'a': 1})
+            DummyCollection('users').find({'a': 2})
+        self.assertEqual(2, counter.queries)
+
+    def test_fails_with_shapes_and_call_sites_when_over_the_limit(self):
+        """assert_max_queries fails listing the offending shapes and call sites"""
+        def dummy_n_plus_one():
+            for i in range(3):
+                DummyCollection('users').find({'a': i})
+
+        try:
+            with mongodog.assert_max_queries(1, sniffer_class=FindSniffer):
+                dummy_n_plus_one()
+        except AssertionError as error:
+            message = str(error)
+        else:
+            self.fail('AssertionError not raised')
+
+        self.assertIn('Expected at most 1 queries, but 3 were issued', message)
+        self.assertIn('3 x collection_find test.users {', message)
+        self.assertIn('%s:{a:int}' % mongodog.sniffer.FIND_ARGUMENTS[0], message)
+        self.assertIn('in dummy_n_plus_one', message)
+
+    def test_counts_only_matching_collections(self):
+        """assert_max_queries counts only commands on the given collection"""
+        with mongodog.assert_max_queries(1, collection='users', sniffer_class=FindSniffer):
+            DummyCollection('users').find()
+            DummyCollection('groups').find()
+            DummyCollection('groups').find()
+
+    def test_works_as_a_decorator(self):
+        """assert_max_queries can decorate functions"""
+        @mongodog.assert_max_queries(0, ops='collection_find', sniffer_class=FindSniffer)
+        def dummy():
+            DummyCollection('users').find()
+
+        self.assertRaises(AssertionError, dummy)
+        self.assertIs(ORIGINAL_FIND, DummyCollection.__dict__['find'])
+
+    def test_counts_only_outermost_calls(self):
+        """assert_max_queries counts find_one once, not also the find and the iteration behind it"""
+        with mongodog.assert_max_queries(1, sniffer_class=FindSniffer) as counter:
+            DummyCollection('users').find_one({'a': 1})
+        self.assertEqual(1, counter.queries)
+
+        with mongodog.assert_max_queries(1, sniffer_class=FindSniffer) as counter:
+            list(DummyCollection('users').find({'a': 1}))
+        self.assertEqual(1, counter.queries)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog trace event reporter"""
+try:
+    # python2
+    import StringIO as io
+except ImportError:
+    # python3
+    import io
+import json
+import threading
+import unittest
+
+import mongodog.tracing
+import mongodog.utils
+
+
+class TestTraceEventReporter(unittest.TestCase):
+    """Unit tests for TraceEventReporter class"""
+
+    def test_writes_complete_events_as_json_array(self):
+        """TraceEventReporter writes commands as complete trace events"""
+        def dummy_trace_caller():
+            return mongodog.utils.get_full_traceback()
+
+        output = io.StringIO()
+        reporter = mongodog.tracing.TraceEventReporter(output)
+        reporter.report_mongo_command(
+            {'op': 'collection_find', 'db': 'test', 'collection': 'foo',
+             'started': 10.5, 'duration': 0.25}, dummy_trace_caller())
+        reporter.close()
+
+        events = json.loads(output.getvalue())
+        self.assertEqual(['M', 'X'], [event['ph'] for event in events])
+        event = events[1]
+        self.assertEqual('collection_find', event['name'])
+        self.assertEqual(10500000, event['ts'])
+        self.assertEqual(250000, event['dur'])
+        self.assertEqual(threading.current_thread().ident, event['tid'])
+        self.assertEqual('foo', event['args']['collection'])
+        self.assertTrue(event['args']['stack'][-1].startswith('dummy_trace_caller'))
+
+    def test_buffers_events_until_buffer_is_full(self):
+        """TraceEventReporter writes events only when the buffer is full"""
+        output = io.StringIO()
+        reporter = mongodog.tracing.TraceEventReporter(output, buffer_size=3)
+        reporter.report_mongo_command({'op': 'collection_count', 'started': 1, 'duration': 0})
+        self.assertEqual('', output.getvalue())
+        reporter.report_mongo_command({'op': 'collection_count', 'started': 2, 'duration': 0})
+        self.assertNotEqual('', output.getvalue())
+        self.assertEqual([], reporter.buffer)
+
+        reporter.report_mongo_command({'op': 'collection_count', 'started': 3, 'duration': 0})
+        reporter.close()
+        self.assertEqual(4, len(json.loads(output.getvalue())))
+
+    def test_drops_events_reported_after_close(self):
+        """TraceEventReporter neither buffers nor writes events reported after close"""
+        output = io.StringIO()
+        reporter = mongodog.tracing.TraceEventReporter(output, buffer_size=1)
+        reporter.report_mongo_command({'op': 'collection_count', 'started': 1, 'duration': 0})
+        reporter.close()
+        written = output.getvalue()
+
+        reporter.report_mongo_command({'op': 'collection_count', 'started': 2, 'duration': 0})
+        self.assertEqual([], reporter.buffer)
+        self.assertEqual(1, reporter.dropped)
+        self.assertEqual(written, output.getvalue())
+
+    def test_empty_trace_is_valid_json(self):
+        """TraceEventReporter writes an empty array, when nothing was reported"""
+        output = io.StringIO()
+        reporter = mongodog.tracing.TraceEventReporter(output)
+        reporter.close()
+        self.assertEqual([], json.loads(output.getvalue()))
@@ -31,3 +31,50 @@ class TestGetTraceback(unittest.TestCase):
 
         last_frame = tb[-1]
         self.assertTrue(last_frame[3].find("dummy_wrapper()") != -1)
+
+
+class TestGetCallSite(unittest.TestCase):
+    """Tests for the function get_call_site"""
+
+    def test_call_site_is_the_innermost_application_frame(self):
+        """Call site is the innermost frame outside of mongodog"""
+        def dummy_call_site():
+            return mongodog.utils.get_full_traceback()
+
+        call_site = mongodog.utils.get_call_site(dummy_call_site())
+        self.assertEqual(__file__.rstrip('c'), call_site[0].rstrip('c'))
+        self.assertEqual('dummy_call_site', call_site[2])
+
+    def test_no_traceback_has_no_call_site(self):
+        """Call site of no traceback is None"""
+        self.assertIsNone(mongodog.utils.get_call_site(None))
+
+
+class TestGetCommandShape(unittest.TestCase):
+    """Tests for the function get_command_shape"""
+
+    def test_commands_differing_only_in_values_have_same_shape(self):
+        """Values, list lengths and timing fields do not affect the shape"""
+        shape1 = mongodog.utils.get_command_shape(
+            {'op': 'collection_find', 'db': 'd', 'collection': 'c',
+             'spec': {'a': {'$in': [1, 2, 3]}}, 'duration': 0.1})
+        shape2 = mongodog.utils.get_command_shape(
+            {'op': 'collection_find', 'db': 'd', 'collection': 'c',
+             'spec': {'a': {'$in': [4]}}})
+        self.assertEqual(shape1, shape2)
+        self.assertEqual('collection_find d.c {spec:{a:{$in:[int]}}}', shape1)
+
+    def test_annotations_do_not_affect_the_shape(self):
+        """Result annotations and capture thread do not affect the shape"""
+        shape1 = mongodog.utils.get_command_shape({'op': 'collection_find', 'spec': {'a': 1}})
+        shape2 = mongodog.utils.get_command_shape({'op': 'collection_find', 'spec': {'a': 1}, 'nreturned': 1,
+                                                   'nbytes': 10, 'thread': 1})
+        self.assertEqual(shape1, shape2)
+
+    def test_commands_differing_in_keys_have_different_shapes(self):
+        """Keys and types affect the shape"""
+        shape1 = mongodog.utils.get_command_shape({'op': 'collection_find', 'spec': {'a': 1}})
+        shape2 = mongodog.utils.get_command_shape({'op': 'collection_find', 'spec': {'b': 1}})
+        shape3 = mongodog.utils.get_command_shape({'op': 'collection_find', 'spec': {'a': 'x'}})
+        self.assertNotEqual(shape1, shape2)
+        self.assertNotEqual(shape1, shape3)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for mongodog WSGI middleware"""
+import logging
+import unittest
+
+import mongodog.scope
+import mongodog.sniffer
+import mongodog.wsgi
+
+
+class CapturingHandler(logging.Handler):
+    """Logging handler, that keeps all records"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestMongoBudgetMiddleware(unittest.TestCase):
+    """Unit tests for MongoBudgetMiddleware class"""
+
+    def dummy(self, *args, **kwargs):
+        self.calls.append(args)
+
+    def outer_dummy(self, *args, **kwargs):
+        self.dummy('inner')
+        self.dummy('inner')
+
+    def app(self, environ, start_response):
+        for i in range(self.queries):
+            self.dummy(i)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    def start_response(self, status, headers, exc_info=None):
+        self.response = status, headers
+
+    def setUp(self):
+        self.calls = []
+        self.queries = 3
+        self.response = None
+        self.handler = CapturingHandler()
+        self.logger = logging.getLogger('mongodog.tests.wsgi')
+        self.logger.handlers = [self.handler]
+        self.logger.propagate = False
+
+        class DummySniffer(mongodog.sniffer.Sniffer):
+            config = [('dummy', TestMongoBudgetMiddleware, 'dummy'),
+                      ('outer_dummy', TestMongoBudgetMiddleware, 'outer_dummy')]
+
+        self.sniffer = DummySniffer(mongodog.scope.ScopeReporter(),
+                                    condition=mongodog.scope.has_active_scope)
+
+    def tearDown(self):
+        self.sniffer.stop()
+
+    def request(self, middleware):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/foo'}
+        result = middleware(environ, self.start_response)
+        body = b''.join(result)
+        result.close()
+        return environ, body
+
+    def test_counts_queries_into_headers_and_environ(self):
+        """MongoBudgetMiddleware adds query counts to response headers and the environ"""
+        middleware = mongodog.wsgi.MongoBudgetMiddleware(self.app, logger=self.logger, sniffer=self.sniffer)
+        environ, body = self.request(middleware)
+
+        self.assertEqual(b'ok', body)
+        self.assertIn(('X-Mongodog-Queries', '3'), self.response[1])
+        self.assertEqual(3, environ['mongodog.scope'].queries)
+        self.assertEqual([], self.handler.records)
+        self.assertFalse(mongodog.scope.has_active_scope())
+
+    def test_counts_only_outermost_calls(self):
+        """MongoBudgetMiddleware does not count calls made within other sniffed calls"""
+        def app(environ, start_response):
+            self.outer_dummy()
+            start_response('200 OK', [])
+            return [b'ok']
+
+        middleware = mongodog.wsgi.MongoBudgetMiddleware(app, max_queries=1, logger=self.logger,
+                                                         sniffer=self.sniffer)
+        environ, _ = self.request(middleware)
+
+        self.assertEqual(2, len(self.calls))
+        self.assertIn(('X-Mongodog-Queries', '1'), self.response[1])
+        self.assertEqual(1, environ['mongodog.scope'].queries)
+        self.assertEqual([], self.handler.records)
+
+    def test_warns_when_request_goes_over_budget(self):
+        """MongoBudgetMiddleware logs a warning with call sites, when the request goes over budget"""
+        middleware = mongodog.wsgi.MongoBudgetMiddleware(
+            self.app, max_queries=2, logger=self.logger, sniffer=self.sniffer)
+        self.request(middleware)
+
+        self.assertEqual(1, len(self.handler.records))
+        record = self.handler.records[0]
+        self.assertEqual(logging.WARNING, record.levelno)
+        self.assertEqual('GET /foo', record.mongodog['name'])
+        self.assertEqual(3, record.mongodog['queries'])
+        self.assertIn('in app', record.getMessage())
+
+    def test_scope_is_closed_when_app_raises_base_exception(self):
+        """MongoBudgetMiddleware closes the scope also on exceptions, that do not derive from Exception"""
+        def app(environ, start_response):
+            self.dummy()
+            raise KeyboardInterrupt()
+
+        middleware = mongodog.wsgi.MongoBudgetMiddleware(app, logger=self.logger, sniffer=self.sniffer)
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/foo'}
+        self.assertRaises(KeyboardInterrupt, middleware, environ, self.start_response)
+
+        self.assertFalse(mongodog.scope.has_active_scope())
+        self.assertEqual(1, environ['mongodog.scope'].queries)
+
+    def test_unsampled_requests_are_not_sniffed(self):
+        """MongoBudgetMiddleware does not sniff requests, that were not sampled"""
+        middleware = mongodog.wsgi.MongoBudgetMiddleware(
+            self.app, sample_rate=0.0, logger=self.logger, sniffer=self.sniffer)
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/foo'}
+        middleware(environ, self.start_response)
+
+        self.assertNotIn('mongodog.scope', environ)
+        self.assertEqual(3, len(self.calls))
+        self.assertEqual([('Content-Type', 'text/plain')], self.response[1])